@@ -0,0 +1,76 @@
+import base64
+import io
+import json
+from pathlib import Path
+
+import nbformat
+import pytest
+
+import urnc
+from urnc.budget import analyze_notebook, categorize
+from urnc.nbstream import iter_events, iter_tokens
+
+
+def example_notebook() -> nbformat.NotebookNode:
+    code = nbformat.v4.new_code_cell("print('ä')\nplot()")
+    code.outputs = [
+        nbformat.v4.new_output("stream", name="stdout", text="ä\n" * 100),
+        nbformat.v4.new_output(
+            "display_data",
+            data={"image/png": base64.b64encode(bytes(3000)).decode(), "text/plain": "<Figure>"},
+        ),
+    ]
+    md = nbformat.v4.new_markdown_cell("![a](attachment:a.png)")
+    md.attachments = {"a.png": {"image/png": base64.b64encode(bytes(1000)).decode()}}
+    return nbformat.v4.new_notebook(cells=[code, md])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_iter_tokens(chunk_size: int):
+    raw = nbformat.writes(example_notebook()).encode()
+    tokens = list(iter_tokens(io.BytesIO(raw), chunk_size))
+    assert sum(t[2] for t in tokens) == len(raw.rstrip())
+    assert json.loads(b"".join(t[1] for t in tokens)) == json.loads(raw)
+
+
+def test_iter_events():
+    raw = b'{"a": [1, {"b": "x"}], "c": {}}'
+    events = [(tuple(p), t[0]) for p, t in iter_events(io.BytesIO(raw))]
+    assert (("a", 1, "b"), "string") in events
+    assert events[-1] == ((), "}")
+
+
+def test_categorize():
+    assert categorize(["metadata", "kernelspec"]) == "metadata"
+    assert categorize(["cells", 0, "source", 1]) == "source"
+    assert categorize(["cells", 0, "outputs", 0, "text"]) == "text_outputs"
+    assert categorize(["cells", 0, "outputs", 0, "data", "image/png"]) == "rich_outputs"
+    assert categorize(["cells", 0, "outputs", 0, "data", "text/plain"]) == "text_outputs"
+    assert categorize(["cells", 0, "attachments", "a.png"]) == "attachments"
+
+
+def test_analyze_notebook(tmp_path: Path):
+    path = tmp_path / "nb.ipynb"
+    nbformat.write(example_notebook(), path)
+    result = analyze_notebook(path)
+    assert result.total == path.stat().st_size
+    assert sum(result.sizes.values()) == result.total
+    assert result.sizes["rich_outputs"] > 4000
+    assert result.sizes["text_outputs"] > 300
+    assert 1300 < result.sizes["attachments"] < 1500
+    assert result.largest_category() == "rich_outputs"
+
+
+def test_check_budgets(tmp_path: Path):
+    nbformat.write(example_notebook(), tmp_path / "big.ipynb")
+    nbformat.write(nbformat.v4.new_notebook(), tmp_path / "small.ipynb")
+    config = urnc.config.default_config(tmp_path)
+    results = urnc.budget.check_budgets(config, tmp_path)
+    assert [r.path.name for r in results] == ["big.ipynb", "small.ipynb"]
+
+    config["check"]["notebook_budget"] = "4 KiB"
+    with pytest.raises(Exception, match="1 size budget"):
+        urnc.budget.check_budgets(config, tmp_path)
+    config["check"]["total_budget"] = "1 KiB"
+    with pytest.raises(Exception, match="2 size budget"):
+        urnc.budget.check_budgets(config, tmp_path)
@@ -1,4 +1,5 @@
 import copy
+import shutil
 import pathlib
 
 import click
@@ -101,3 +102,74 @@ def test_write_gitignore(tmp_path: pathlib.Path):
     with pytest.raises(Exception, match="config.git.exclude must be a list"):
         urnc.ci.write_gitignore(None, student_gitignore, config)
 
+
+
+def test_ci_shard_merge(tmp_path: pathlib.Path):
+    admin_path = tmp_path / "example-course-admin"
+    student_path = tmp_path / "example-course"
+    student_url = tmp_path / "example-course.git"
+    urnc.init.init("Example Course", admin_path, tmp_path / "example-course-admin.git", student_url,
+                   template="full")
+    bundle_dir = tmp_path / "bundles"
+    config = urnc.config.read_config(admin_path)
+    config["convert"]["write_mode"] = "overwrite"
+    config["ci"]["commit"] = True
+
+    bundles = [urnc.ci.ci_shard(copy.deepcopy(config), (i, 2), bundle_dir) for i in (1, 2)]
+    notebooks = [urnc.shard.read_manifest(bundle)["notebooks"] for bundle in bundles]
+    assert sorted(notebooks[0] + notebooks[1]) == [
+        "assignments/week1.ipynb", "lectures/week1/lecture1.ipynb", "lectures/week1/lecture2.ipynb"
+    ]
+    assert not admin_path.joinpath("out").exists()
+
+    bundles[1].unlink()
+    with pytest.raises(Exception, match="missing \\[2\\]"):
+        urnc.ci.ci_merge(copy.deepcopy(config), bundle_dir)
+    urnc.ci.ci_shard(copy.deepcopy(config), (2, 2), bundle_dir)
+    urnc.ci.ci_merge(copy.deepcopy(config), bundle_dir)
+    urnc.pull.pull(str(student_url), str(student_path), "main", 1)
+
+    for notebook in notebooks[0] + notebooks[1]:
+        admin_nb = nbformat.read(admin_path / notebook, as_version=4)
+        student_nb = nbformat.read(student_path / notebook, as_version=4)
+        assert student_nb != admin_nb
+    assert not (student_path / "config.yaml").exists()
+
+
+def test_ci_incremental(tmp_path: pathlib.Path, caplog: pytest.LogCaptureFixture):
+    admin_path = tmp_path / "example-course-admin"
+    student_url = tmp_path / "example-course.git"
+    urnc.init.init("Example Course", admin_path, tmp_path / "example-course-admin.git", student_url,
+                   template="full")
+    config = urnc.config.read_config(admin_path)
+    config["convert"]["write_mode"] = "overwrite"
+    config["ci"]["commit"] = True
+    admin_repo = git.Repo(admin_path)
+    student_repo = git.Repo(student_url)
+
+    urnc.ci.ci(copy.deepcopy(config))
+    trailers = urnc.ci.read_trailers(student_repo.head.commit.message)
+    assert trailers[urnc.ci.SOURCE_TRAILER] == admin_repo.head.commit.hexsha
+
+    lecture = admin_path / "lectures" / "week1" / "lecture1.ipynb"
+    nb = nbformat.read(lecture, as_version=4)
+    nb.cells.append(nbformat.v4.new_code_cell("### Solution\nx = 1"))
+    nbformat.write(nb, lecture)
+    shutil.copy(admin_path / "assignments" / "week1.ipynb", admin_path / "assignments" / "week2.ipynb")
+    admin_repo.index.remove(["lectures/week1/lecture2.ipynb"], working_tree=True)
+    admin_repo.git.add(all=True)
+    admin_repo.index.commit("Update course")
+
+    urnc.ci.ci(copy.deepcopy(config), incremental=True)
+    assert "Updating student repo incrementally: 3 files changed" in caplog.text
+    assert "2 notebooks converted" in caplog.text
+    incremental = student_repo.head.commit
+    names = [item.path for item in incremental.tree.traverse()]
+    assert "assignments/week2.ipynb" in names
+    assert "lectures/week1/lecture2.ipynb" not in names
+    assert urnc.ci.read_trailers(incremental.message)[urnc.ci.SOURCE_TRAILER] == admin_repo.head.commit.hexsha
+
+    # A full rebuild produces the same student version. Unknown commits fall back to it.
+    urnc.ci.ci(copy.deepcopy(config), since="0" * 40)
+    assert "Falling back to a full rebuild" in caplog.text
+    assert student_repo.head.commit.tree.hexsha == incremental.tree.hexsha
@@ -0,0 +1,114 @@
+import base64
+import io
+import json
+import random
+from pathlib import Path
+
+import nbformat
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output, new_raw_cell
+
+import urnc
+from urnc.clear import UnsupportedNotebook, clear_file, is_clear, stream_clear
+from urnc.config import TargetType, WriteMode
+from urnc.convert import convert, convert_target
+
+
+def example_notebook() -> nbformat.NotebookNode:
+    rng = random.Random(42)
+    image = base64.b64encode(bytes(rng.randrange(256) for _ in range(50000))).decode()
+    nb = new_notebook(metadata={"kernelspec": {"name": "python3", "display_name": "Python 3"},
+                                "title": "Übung"})
+    nb.cells = [
+        new_markdown_cell("# Tïtle\n\nSome text", attachments={"a.png": {"image/png": image[:100]}}),
+        new_code_cell("print('x')\n1 + 1", execution_count=3, metadata={"trusted": True, "tags": ["a"]},
+                      outputs=[new_output("stream", name="stdout", text="x\n" * 10),
+                               new_output("display_data", data={"image/png": image, "text/plain": "<Figure>"}),
+                               new_output("execute_result", data={"text/plain": "2"}, execution_count=3)]),
+        new_raw_cell("raw\n"),
+        new_code_cell(""),
+    ]
+    return nb
+
+
+def regular_clear(path: Path) -> str:
+    config = urnc.config.default_config(Path("."))
+    return convert_target(path, None, TargetType.CLEAR, config)[0][0]
+
+
+def stream(path: Path, chunk_size: int = 1 << 20) -> str:
+    out = io.StringIO()
+    with open(path, "rb") as f:
+        stream_clear(f, out, chunk_size)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("minor", [4, 5])
+def test_stream_clear(tmp_path: Path, minor: int):
+    nb = example_notebook()
+    data = json.loads(nbformat.writes(nb))
+    data["nbformat_minor"] = minor
+    if minor < 5:
+        for cell in data["cells"]:
+            del cell["id"]
+    path = tmp_path / "nb.ipynb"
+    path.write_text(json.dumps(data), encoding="utf-8")  # compact, unsorted keys
+    expected = regular_clear(path)
+    for chunk_size in [1 << 20, 64, 7]:
+        assert stream(path, chunk_size) == expected
+
+
+def test_stream_clear_empty(tmp_path: Path):
+    path = tmp_path / "nb.ipynb"
+    nbformat.write(new_notebook(), path)
+    assert stream(path) == regular_clear(path)
+
+
+def test_clear_file_fallback(tmp_path: Path):
+    # Missing cell ids are generated randomly by nbformat
+    data = json.loads(nbformat.writes(example_notebook()))
+    del data["cells"][1]["id"]
+    path = tmp_path / "nb.ipynb"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    with pytest.raises(UnsupportedNotebook):
+        stream(path)
+    assert not clear_file(path, tmp_path / "out.ipynb")
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_convert_clear(tmp_path: Path):
+    paths = [tmp_path / "a.ipynb", tmp_path / "b.ipynb"]
+    nbformat.write(example_notebook(), paths[0])
+    data = json.loads(nbformat.writes(example_notebook()))
+    del data["cells"][0]["id"]
+    paths[1].write_text(json.dumps(data), encoding="utf-8")
+    expected = [regular_clear(path) for path in paths]
+
+    config = urnc.config.default_config(tmp_path)
+    config["convert"]["write_mode"] = WriteMode.OVERWRITE
+    convert(config, tmp_path, [{"type": TargetType.CLEAR, "path": "{nb.relpath}"}])
+    # b.ipynb is converted regularly and gets a random cell id
+    assert paths[0].read_text(encoding="utf-8") == expected[0]
+    cleared = nbformat.read(paths[1], as_version=4)
+    assert all(cell.get("outputs", []) == [] for cell in cleared.cells)
+
+
+def test_is_clear(tmp_path: Path):
+    path = tmp_path / "nb.ipynb"
+    nbformat.write(example_notebook(), path)
+    assert not is_clear(path)
+    path.write_text(regular_clear(path), encoding="utf-8")
+    assert is_clear(path)
+
+
+def test_check_clear_unchanged(tmp_path: Path):
+    dirty, clean = tmp_path / "dirty.ipynb", tmp_path / "clean.ipynb"
+    nbformat.write(example_notebook(), dirty)
+    clean.write_text(regular_clear(dirty), encoding="utf-8")
+    mtime = clean.stat().st_mtime_ns
+    config = urnc.config.default_config(tmp_path)
+    config["convert"]["write_mode"] = WriteMode.OVERWRITE
+    for type in [TargetType.CLEAR, TargetType.FIX]:
+        convert(config, tmp_path, [{"type": type, "path": "{nb.relpath}"}])
+        assert is_clear(dirty)
+        assert clean.stat().st_mtime_ns == mtime
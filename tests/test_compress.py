@@ -0,0 +1,58 @@
+import random
+from pathlib import Path
+
+import pytest
+
+import urnc
+from urnc.compress import compress_image, find_images
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def noisy_image(path: Path, size: int = 256):
+    rng = random.Random(42)
+    data = bytes(rng.randrange(256) for _ in range(size * size * 3))
+    Image.frombytes("RGB", (size, size), data).save(path)
+
+
+def test_compress_image(tmp_path: Path):
+    img_path = tmp_path / "noise.png"
+    noisy_image(img_path)
+    original_size = img_path.stat().st_size
+    max_size = 20 * 1024
+    assert original_size > max_size
+
+    cache_dir = tmp_path / "cache"
+    assert compress_image(img_path, max_size, cache_dir)
+    assert img_path.stat().st_size <= max_size
+    with Image.open(img_path) as img:
+        assert img.format == "PNG"
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # Already small enough. Nothing should happen.
+    assert not compress_image(img_path, max_size, cache_dir)
+
+
+def test_compress_cached(tmp_path: Path):
+    max_size = 20 * 1024
+    cache_dir = tmp_path / "cache"
+    for name in ["a.jpg", "b.jpg"]:
+        noisy_image(tmp_path / name)
+    assert compress_image(tmp_path / "a.jpg", max_size, cache_dir)
+    cached = next(cache_dir.iterdir())
+    cached.write_bytes(b"cached")
+    assert compress_image(tmp_path / "b.jpg", max_size, cache_dir)
+    assert (tmp_path / "b.jpg").read_bytes() == b"cached"
+
+
+def test_compress_images(tmp_path: Path):
+    (tmp_path / ".hidden").mkdir()
+    noisy_image(tmp_path / ".hidden" / "skip.png")
+    noisy_image(tmp_path / "big.png")
+    noisy_image(tmp_path / "small.png", size=8)
+    assert find_images(tmp_path, 1024) == [tmp_path / "big.png"]
+
+    config = urnc.config.default_config(tmp_path)
+    config["convert"]["images"]["max_size"] = "20 KiB"
+    config["convert"]["images"]["cache_dir"] = str(tmp_path / "cache")
+    assert urnc.compress.compress_images(tmp_path, config) == 1
@@ -1,5 +1,8 @@
-import urnc
+from concurrent.futures import ThreadPoolExecutor
+
 import nbformat
+import pytest
+import urnc
 
 def test_convert():
     # Init course containing solution cells
@@ -19,3 +22,36 @@ def test_convert():
         nb = nbformat.read(f, as_version=4)
     num_solution_cells = sum('## Solution' in (cell.source or '') for cell in nb.cells)
     assert num_solution_cells == 0
+
+
+def test_converter(tmp_path, monkeypatch):
+    urnc.init.init(name="Test Course", path=tmp_path / "course")
+    config = urnc.config.read_config(tmp_path / "course")
+    nb = nbformat.read(tmp_path / "course" / "example.ipynb", as_version=4)
+    expected = urnc.convert.convert_target(tmp_path / "course" / "example.ipynb", None, "student", config)[0][0]
+
+    converter = urnc.convert.Converter(config)
+    result = converter.convert(nb, "example.ipynb")
+    assert result.notebook == expected
+    assert any('## Solution' in cell.source for cell in nb.cells)
+    raw = nbformat.writes(nb).encode()
+    assert next(converter.convert_all([raw])).notebook == expected
+
+    # The converter can be shared by threads
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(converter.convert, [nb] * 8))
+    assert all(r.notebook == expected for r in results)
+
+    solution = urnc.convert.Converter(config, "solution").convert(nb, "example.ipynb")
+    assert solution.notebook == urnc.convert.convert_target(
+        tmp_path / "course" / "example.ipynb", None, "solution", config)[0][0]
+    assert solution.node().cells != result.node().cells
+    with pytest.raises(ValueError, match="execute"):
+        urnc.convert.Converter(config, "execute")
+
+    # Remote images are not requested in memory
+    requested = []
+    monkeypatch.setattr(urnc.preprocessor.image.requests, "head", lambda url, **kwargs: requested.append(url))
+    nb.cells.append(nbformat.v4.new_markdown_cell("![remote](https://example.com/image.png)"))
+    assert "https://example.com/image.png" in converter.convert(nb).notebook
+    assert requested == []
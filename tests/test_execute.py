@@ -1,8 +1,17 @@
+import asyncio
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+
 import nbformat
+import urnc
 from traitlets.config import Config
-from urnc.preprocessor.executor import ExecutePreprocessor
+from urnc.preprocessor.executor import ExecutePreprocessor, find_resume_index, is_complete_checkpoint
 from urnc.preprocessor.clear_tagged import ClearTaggedCells
 from urnc.preprocessor.check_outputs import CheckOutputs
+from urnc.timing import NotebookTiming, export_timing_report
 
 
 def test_execute_notebook():
@@ -61,3 +70,218 @@ def test_pipeline():
 
     assert checker.check_output(nb.cells[0])
     assert not checker.check_output(nb.cells[1])
+
+
+def test_truncate_outputs():
+    config = Config()
+    config.CheckOutputs.truncate = True
+    config.CheckOutputs.max_output_lines = 10
+    config.CheckOutputs.max_output_size = "1 KiB"
+    checker = CheckOutputs(config=config)
+    cell = nbformat.v4.new_code_cell("train()")
+    cell.outputs = [
+        nbformat.v4.new_output("stream", name="stdout", text=f"epoch {i}\n")
+        for i in range(100)
+    ] + [
+        nbformat.v4.new_output("stream", name="stderr", text="x" * 5000),
+    ]
+    nb = nbformat.v4.new_notebook(cells=[cell])
+    nb, _ = checker.preprocess(nb, {})
+
+    outputs = nb.cells[0].outputs
+    assert len(outputs) == 2
+    lines = outputs[0].text.splitlines()
+    assert lines[:5] == [f"epoch {i}" for i in range(5)]
+    assert lines[-5:] == [f"epoch {i}" for i in range(95, 100)]
+    assert "90 lines" in lines[5]
+    assert len(outputs[1].text) < 1200
+    assert "truncated" in outputs[1].text
+
+
+def test_kernel_pool(tmp_path):
+    config = Config()
+    config.ExecutePreprocessor.kernel_pool_size = 1
+    config.ExecutePreprocessor.warmup_code = "warm = 42"
+    executor = ExecutePreprocessor(config=config)
+    executor.start_kernel_pool(2)
+    tmp_path.joinpath("sub").mkdir()
+
+    def run(source, path):
+        nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source)])
+        resources = {"path": str(path), "filename": path.name}
+        nb, _ = executor.preprocess(nb, resources)
+        return nb.cells[0].outputs[0]["text"]
+
+    try:
+        first = run("leaked = 1\nprint(warm)", tmp_path.joinpath("a.ipynb"))
+        second = run("import os\nprint(warm, 'leaked' in dir(), os.getcwd())",
+                     tmp_path.joinpath("sub", "b.ipynb"))
+    finally:
+        executor.shutdown_kernel_pool()
+    assert first == "42\n"
+    assert second == f"42 False {tmp_path.joinpath('sub')}\n"
+    assert executor.kernel_pool is None
+
+
+def test_timing_report(tmp_path):
+    nb = nbformat.v4.new_notebook(cells=[
+        nbformat.v4.new_markdown_cell("# Title"),
+        nbformat.v4.new_code_cell("import time\ntime.sleep(0.2)"),
+        nbformat.v4.new_code_cell("print('done')"),
+    ])
+    nbformat.write(nb, tmp_path.joinpath("slow.ipynb"))
+    config = urnc.config.default_config(tmp_path)
+    config["execute"]["timing"]["export"] = "timing.json"
+
+    converted = urnc.convert.convert_target(tmp_path, "out/", "execute", config)
+
+    with open(tmp_path.joinpath("timing.json")) as f:
+        report = json.load(f)
+    assert len(report) == 1
+    assert report[0]["notebook"] == "slow.ipynb"
+    assert report[0]["startup"] > 0
+    assert [cell["index"] for cell in report[0]["cells"]] == [1, 2]
+    assert report[0]["cells"][0]["duration"] >= 0.2
+    assert report[0]["duration"] >= report[0]["startup"] + 0.2
+
+    executed = nbformat.reads(converted[0][0], as_version=4)
+    timings = [NotebookTiming(Path("slow.ipynb"), executed)]
+    export_timing_report(timings, tmp_path.joinpath("timing.csv"))
+    with open(tmp_path.joinpath("timing.csv")) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["notebook", "cell", "start", "end", "duration", "source"]
+    assert [row[1] for row in rows[1:]] == ["", "1", "2"]
+
+
+def test_execution_limits(tmp_path):
+    def write(name, sources, limits=None):
+        nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(s) for s in sources])
+        if limits:
+            nb.metadata["urnc"] = {"limits": limits}
+        nbformat.write(nb, tmp_path.joinpath(name))
+
+    write("a-cell.ipynb", ["while True: pass", "print('unreachable')"])
+    write("b-notebook.ipynb", ["import time", "time.sleep(1)", "time.sleep(1)", "time.sleep(60)"],
+          limits={"notebook_timeout": 1.5, "cell_timeout": None})
+    write("c-ok.ipynb", ["print('ok')"])
+    if sys.platform.startswith("linux"):
+        write("d-memory.ipynb", ["x = bytearray(512 * 1024 * 1024)\nimport time\ntime.sleep(10)"],
+              limits={"max_memory": "256 MiB"})
+    config = urnc.config.default_config(tmp_path)
+    config["execute"]["limits"]["cell_timeout"] = 2
+
+    converted = urnc.convert.convert_target(tmp_path, "out/", "execute", config)
+
+    results = {path.name: nbformat.reads(body, as_version=4) for body, path, _ in converted}
+    cell = results["a-cell-executed.ipynb"].cells[0]
+    assert cell.outputs[-1].ename == "LimitExceeded"
+    assert "Cell time limit of 2s" in cell.outputs[-1].evalue
+    cells = results["b-notebook-executed.ipynb"].cells
+    assert "Notebook time limit of 1.5s" in cells[2].outputs[-1].evalue
+    assert results["c-ok-executed.ipynb"].cells[0].outputs[0].text == "ok\n"
+    if sys.platform.startswith("linux"):
+        cell = results["d-memory-executed.ipynb"].cells[0]
+        assert "memory limit of 256 MiB" in cell.outputs[-1].evalue
+
+
+def test_limit_overrides():
+    executor = ExecutePreprocessor(cell_timeout=2, max_memory="1 GiB")
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["urnc"] = {"limits": {"cell_timeout": "30", "max_memory": 2000000000}}
+    assert executor.get_limits(nb) == {"notebook_timeout": None, "cell_timeout": 30.0,
+                                       "max_memory": "2000000000 B"}
+    # Invalid values are reported and the defaults are kept
+    nb.metadata["urnc"] = {"limits": {"cell_timeout": "soon", "max_memory": "lots", "notebook_timeout": [1]}}
+    assert executor.get_limits(nb) == {"notebook_timeout": None, "cell_timeout": 2, "max_memory": "1 GiB"}
+
+
+def test_async_execute(tmp_path):
+    executor = ExecutePreprocessor(progress_bar=False)
+    cwd = os.getcwd()
+    dirs = [tmp_path.joinpath(f"nb{i}") for i in range(3)]
+    notebooks = []
+    for d in dirs:
+        d.mkdir()
+        notebooks.append(nbformat.v4.new_notebook(cells=[
+            nbformat.v4.new_code_cell("import os, time\ntime.sleep(1)\nprint(os.getcwd())"),
+        ]))
+
+    async def run_all():
+        tasks = [executor.async_execute_notebook(nb, str(d)) for nb, d in zip(notebooks, dirs)]
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run_all())
+
+    assert os.getcwd() == cwd
+    for nb, d in zip(results, dirs):
+        assert nb.cells[0].outputs[0].text == f"{d}\n"
+    cells = [nb.cells[0].metadata.papermill for nb in results]
+    assert max(c["start_time"] for c in cells) < min(c["end_time"] for c in cells)
+
+
+def test_resume(tmp_path):
+    path = tmp_path.joinpath("nb.ipynb")
+    sources = ["import random\nx = random.random()\nprint(x)", "y = 2 * x", "assert False", "print(y == 2 * x)"]
+    nbformat.write(nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(s) for s in sources]), path)
+    config = urnc.config.default_config(tmp_path)
+    config["execute"]["checkpoints"] = True
+    config["execute"]["checkpoint_dir"] = str(tmp_path.joinpath("checkpoints"))
+    config["convert"]["write_mode"] = urnc.config.WriteMode.OVERWRITE
+
+    [(body, _, _)] = urnc.convert.convert_target(path, "out/", "execute", config)
+    failed = nbformat.reads(body, as_version=4)
+    assert failed.cells[2].outputs[-1].ename == "AssertionError"
+    assert len(list(tmp_path.joinpath("checkpoints").iterdir())) == 1
+
+    nb = urnc.util.read_notebook(path)
+    nb.cells[2].source = "z = 3"
+    nbformat.write(nb, path)
+    config["execute"]["resume"] = True
+    config["execute"]["timing"]["export"] = "timing.json"
+    [(body, _, _)] = urnc.convert.convert_target(path, "out/", "execute", config)
+    resumed = nbformat.reads(body, as_version=4)
+    # Earlier outputs are kept, the kernel state is rebuilt by replaying them
+    assert resumed.cells[0].outputs == failed.cells[0].outputs
+    assert resumed.cells[2].outputs == []
+    assert resumed.cells[3].outputs[0].text == "True\n"
+    # Replayed cells are not timed again
+    [report] = json.loads(tmp_path.joinpath("timing.json").read_text())
+    assert report["startup"] >= 0
+    assert [cell["start"] for cell in report["cells"][:2]] == [None, None]
+    assert [cell["duration"] for cell in report["cells"][:2]] == [0, 0]
+    assert report["cells"][2]["start"] >= report["start"]
+
+    # Complete checkpoints are reused without executing the notebook again
+    urnc.metrics.metrics.reset()
+    [(body, _, _)] = urnc.convert.convert_target(path, "out/", "execute", config)
+    assert nbformat.reads(body, as_version=4).cells == resumed.cells
+    assert urnc.metrics.metrics.get("urnc_notebooks", state="cached") == 1
+    assert urnc.metrics.metrics.get("urnc_notebooks", state="converted") == 0
+
+    # Removed cells are not taken from the checkpoint
+    nb = urnc.util.read_notebook(path)
+    del nb.cells[-1]
+    nbformat.write(nb, path)
+    urnc.metrics.metrics.reset()
+    [(body, _, _)] = urnc.convert.convert_target(path, "out/", "execute", config)
+    shortened = nbformat.reads(body, as_version=4)
+    assert [cell.source for cell in shortened.cells] == [cell.source for cell in nb.cells]
+    assert shortened.cells[0].outputs == resumed.cells[0].outputs
+    assert urnc.metrics.metrics.get("urnc_notebooks", state="cached") == 0
+    urnc.metrics.metrics.reset()
+
+
+def test_find_resume_index():
+    sources = ["x = 1", "y = 2"]
+    checkpoint = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(s) for s in sources])
+    checkpoint.metadata.kernelspec = {"name": "python3", "language": "python"}
+    for cell in checkpoint.cells:
+        cell.metadata.papermill = {"status": "completed"}
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(sources[0])])
+    nb.metadata.kernelspec = dict(checkpoint.metadata.kernelspec)
+    assert find_resume_index(nb, checkpoint) == 1
+    assert not is_complete_checkpoint(nb, checkpoint, 1)
+    nb.cells.append(nbformat.v4.new_code_cell(sources[1]))
+    assert is_complete_checkpoint(nb, checkpoint, find_resume_index(nb, checkpoint))
+    nb.metadata.kernelspec = {"name": "ir", "language": "R"}
+    assert find_resume_index(nb, checkpoint) == 0
@@ -0,0 +1,87 @@
+import base64
+from pathlib import Path
+
+import nbformat
+from traitlets.config import Config
+
+import urnc
+from urnc.preprocessor.extract_outputs import ExtractOutputs
+
+PNG = base64.b64encode(b"\x89PNG" + bytes(range(256)) * 40).decode()
+
+
+def image_notebook() -> nbformat.NotebookNode:
+    code = nbformat.v4.new_code_cell("plot()")
+    code.outputs = [
+        nbformat.v4.new_output(
+            "display_data",
+            data={"image/png": PNG, "text/plain": "<Figure>"},
+        )
+    ]
+    md = nbformat.v4.new_markdown_cell("![plot.png](attachment:plot.png)")
+    md.attachments = {"plot.png": {"image/png": PNG}}
+    small = nbformat.v4.new_markdown_cell("![x.png](attachment:x.png)")
+    small.attachments = {"x.png": {"image/png": "iVBORw0KGgo="}}
+    return nbformat.v4.new_notebook(cells=[code, md, small])
+
+
+def test_extract_outputs():
+    config = Config()
+    config.ExtractOutputs.min_size = "1 KiB"
+    extractor = ExtractOutputs(config=config)
+    nb, resources = extractor.preprocess(image_notebook(), {})
+
+    files = resources["outputs"]
+    assert len(files) == 1
+    filename = next(iter(files))
+    assert filename.startswith("_files/") and filename.endswith(".png")
+    assert files[filename] == base64.b64decode(PNG)
+
+    data = nb.cells[0].outputs[0].data
+    assert "image/png" not in data
+    assert data["text/plain"] == "<Figure>"
+    assert data["text/markdown"] == f"![image/png]({filename})"
+    assert nb.cells[1].source == f"![plot.png]({filename})"
+    assert "attachments" not in nb.cells[1]
+    assert "x.png" in nb.cells[2].attachments
+
+
+def test_extract_mixed_outputs():
+    config = Config()
+    config.ExtractOutputs.min_size = "1 KiB"
+    extractor = ExtractOutputs(config=config)
+    code = nbformat.v4.new_code_cell("show()")
+    code.outputs = [
+        nbformat.v4.new_output("display_data", data={"image/png": PNG, "image/jpeg": PNG}),
+        nbformat.v4.new_output("display_data", data={"text/markdown": "**plot**", "image/png": PNG}),
+    ]
+    nb, resources = extractor.preprocess(nbformat.v4.new_notebook(cells=[code]), {})
+
+    [filename] = resources["outputs"]
+    assert filename.endswith(".png")
+    images, markdown = nb.cells[0].outputs
+    # Only the preferred image is extracted, other mime types are kept
+    assert images.data["text/markdown"] == f"![image/png]({filename})"
+    assert images.data["image/jpeg"] == PNG
+    # Existing markdown is never replaced
+    assert markdown.data == {"text/markdown": "**plot**", "image/png": PNG}
+
+
+def test_convert_extract(tmp_path: Path):
+    (tmp_path / "week1").mkdir()
+    for name in ["a.ipynb", "b.ipynb", "week1/c.ipynb"]:
+        nbformat.write(image_notebook(), tmp_path / name)
+    config = urnc.config.default_config(tmp_path)
+    config["convert"]["write_mode"] = "overwrite"
+    config["convert"]["extract"]["enabled"] = True
+    config["convert"]["extract"]["min_size"] = "1 KiB"
+    targets = [{"type": "student", "path": str(tmp_path / "out")}]
+    urnc.convert.convert(config, tmp_path, targets)
+
+    files = list((tmp_path / "out" / "_files").iterdir())
+    assert len(files) == 1
+    assert not (tmp_path / "out" / "week1" / "_files").exists()
+    nb = nbformat.read(tmp_path / "out" / "a.ipynb", as_version=4)
+    assert nb.cells[1].source == f"![plot.png](_files/{files[0].name})"
+    nb = nbformat.read(tmp_path / "out" / "week1" / "c.ipynb", as_version=4)
+    assert nb.cells[1].source == f"![plot.png](../_files/{files[0].name})"
@@ -1,5 +1,9 @@
+import os
 from pathlib import Path
 import tempfile
+
+import git
+
 import urnc
 
 
@@ -59,3 +63,64 @@ def test_ignore_pattern():
     notebooks = urnc.convert.filter_notebooks(notebooks, ["ignore*.ipynb"])
     assert notebooks.sort() == [p1, p5].sort()
     tmp.cleanup()
+
+
+def test_ignore_gitignore_semantics(tmp_path: Path):
+    files = [
+        "a.ipynb", "draft-a.ipynb", "node_modules/pkg/x.ipynb", "data/raw/y.ipynb",
+        "lectures/old/l1.ipynb", "lectures/new/old/l2.ipynb", "lectures/new/l3.ipynb",
+        "venv/lib/z.ipynb", "tutorials/scratch/t.ipynb", "tutorials/keep.ipynb",
+    ]
+    for file in files:
+        tmp_path.joinpath(file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(file).touch()
+    patterns = ["draft*.ipynb", "node_modules", "data/", "/lectures/old/", "venv/**",
+                "tutorials/**/*.ipynb", "!tutorials/keep.ipynb", "# comment"]
+
+    notebooks = urnc.convert.find_notebooks(tmp_path, None, patterns, tmp_path)
+
+    relpaths = [nb.relative_to(tmp_path).as_posix() for nb in notebooks]
+    assert relpaths == ["a.ipynb", "lectures/new/l3.ipynb", "lectures/new/old/l2.ipynb",
+                        "tutorials/keep.ipynb"]
+    all_notebooks = urnc.convert.find_notebooks(tmp_path, None)
+    assert urnc.convert.filter_notebooks(all_notebooks, patterns, tmp_path) == notebooks
+
+
+def test_ignore_prunes_directories(tmp_path: Path, monkeypatch):
+    tmp_path.joinpath("data", "big").mkdir(parents=True)
+    tmp_path.joinpath("data", "big", "x.ipynb").touch()
+    tmp_path.joinpath("a.ipynb").touch()
+    walked = []
+    walk = os.walk
+
+    def recording_walk(*args, **kwargs):
+        for entry in walk(*args, **kwargs):
+            walked.append(Path(entry[0]))
+            yield entry
+
+    monkeypatch.setattr(os, "walk", recording_walk)
+    notebooks = urnc.convert.find_notebooks(tmp_path, None, ["data"], tmp_path)
+    assert notebooks == [tmp_path / "a.ipynb"]
+    assert walked == [tmp_path]
+
+
+def test_find_notebooks_git(tmp_path: Path):
+    repo = git.Repo.init(tmp_path)
+    for file in ["tracked.ipynb", "sub/tracked2.ipynb", "untracked.ipynb", "ignored.ipynb"]:
+        tmp_path.joinpath(file).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(file).touch()
+    tmp_path.joinpath(".gitignore").write_text("ignored.ipynb\n")
+    repo.index.add(["tracked.ipynb", "sub/tracked2.ipynb"])
+
+    notebooks = urnc.convert.find_notebooks(tmp_path, None, backend="git")
+    assert notebooks == [tmp_path / "sub" / "tracked2.ipynb", tmp_path / "tracked.ipynb"]
+    notebooks = urnc.convert.find_notebooks(tmp_path / "sub", None, backend="git")
+    assert notebooks == [tmp_path / "sub" / "tracked2.ipynb"]
+    notebooks = urnc.convert.find_notebooks(tmp_path, None, ["sub/"], tmp_path, backend="git",
+                                            untracked=True)
+    assert notebooks == [tmp_path / "tracked.ipynb", tmp_path / "untracked.ipynb"]
+
+    # Falls back to the filesystem walk outside of git repositories
+    urnc.util.rmtree(tmp_path / ".git")
+    notebooks = urnc.convert.find_notebooks(tmp_path, None, backend="git")
+    assert len(notebooks) == 4
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import git
+import nbformat
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+
+import urnc
+from urnc.clear import is_clear
+from urnc.hook import clear_staged
+
+
+def write_notebook(path: Path, source: str = "1 + 1"):
+    nb = new_notebook()
+    nb.cells = [new_code_cell(source, execution_count=1,
+                              outputs=[new_output("execute_result", data={"text/plain": "2"}, execution_count=1)])]
+    nbformat.write(nb, path)
+
+
+def staged(repo: git.Repo, name: str) -> nbformat.NotebookNode:
+    return nbformat.reads(repo.git.show(f":{name}"), as_version=4)
+
+
+def test_clear_staged(tmp_path: Path):
+    repo = git.Repo.init(tmp_path)
+    for name in ["staged.ipynb", "partial.ipynb", "unstaged.ipynb"]:
+        write_notebook(tmp_path / name)
+    (tmp_path / "sub").mkdir()
+    write_notebook(tmp_path / "sub" / "nested.ipynb")
+    repo.index.add(["staged.ipynb", "partial.ipynb", "sub/nested.ipynb"])
+    write_notebook(tmp_path / "partial.ipynb", "2 + 2")
+
+    config = urnc.config.default_config(tmp_path)
+    changed = clear_staged(config, tmp_path, workers=2)
+    assert [p.relative_to(tmp_path).as_posix() for p in changed] == ["partial.ipynb", "staged.ipynb",
+                                                                     "sub/nested.ipynb"]
+    assert is_clear(tmp_path / "staged.ipynb")
+    assert is_clear(tmp_path / "sub" / "nested.ipynb")
+    assert not is_clear(tmp_path / "unstaged.ipynb")
+    # Unstaged changes are kept
+    assert not is_clear(tmp_path / "partial.ipynb")
+    assert staged(repo, "partial.ipynb").cells[0].outputs == []
+    assert staged(repo, "partial.ipynb").cells[0].source == "1 + 1"
+    assert repo.git.diff("--name-only") == "partial.ipynb"
+
+    assert clear_staged(config, tmp_path) == []
@@ -85,3 +85,26 @@ def test_autofix():
         print(tagged2.cells[0].source)
         assert util.has_tag(tagged2.cells[0], "invalid") is False
         assert util.has_tag(tagged2.cells[1], "invalid") is False
+
+
+def test_stat_cache(tmp_path: Path):
+    img_path = tmp_path.joinpath("logo.png")
+    img_path.write_bytes(b"x" * 2048)
+    config = Config()
+    config.ImageChecker.base_path = str(tmp_path)
+    config.ImageChecker.max_image_size = "1 KiB"
+    preprocessor = image.ImageChecker(config=config)
+    assert preprocessor.max_size == 1024
+
+    for name in ["nb1.ipynb", "nb2.ipynb"]:
+        nb = nbformat.v4.new_notebook(
+            cells=[nbformat.v4.new_markdown_cell("![](logo.png)")]
+        )
+        preprocessor.preprocess(nb, {"path": tmp_path.joinpath(name)})
+
+    assert len(preprocessor.image_stats) == 1
+    largest = preprocessor.largest_images()
+    assert largest[0].path == img_path
+    assert largest[0].size == 2048
+    assert largest[0].notebooks == {tmp_path / "nb1.ipynb", tmp_path / "nb2.ipynb"}
+    preprocessor.log_summary()
@@ -0,0 +1,87 @@
+import threading
+from pathlib import Path
+
+import nbformat
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook
+
+import urnc
+from urnc.metrics import Metrics, export, metrics
+
+
+def test_render():
+    m = Metrics()
+    m.labels["course"] = 'My "Course"'
+    m.add("urnc_notebooks", 2, state="converted")
+    m.add("urnc_notebooks", state="converted")
+    m.add("urnc_phase_duration_seconds", 0.5, phase="convert")
+    text = m.render()
+    assert 'urnc_notebooks{course="My \\"Course\\"",state="converted"} 3\n' in text
+    assert "# UNIT urnc_phase_duration_seconds seconds\n" in text
+    assert 'urnc_phase_duration_seconds{course="My \\"Course\\"",phase="convert"} 0.5\n' in text
+    assert "urnc_push_bytes" not in text
+    assert text.endswith("# EOF\n")
+
+
+def test_add_threads():
+    m = Metrics()
+
+    def work():
+        for _ in range(10000):
+            m.add("urnc_notebooks", state="converted")
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert m.get("urnc_notebooks", state="converted") == 80000
+
+
+def test_count_per_target(tmp_path: Path):
+    for name in ["a.ipynb", "b.ipynb"]:
+        nb = new_notebook()
+        nb.cells = [new_code_cell("print(1)")]
+        nbformat.write(nb, tmp_path / name)
+    config = urnc.config.default_config(tmp_path)
+    out = tmp_path.parent / f"{tmp_path.name}-out"
+    targets = [{"type": "student", "path": str(out / "student")}, {"type": "clear", "path": str(out / "clear")}]
+    metrics.reset()
+    urnc.convert.convert(config, tmp_path, targets)
+    assert metrics.get("urnc_notebooks", state="discovered") == 4
+    assert metrics.get("urnc_notebooks", state="converted") == 4
+    # Unchanged outputs are skipped, each job is counted once
+    metrics.reset()
+    urnc.convert.convert(config, tmp_path, targets)
+    assert metrics.get("urnc_notebooks", state="discovered") == 4
+    done = sum(metrics.get("urnc_notebooks", state=state) for state in ["converted", "cached", "skipped"])
+    assert done == 4
+    # Notebooks without image paths to fix are not written
+    metrics.reset()
+    config["convert"]["write_mode"] = "overwrite"
+    urnc.convert.convert(config, tmp_path, [{"type": "fix", "path": "{nb.abspath}"}])
+    assert metrics.get("urnc_notebooks", state="discovered") == 2
+    assert metrics.get("urnc_notebooks", state="skipped") == 2
+    assert metrics.get("urnc_notebooks", state="converted") == 0
+    metrics.reset()
+
+
+def test_export_convert(tmp_path: Path):
+    for name in ["a.ipynb", "b.ipynb"]:
+        nb = new_notebook()
+        nb.cells = [new_code_cell("print(1)")]
+        nbformat.write(nb, tmp_path / name)
+    config = urnc.config.default_config(tmp_path)
+    path = tmp_path / "metrics" / "urnc.prom"
+    with export(path, command="convert", course=None):
+        urnc.convert.convert(config, tmp_path, [{"type": "student", "path": "out"}])
+    assert metrics.get("urnc_notebooks", state="discovered") == 2
+    assert metrics.get("urnc_notebooks", state="converted") == 2
+    assert metrics.get("urnc_written_bytes") > 0
+    text = path.read_text()
+    assert 'urnc_notebooks{command="convert",state="discovered"} 2' in text
+    assert 'urnc_run_success{command="convert"} 1' in text
+
+    with pytest.raises(RuntimeError):
+        with export(path, command="convert"):
+            raise RuntimeError("failed")
+    assert 'urnc_run_success{command="convert"} 0' in path.read_text()
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import nbformat
+import pytest
+
+import urnc
+from urnc.plan import OVERWRITE, SKIP, WRITE, create_plan, read_plan, write_plan
+
+
+def write_notebook(path: Path, source: str = "print(1)"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nbformat.write(nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source)]), path)
+
+
+def test_create_plan(tmp_path: Path):
+    write_notebook(tmp_path / "a.ipynb")
+    write_notebook(tmp_path / "sub" / "b.ipynb")
+    write_notebook(tmp_path / "out" / "sub" / "b.ipynb")
+    config = urnc.config.default_config(tmp_path)
+    targets = [{"type": "student", "path": "out"}, {"type": "solution", "path": "out"}]
+
+    plan = create_plan(config, tmp_path, targets)
+
+    rows = [entry.to_dict(tmp_path) for entry in plan]
+    assert [(r["input"], r["type"], r["output"], r["action"]) for r in rows] == [
+        ("a.ipynb", "student", "out/a.ipynb", WRITE),
+        ("sub/b.ipynb", "student", "out/sub/b.ipynb", SKIP),
+        ("a.ipynb", "solution", "out/a-solution.ipynb", WRITE),
+        ("sub/b.ipynb", "solution", "out/sub/b-solution.ipynb", WRITE),
+    ]
+
+    config["convert"]["write_mode"] = urnc.config.WriteMode.OVERWRITE
+    write_plan(plan, tmp_path / "plan.json", tmp_path)
+    actions = [entry.action for entry in read_plan(tmp_path / "plan.json", config)]
+    assert actions == [WRITE, OVERWRITE, WRITE, WRITE]
+
+
+def test_plan_collision(tmp_path: Path):
+    write_notebook(tmp_path / "a.ipynb")
+    write_notebook(tmp_path / "b.ipynb")
+    config = urnc.config.default_config(tmp_path)
+    with pytest.raises(Exception, match="Output path collision"):
+        create_plan(config, tmp_path, [{"type": "student", "path": "out/student.ipynb"}])
+
+
+def test_convert_plan(tmp_path: Path):
+    write_notebook(tmp_path / "a.ipynb")
+    write_notebook(tmp_path / "b.ipynb")
+    write_notebook(tmp_path / "out" / "b.ipynb", "existing")
+    config = urnc.config.default_config(tmp_path)
+    plan = create_plan(config, tmp_path, [{"type": "student", "path": str(tmp_path / "out")}])
+
+    # Only the entries of the plan are converted, existing outputs are skipped
+    urnc.convert.convert(config, tmp_path, [], plan[1:])
+    assert not (tmp_path / "out" / "a.ipynb").exists()
+    urnc.convert.convert(config, tmp_path, [], plan)
+    assert (tmp_path / "out" / "a.ipynb").exists()
+    assert nbformat.read(tmp_path / "out" / "b.ipynb", as_version=4).cells[0].source == "existing"
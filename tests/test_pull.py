@@ -133,3 +133,81 @@ def test_pull_delete_restore():
     assert (pull_path / "example.ipynb").is_file()
 
     urnc.util.release_locks(repo)
+
+
+def count_objects(repo_path: Path) -> dict:
+    lines = git.Repo(repo_path).git.count_objects("-v").splitlines()
+    return dict(line.split(": ") for line in lines)
+
+
+def test_pull_reference(tmp_path: Path):
+    repo_path = tmp_path / "repo"
+    urnc.init.init("Example Course", repo_path)
+    repo = git.Repo(repo_path)
+    remote_path = tmp_path / "remote.git"
+    git.Repo.init(remote_path, bare=True, initial_branch="main")
+    repo.create_remote("origin", str(remote_path)).push(refspec="main:main")
+    url = remote_path.as_uri()
+    reference = tmp_path / "shared" / "student.git"
+
+    # The first clone creates the store, all clones borrow its objects
+    for name in ["alice", "bob"]:
+        urnc.pull.pull(url, str(tmp_path / name), "main", 1, reference=str(reference))
+        assert (tmp_path / name / "example.ipynb").is_file()
+        alternates = tmp_path / name / ".git" / "objects" / "info" / "alternates"
+        assert alternates.read_text() == f"{reference / 'objects'}\n"
+        assert count_objects(tmp_path / name)["in-pack"] == "0"
+    assert git.Repo(reference).git.config("gc.pruneExpire") == "never"
+
+    # New versions are fetched into the store only
+    (repo_path / "new_file.txt").write_text("new")
+    update_remote(repo)
+    urnc.pull.pull(url, str(tmp_path / "alice"), "main", 1, reference=str(reference))
+    assert (tmp_path / "alice" / "new_file.txt").is_file()
+    assert git.Repo(reference).commit("main") == repo.head.commit
+    assert count_objects(tmp_path / "alice")["in-pack"] == "0"
+    assert count_objects(tmp_path / "alice")["count"] == "0"
+
+    # Existing clones start using the store on their next pull
+    urnc.pull.pull(url, str(tmp_path / "carol"), "main", 1)
+    urnc.pull.pull(url, str(tmp_path / "carol"), "main", 1, reference=str(reference))
+    assert (tmp_path / "carol" / ".git" / "objects" / "info" / "alternates").is_file()
+    urnc.util.release_locks(repo)
+
+
+def test_pull_shallow(tmp_path: Path):
+    repo_path = tmp_path / "repo"
+    urnc.init.init("Example Course", repo_path)
+    repo = git.Repo(repo_path)
+    remote_path = tmp_path / "remote.git"
+    git.Repo.init(remote_path, bare=True, initial_branch="main")
+    git.Repo(remote_path).git.config("uploadpack.allowFilter", "true")
+    origin = repo.create_remote("origin", str(remote_path))
+    url = remote_path.as_uri()
+
+    def publish(day: int):
+        (repo_path / f"day{day}.txt").write_text(f"day {day}")
+        repo.git.add(all=True)
+        date = f"2026-01-{day:02}T12:00:00"
+        repo.index.commit(f"day {day}", author_date=date, commit_date=date)
+        origin.push(refspec="main:main")
+
+    for day in range(1, 4):
+        publish(day)
+    pull_path = tmp_path / "pulled"
+    urnc.pull.pull(url, str(pull_path), "main", 1, filter="blob:none")
+    pulled = git.Repo(pull_path)
+    assert pulled.git.config("remote.origin.partialclonefilter") == "blob:none"
+    assert pulled.git.rev_list("--count", "origin/main") == "1"
+
+    # Fetches keep the history shallow, also with local commits
+    for week in range(2):
+        (pull_path / "notes.txt").write_text(f"week {week}")
+        publish(4 + 2 * week)
+        publish(5 + 2 * week)
+        urnc.pull.pull(url, str(pull_path), "main", 1, filter="blob:none")
+        assert (pull_path / f"day{5 + 2 * week}.txt").is_file()
+        assert (pull_path / "notes.txt").read_text() == f"week {week}"
+        # The two new commits and the previous one, which is the merge base
+        assert pulled.git.rev_list("--count", "origin/main") == "3"
+    urnc.util.release_locks(repo)
@@ -0,0 +1,82 @@
+import threading
+import time
+from pathlib import Path
+
+import nbformat
+import pytest
+
+import urnc
+from urnc.schedule import FAILED, OK, SKIPPED, run_graph
+
+
+def test_run_graph_order():
+    order = []
+    deps = {"c": ["a", "b"], "b": ["a"]}
+    status = run_graph(["c", "b", "a", "d"], deps, lambda n: order.append(n) or True)
+    assert order == ["a", "b", "c", "d"]
+    assert set(status.values()) == {OK}
+
+
+def test_run_graph_concurrent():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def func(node):
+        if node in ("a", "b"):
+            barrier.wait()  # deadlocks unless a and b run at the same time
+        return True
+
+    status = run_graph(["a", "b", "c"], {"c": ["a", "b"]}, func, workers=2)
+    assert status == {"a": OK, "b": OK, "c": OK}
+
+
+def test_run_graph_skip():
+    deps = {"b": ["a"], "c": ["b"], "e": ["d"]}
+    status = run_graph(["a", "b", "c", "d", "e"], deps, lambda n: n != "a")
+    assert status == {"a": FAILED, "b": SKIPPED, "c": SKIPPED, "d": OK, "e": OK}
+
+
+def test_run_graph_cycle():
+    with pytest.raises(Exception, match="a -> b -> a"):
+        run_graph(["a", "b"], {"a": ["b"], "b": ["a"]}, lambda n: True)
+
+
+def test_run_graph_exception():
+    def func(node):
+        if node == "a":
+            raise ValueError("boom")
+        time.sleep(0.1)
+        return True
+
+    with pytest.raises(ValueError):
+        run_graph(["a", "b", "c"], {"c": ["b"]}, func, workers=2)
+
+
+def write_notebook(path: Path, source: str, depends_on=None):
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell(source)])
+    if depends_on:
+        nb.metadata["urnc"] = {"depends_on": depends_on}
+    nbformat.write(nb, path)
+
+
+def test_execute_dependencies():
+    root = Path("course").absolute()
+    root.joinpath("data").mkdir(parents=True)
+    write_notebook(root.joinpath("01-load.ipynb"), "print(open('data/x.txt').read())",
+                   depends_on=["data/00-write.ipynb"])
+    write_notebook(root.joinpath("data", "00-write.ipynb"), "open('x.txt', 'w').write('42')")
+    write_notebook(root.joinpath("02-fail.ipynb"), "raise ValueError('boom')")
+    write_notebook(root.joinpath("03-after.ipynb"), "print('after')")
+    config = urnc.config.default_config(root)
+    config["execute"]["parallel"] = 2
+    config["execute"]["dependencies"] = {"03-after.ipynb": ["02-fail.ipynb"]}
+
+    converted = urnc.convert.convert_target(root, "out/", "execute", config)
+
+    outputs = {
+        path.name: nbformat.reads(body, as_version=4).cells[0].outputs
+        for body, path, _ in converted
+    }
+    assert sorted(outputs) == ["00-write-executed.ipynb", "01-load-executed.ipynb",
+                               "02-fail-executed.ipynb"]
+    assert outputs["01-load-executed.ipynb"][0]["text"] == "42\n"
+    assert outputs["02-fail-executed.ipynb"][0]["output_type"] == "error"
@@ -0,0 +1,67 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+import urnc
+from urnc.metrics import metrics
+from urnc.serve import PreviewCache, PreviewServer
+
+
+def test_cache(tmp_path: Path):
+    cache = PreviewCache(size=2)
+    paths = [tmp_path / f"{name}.ipynb" for name in "abc"]
+    for path in paths:
+        path.write_text("{}")
+    keys = [cache.key("student", "html", path) for path in paths]
+    for key in keys:
+        assert cache.get(key) is None
+        cache.put(key, b"x")
+    assert cache.get(keys[0]) is None  # least recently used
+    assert cache.get(keys[2]) == b"x"
+    paths[2].write_text('{"changed": 1}')
+    assert cache.key("student", "html", paths[2]) != keys[2]
+
+    # The key of the content read matches the key of the next request
+    key, data = cache.read("student", "html", paths[1])
+    assert data == b"{}" and key == keys[1]
+    paths[1].write_text('{"changed": 2}')
+    key, data = cache.read("student", "html", paths[1])
+    assert data == b'{"changed": 2}'
+    assert cache.key("student", "html", paths[1]) == key
+
+
+def test_serve(tmp_path: Path):
+    urnc.init.init(name="Test Course", path=tmp_path / "course")
+    config = urnc.config.read_config(tmp_path / "course")
+    server = PreviewServer(config, tmp_path / "course", ("127.0.0.1", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def get(path: str) -> bytes:
+        with urllib.request.urlopen(url + path) as response:
+            return response.read()
+
+    try:
+        metrics.reset()
+        assert b'href="/student/example.ipynb"' in get("/")
+        student = json.loads(get("/student/example.ipynb?format=ipynb"))
+        expected = urnc.convert.convert_target(tmp_path / "course" / "example.ipynb", None, "student", config)[0][0]
+        assert student == json.loads(expected)
+        assert get("/student/example.ipynb?format=ipynb") == expected.encode()
+        assert b"<html" in get("/solution/example.ipynb")
+        assert metrics.get("urnc_preview_requests", cache="hit") == 1
+        assert metrics.get("urnc_preview_requests", cache="miss") == 2
+        assert b'urnc_preview_requests{cache="hit"} 1' in get("/metrics")
+        (tmp_path / "secret.txt").write_text("secret")
+        for path in ["/student/missing.ipynb", "/student/../secret.txt", "/student/.git/config",
+                     "/execute/example.ipynb"]:
+            with pytest.raises(urllib.error.HTTPError, match="404"):
+                get(path)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import pytest
+
+from urnc.shard import parse_shard, shard_notebooks
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for value in ("0/4", "5/4", "1", "a/b"):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+@pytest.mark.parametrize("strategy", ["hash", "size"])
+def test_shard_notebooks(tmp_path: Path, strategy: str):
+    notebooks = []
+    for i in range(20):
+        path = tmp_path.joinpath(f"nb{i:02}.ipynb")
+        path.write_text("x" * (i + 1) * 100)
+        notebooks.append(path)
+    shards = [shard_notebooks(notebooks, tmp_path, (i, 3), strategy) for i in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == notebooks
+    # The partition only depends on the relative paths
+    moved = [Path("/elsewhere").joinpath(nb.name) for nb in notebooks]
+    if strategy == "hash":
+        assert [nb.name for nb in shard_notebooks(moved, Path("/elsewhere"), (1, 3))] == \
+            [nb.name for nb in shards[0]]
+    else:
+        sizes = [sum(nb.stat().st_size for nb in shard) for shard in shards]
+        assert max(sizes) - min(sizes) <= 2000
@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+
+import nbformat
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
+
+import urnc
+from urnc import trace
+
+
+def read_trace(path: Path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_disabled():
+    assert not trace.enabled()
+    with trace.span("convert", "phase") as span:
+        span.set(notebooks=1)
+        span.fail()
+    func = len
+    assert trace.traced(func, "len") is func
+
+
+def test_export_convert(tmp_path: Path):
+    for name in ["a.ipynb", "b.ipynb"]:
+        nb = new_notebook()
+        nb.cells = [new_markdown_cell("![missing](missing.png)"), new_code_cell("### Solution\nx = 1")]
+        nbformat.write(nb, tmp_path / name)
+    config = urnc.config.default_config(tmp_path)
+    path = tmp_path / "trace.jsonl"
+    with trace.export(path, command="convert", course=None):
+        with urnc.metrics.phase("discover"):
+            pass
+        urnc.convert.convert(config, tmp_path, [{"type": "student", "path": "out"}])
+    assert not trace.enabled()
+
+    records = read_trace(path)
+    spans = {record["span"]: record for record in records if "span" in record and "kind" in record}
+    run = next(s for s in spans.values() if s["kind"] == "run")
+    assert run["name"] == "convert" and run["parent"] is None and run["outcome"] == "ok"
+    assert run["attrs"] == {"command": "convert"}
+    notebooks = [s for s in spans.values() if s["kind"] == "notebook"]
+    assert sorted(s["name"] for s in notebooks) == ["a.ipynb", "b.ipynb"]
+    assert all(spans[s["parent"]]["name"] == "convert" for s in notebooks)
+    preprocessors = [s for s in spans.values() if s["kind"] == "preprocessor"]
+    assert {s["name"] for s in preprocessors} == {"ImageChecker", "AddTags", "SolutionProcessor", "ClearOutputs"}
+    assert all(spans[s["parent"]]["kind"] == "notebook" for s in preprocessors)
+    for s in spans.values():
+        assert s["end"] >= s["start"] and s["duration"] >= 0
+        assert s["worker"].split("/")[0].isdigit()
+    # Warnings are recorded as events of the innermost span
+    warnings = [record for record in records if record.get("event") == "warning"]
+    assert warnings and spans[warnings[0]["span"]]["name"] == "ImageChecker"
+
+
+def test_export_error(tmp_path: Path):
+    path = tmp_path / "trace.jsonl"
+    with pytest.raises(RuntimeError):
+        with trace.export(path, command="ci"):
+            with trace.span("push", "phase"):
+                raise RuntimeError("push failed")
+    phase, run = read_trace(path)
+    assert phase["outcome"] == "error" and phase["error"] == "push failed"
+    assert run["outcome"] == "error" and phase["parent"] == run["span"]
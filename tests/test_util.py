@@ -1,5 +1,6 @@
 import os
 import shutil
+import threading
 from pathlib import Path
 
 import git
@@ -7,7 +8,7 @@ import nbformat
 import pytest
 
 from urnc.init import init
-from urnc.util import (branch_exists, chdir, dirs_equal, get_course_repo,
+from urnc.util import (Pool, branch_exists, chdir, dirs_equal, get_course_repo,
                        get_course_root, get_urnc_root, git_folder_name,
                        is_remote_git_url, read_notebook,
                        release_locks, tag_exists,
@@ -151,3 +152,27 @@ def test_ensure_git_identity(tmp_path: Path):
         email = config.get_value("user", "email")
     assert name == "urnc"
     assert email == "urnc@spang-lab.de"
+
+
+def test_pool():
+    created = []
+
+    def create():
+        created.append(object())
+        return created[-1]
+
+    pool = Pool(create)
+    borrowed = []
+
+    def work():
+        with pool.acquire() as obj:
+            borrowed.append(obj)
+    # Objects are reused by later threads instead of created per thread
+    for _ in range(3):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    assert borrowed == created * 3
+    with pool.acquire() as a, pool.acquire() as b:
+        assert a is not b
+    assert len(created) == 2
@@ -10,4 +10,21 @@ convert, and manage course versions.
 # pyright: reportImportCycles=false
 # pyright: reportUnusedImport=false
 
-from urnc import ci, convert, logger, pull, util, version, format, config, git, init
+import importlib
+from typing import TYPE_CHECKING, Any
+
+# Submodules are imported on first access, so commands that only need a few
+# of them (e.g. the pre-commit hook) do not pay for importing nbconvert,
+# papermill or GitPython.
+_submodules = ("ci", "convert", "logger", "pull", "util", "version", "format", "config", "git", "init",
+               "compress", "nbstream", "budget", "shard", "plan", "clear", "hook", "metrics", "trace", "serve")
+
+if TYPE_CHECKING:
+    from urnc import (ci, convert, logger, pull, util, version, format, config, git, init, compress, nbstream,
+                      budget, shard, plan, clear, hook, metrics, trace, serve)
+
+
+def __getattr__(name: str) -> Any:
+    if name in _submodules:
+        return importlib.import_module(f"urnc.{name}")
+    raise AttributeError(f"module 'urnc' has no attribute '{name}'")
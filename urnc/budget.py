@@ -0,0 +1,140 @@
+"""Size analysis of notebooks used by `urnc check`"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Union
+
+from urnc.logger import critical, dbg, error, log
+from urnc.nbstream import PathEntry, iter_events
+from urnc.preprocessor.util import string_to_byte
+
+categories = ("source", "text_outputs", "rich_outputs", "attachments", "metadata")
+
+# Mime types of outputs that are counted as text. All other mime types (images,
+# html, javascript, widgets, ...) are counted as rich outputs.
+text_mime_types = ("text/plain", "text/markdown", "text/latex")
+
+# Fields of error and stream outputs that are counted as text
+text_output_fields = ("text", "traceback", "ename", "evalue")
+
+
+def categorize(path: Sequence[PathEntry]) -> str:
+    """Return the size category for the JSON value at {path} of a notebook."""
+    if len(path) < 3 or path[0] != "cells":
+        return "metadata"
+    field = path[2]
+    if field == "source":
+        return "source"
+    if field == "attachments":
+        return "attachments"
+    if field == "outputs" and len(path) >= 5:
+        if path[4] == "data" and len(path) >= 6:
+            return "text_outputs" if path[5] in text_mime_types else "rich_outputs"
+        if path[4] in text_output_fields:
+            return "text_outputs"
+    return "metadata"
+
+
+def format_size(size: float) -> str:
+    """Format {size} (in bytes) as human readable string, e.g. '1.5 MiB'."""
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024:
+            break
+    return f"{size:.1f} {unit}"
+
+
+class NotebookSize(object):
+    def __init__(self, path: Path):
+        """Byte breakdown of a single notebook file.
+
+        Attributes:
+            path (Path): Path of the notebook.
+            total (int): Size of the notebook file in bytes.
+            sizes (Dict[str, int]): Bytes per category, see `urnc.budget.categories`.
+                Whitespace and JSON syntax are attributed to the enclosing value.
+        """
+        self.path = path
+        self.total = 0
+        self.sizes: Dict[str, int] = dict.fromkeys(categories, 0)
+
+    def largest_category(self) -> str:
+        return max(self.sizes, key=lambda c: self.sizes[c])
+
+    def describe(self) -> str:
+        parts = [f"{c}: {format_size(self.sizes[c])}" for c in categories if self.sizes[c]]
+        return f"{format_size(self.total)} ({', '.join(parts)})"
+
+
+def analyze_notebook(path: Union[str, Path]) -> NotebookSize:
+    """
+    Compute the byte breakdown of the notebook at {path} in a single streaming
+    pass over the file, i.e. without parsing it into a `NotebookNode`.
+    """
+    path = Path(path)
+    result = NotebookSize(path)
+    sizes = result.sizes
+    with open(path, "rb") as f:
+        for json_path, token in iter_events(f):
+            sizes[categorize(json_path)] += token[2]
+        result.total = f.tell()
+    sizes["metadata"] += result.total - sum(sizes.values())
+    return result
+
+
+def check_budgets(config: Dict[str, Any], input: Union[str, Path]) -> List[NotebookSize]:
+    """
+    Analyze the size of all notebooks in {input} and enforce the budgets
+    configured in ``check.notebook_budget`` and ``check.total_budget``.
+
+    Logs the byte breakdown of every notebook (debug level) and the
+    ``check.top`` largest notebooks. Raises an exception if a budget is
+    exceeded.
+
+    Returns:
+        The size breakdown of all analyzed notebooks, largest first.
+    """
+    from urnc.plan import discover_notebooks
+
+    input = Path(input)
+    check_config = config["check"]
+    if input.is_file():
+        notebooks = [input]
+    else:
+        notebooks = discover_notebooks(input, None, config)
+
+    results = []
+    for nb in notebooks:
+        result = analyze_notebook(nb)
+        dbg(f"Size of {nb.name}: {result.describe()}")
+        results.append(result)
+    results.sort(key=lambda r: r.total, reverse=True)
+
+    def relpath(path: Path) -> str:
+        return os.path.relpath(path, start=config["base_path"])
+
+    total = sum(r.total for r in results)
+    log(f"Total size of {len(results)} notebooks: {format_size(total)}")
+    for result in results[:check_config["top"]]:
+        largest = result.largest_category()
+        log(f"{relpath(result.path)}: {result.describe()}, mostly {largest}")
+
+    violations = 0
+    if check_config["notebook_budget"]:
+        budget = string_to_byte(check_config["notebook_budget"])
+        for result in results:
+            if result.total > budget:
+                error(f"{relpath(result.path)} exceeds the notebook budget of " +
+                      f"{check_config['notebook_budget']}: {result.describe()}")
+                violations += 1
+    if check_config["total_budget"]:
+        budget = string_to_byte(check_config["total_budget"])
+        if total > budget:
+            error(f"Notebooks exceed the total budget of {check_config['total_budget']}: " +
+                  f"{format_size(total)}")
+            violations += 1
+    if violations:
+        critical(f"{violations} size budget(s) exceeded.")
+    return results
@@ -1,11 +1,13 @@
 """Functions to be used by CI pipelines"""
 
+import importlib.metadata
 import os
 import shutil
+import tempfile
 from datetime import datetime
-from os.path import basename, exists, isdir, isfile, join
+from os.path import exists, isdir, isfile, join
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import click
 import dateutil
@@ -14,10 +16,18 @@ import dateutil.tz
 import git
 
 import urnc
+from urnc.format import format_path
+from urnc.plan import PlanEntry, check_collisions, discover_notebooks, filter_notebooks, find_jobs, write_decision
+from urnc.shard import (Shard, bundle_name, changed_files, extract_bundle, read_bundles, relpath,
+                        shard_notebooks, write_bundle)
 from urnc.util import is_remote_git_url
 from urnc.logger import critical, log, warn
+from urnc.metrics import add, phase
 import textwrap
 
+# Trailers of student commits recording what they were converted from
+SOURCE_TRAILER = "Urnc-Source-Commit"
+VERSION_TRAILER = "Urnc-Version"
 
 # See: https://stackoverflow.com/questions/1703546/parsing-date-time-string-with-timezone-abbreviated-name-in-python
 tz_str = textwrap.dedent('''
@@ -175,7 +185,289 @@ def update_index(repo: git.Repo) -> None:
         repo.index.write()
 
 
-def ci(config: Dict[str, Any]) -> None:
+def copy_course(base_path: Path, target: Path, skip: Sequence[Path] = ()) -> None:
+    """
+    Copy all files of the course at {base_path} except '.git' folders to
+    {target}. Directories in {skip} (e.g. {target} itself, if it is located
+    inside the course) are not copied.
+    """
+    skip = [Path(path).resolve() for path in skip]
+
+    def ignore_fn(dir: str, files: List[str]) -> List[str]:
+        ignore_list = [".git"] if ".git" in files else []
+        for file in files:
+            if Path(dir).joinpath(file).resolve() in skip:
+                log(f"Skipping copy of {Path(dir).joinpath(file)}")
+                ignore_list.append(file)
+        return ignore_list
+
+    shutil.copytree(base_path, target, ignore=ignore_fn, dirs_exist_ok=True)
+
+
+def get_targets(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    targets = config["convert"]["targets"]
+    if not targets:
+        targets = [{"type": "student", "path": "{nb.abspath}"}]
+    return targets
+
+
+def prepare_student_repo(config: Dict[str, Any], skip: Sequence[Path] = ()) -> git.Repo:
+    """
+    Clone or pull the student repository, delete all of its files and copy
+    the files of the course (except {skip}) into it.
+    """
+    base_path = config["base_path"]
+    repo = urnc.git.get_repo(base_path)
+    if not repo:
+        warn("Not in a git repository")
+
+    # Make sure main repo is clean if we want to commit and push to student remote
+    if config["ci"]["commit"] and repo and repo.is_dirty():
+        raise click.UsageError("Repo is not clean. Commit your changes first.")
+
+    # Clone and clear student repo. Then copy over files from main repo
+    student_repo = clone_student_repo(config)
+    student_path = Path(student_repo.working_dir)
+    clear_repo(student_repo)
+    copy_course(base_path, student_path, skip=[student_path, *skip])
+    return student_repo
+
+
+def publish_student_repo(config: Dict[str, Any], base_path: Path, student_repo: git.Repo) -> None:
+    """
+    Compress images (if configured), update the .gitignore of the student
+    repository and commit and push it, if ``ci.commit`` is set.
+    """
+    student_path = Path(student_repo.working_dir)
+    with phase("publish"):
+        if config["convert"]["images"]["compress"]:
+            log("Compressing oversized images")
+            urnc.compress.compress_images(student_path, config)
+        # Update .gitignore and drop cached files
+        log("Updating .gitignore from config")
+        write_gitignore(
+            main_gitignore=base_path.joinpath(".gitignore"),
+            student_gitignore=student_path.joinpath(".gitignore"),
+            config=config,
+        )
+        log("Dropping cached files...")
+        update_index(student_repo)
+
+    # Commit and push
+    if config["ci"]["commit"]:
+        with phase("commit"):
+            log("Adding files and commiting")
+            student_repo.git.add(all=True)
+            student_repo.index.commit(commit_message(base_path))
+        size = push_size(student_repo)
+        if size is not None:
+            add("urnc_push_bytes", size)
+        with phase("push"):
+            log("Pushing student repo")
+            student_repo.git.push()
+        log("Done.")
+    else:
+        log("Skipping git commit and push")
+        log("Done.")
+    urnc.util.release_locks(student_repo)
+
+
+def push_size(repo: git.Repo) -> Optional[int]:
+    """
+    Return the size in bytes of the objects of {repo} not yet contained in
+    any remote branch, i.e. roughly the amount of data pushed. Returns None
+    if git is too old (< 2.31) to compute it.
+    """
+    try:
+        return int(repo.git.rev_list("--objects", "--disk-usage", "HEAD", "--not", "--remotes"))
+    except (git.GitCommandError, ValueError):
+        return None
+
+
+def urnc_version() -> str:
+    try:
+        return importlib.metadata.version("urnc")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def commit_message(base_path: Path) -> str:
+    """
+    Return the message of the student commit. If the course is a git repo,
+    its current commit is recorded as trailer, so the next run of
+    ``urnc ci --incremental`` knows what was converted.
+    """
+    message = "urnc convert"
+    repo = urnc.git.get_repo(base_path)
+    if repo is not None and repo.head.is_valid():
+        message += f"\n\n{SOURCE_TRAILER}: {repo.head.commit.hexsha}\n{VERSION_TRAILER}: {urnc_version()}\n"
+        urnc.util.release_locks(repo)
+    return message
+
+
+def read_trailers(message: str) -> Dict[str, str]:
+    """Return the trailers (lines 'Key: value' in the last paragraph) of a commit {message}."""
+    paragraphs = message.strip().split("\n\n")
+    if len(paragraphs) < 2:
+        return {}
+    trailers = {}
+    for line in paragraphs[-1].splitlines():
+        key, sep, value = line.partition(": ")
+        if sep and key and " " not in key:
+            trailers[key] = value.strip()
+    return trailers
+
+
+def changed_paths(base_path: Path, since: str) -> List[Tuple[str, str]]:
+    """
+    Return the files below {base_path} changed between commit {since} and
+    HEAD as tuples (status, path), where status is 'A', 'M' or 'D' and
+    paths are relative to {base_path}. Renames are reported as deletion and
+    addition.
+
+    Raises:
+        git.GitCommandError: If {since} is not available, e.g. in a shallow clone.
+    """
+    output = git.Git(str(base_path)).diff("--name-status", "--no-renames", "--relative", "-z",
+                                          f"{since}..HEAD", "--")
+    fields = [field for field in output.split("\0") if field]
+    changes = []
+    for status, path in zip(fields[0::2], fields[1::2]):
+        changes.append(("D" if status == "D" else "A" if status == "A" else "M", path))
+    return changes
+
+
+def incremental_base(config: Dict[str, Any], student_repo: git.Repo, since: Optional[str]) -> Optional[str]:
+    """
+    Return the commit of the course the student repository was converted
+    from, or None (with a warning) if the student version has to be rebuilt
+    completely.
+    """
+    base_path = config["base_path"]
+    repo = urnc.git.get_repo(base_path)
+    if repo is None:
+        warn("Not in a git repository. Falling back to a full rebuild.")
+        return None
+    if repo.is_dirty():
+        warn("Repo is not clean. Falling back to a full rebuild.")
+        return None
+    if not student_repo.head.is_valid():
+        log("Student repo has no commits yet. Doing a full rebuild.")
+        return None
+    trailers = read_trailers(student_repo.head.commit.message)
+    if since is None:
+        since = trailers.get(SOURCE_TRAILER)
+        if since is None:
+            warn(f"Last student commit has no {SOURCE_TRAILER} trailer. Falling back to a full rebuild.")
+            return None
+        if trailers.get(VERSION_TRAILER) != urnc_version():
+            log(f"Last student commit was converted by urnc {trailers.get(VERSION_TRAILER)}. Doing a full rebuild.")
+            return None
+    if config["convert"]["extract"]["enabled"]:
+        log("Extracted outputs are not tracked per notebook. Doing a full rebuild.")
+        return None
+    # The published files may change without any commit, e.g. by entries of
+    # git.exclude with a date
+    student_path = Path(student_repo.working_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        gitignore = Path(tmp).joinpath(".gitignore")
+        write_gitignore(base_path.joinpath(".gitignore"), gitignore, config)
+        current = student_path.joinpath(".gitignore")
+        if not current.is_file() or current.read_bytes() != gitignore.read_bytes():
+            log("Excluded files changed. Doing a full rebuild.")
+            return None
+    return since
+
+
+def update_student_files(config: Dict[str, Any],
+                         student_path: Path,
+                         changes: Sequence[Tuple[str, str]]) -> List[Path]:
+    """
+    Apply the {changes} (see :func:`changed_paths`) of the course to the
+    student repository at {student_path}: copy added and modified files and
+    delete removed files, together with the outputs of removed notebooks.
+
+    Returns:
+        The copied notebooks that have to be converted.
+    """
+    base_path = config["base_path"]
+    output_dir = base_path.joinpath(config["git"]["output_dir"]).absolute()
+    targets = get_targets(config)
+    notebooks = []
+    for status, name in changes:
+        src = base_path.joinpath(name)
+        dst = student_path.joinpath(name)
+        if output_dir in src.absolute().parents:
+            continue
+        is_notebook = name.lower().endswith(".ipynb")
+        if status == "D":
+            log(f"Removing {name}")
+            dst.unlink(missing_ok=True)
+            if is_notebook:
+                for target in targets:
+                    out = format_path(dst, target.get("path"), student_path, target["type"])
+                    if out is not None and out.is_file():
+                        log(f"Removing {out}")
+                        out.unlink()
+        else:
+            log(f"Copying {name}")
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(src, dst)
+            if is_notebook and not any(part.startswith(".") for part in Path(name).parts):
+                notebooks.append(dst)
+    return filter_notebooks(notebooks, config["convert"]["ignore"], student_path)
+
+
+def ci_incremental(config: Dict[str, Any], since: Optional[str] = None) -> Optional[git.Repo]:
+    """
+    Like steps 1-4 of :func:`ci`, but only files changed since the course
+    commit the student repository was last converted from (recorded in the
+    trailer of the last student commit, or given as {since}) are copied,
+    deleted or converted.
+
+    Returns:
+        The updated student repository, or None if a full rebuild is
+        required, e.g. because the recorded commit is not available in a
+        shallow clone or ``config.yaml`` changed.
+    """
+    base_path = config["base_path"]
+    repo = urnc.git.get_repo(base_path)
+    if config["ci"]["commit"] and repo and repo.is_dirty():
+        raise click.UsageError("Repo is not clean. Commit your changes first.")
+    with phase("prepare"):
+        student_repo = clone_student_repo(config)
+    since = incremental_base(config, student_repo, since)
+    if since is None:
+        return None
+    try:
+        changes = changed_paths(base_path, since)
+    except git.GitCommandError:
+        warn(f"Commit {since} is not available, e.g. because of a shallow clone. Falling back to a full rebuild.")
+        return None
+    if any(name == "config.yaml" for _, name in changes):
+        log("config.yaml changed. Doing a full rebuild.")
+        return None
+    log(f"Updating student repo incrementally: {len(changes)} files changed since {since}")
+    student_path = Path(student_repo.working_dir)
+    # Written again by publish_student_repo
+    student_path.joinpath(".gitignore").unlink(missing_ok=True)
+    with phase("prepare"):
+        notebooks = update_student_files(config, student_path, changes)
+    config["base_path"] = student_path
+    targets = get_targets(config)
+    plan = []
+    for i, target in enumerate(targets):
+        for nb in notebooks:
+            for nb_path, out_file in find_jobs(nb, target.get("path", None), target["type"], config):
+                plan.append(PlanEntry(nb_path, target["type"], out_file,
+                                      write_decision(out_file, config["convert"]["write_mode"]), target=i))
+    check_collisions(plan)
+    urnc.convert.convert(config, student_path, targets, plan=plan)
+    log(f"{len(notebooks)} notebooks converted")
+    return student_repo
+
+
+def ci(config: Dict[str, Any], incremental: bool = False, since: Optional[str] = None) -> None:
     """
     Performs a continuous integration run by:
 
@@ -183,6 +475,7 @@ def ci(config: Dict[str, Any]) -> None:
     2. Deleting all non-hidden files in STUDENT_PATH
     3. Copying all non-hidden files from ADMIN_PATH to STUDENT_PATH
     4. Converting all notebooks in STUDENT_PATH according to CONVERT_SETTINGS
+       (and compressing oversized images if ``convert.images.compress`` is set)
     5. Updating STUDENT_PATH/.gitignore according to GIT_EXCLUDES
     6. Commiting and pushing the changes if COMMIT is True
 
@@ -197,61 +490,93 @@ def ci(config: Dict[str, Any]) -> None:
     For a list of configuration values, see
     https://spang-lab.github.io/urnc/configuration.html
 
+    If {incremental} is set or a commit {since} is given, steps 2-4 only
+    process the files changed since the last conversion, see
+    :func:`ci_incremental`.
+
     Parameters:
         config: configuration dictionary as returned by `urnc.config.read()`
+        incremental: Only process files changed since the course commit
+            recorded in the last student commit.
+        since: Only process files changed since this course commit.
 
     Raises:
         Exception: If the repository is dirty and commit is True.
     """
     base_path = config["base_path"]
-    repo = urnc.git.get_repo(base_path)
-    if not repo:
-        warn("Not in a git repository")
+    student_repo = None
+    if incremental or since:
+        student_repo = ci_incremental(config, since)
+    if student_repo is None:
+        config["base_path"] = base_path
+        with phase("prepare"):
+            student_repo = prepare_student_repo(config)
+        student_path = Path(student_repo.working_dir)
+        config["base_path"] = student_path
+        # The copied notebooks are not tracked by the student repository
+        config["convert"]["discovery"]["backend"] = "walk"
+        urnc.convert.convert(config, student_path, get_targets(config))
+        log("Notebooks converted")
+    publish_student_repo(config, base_path, student_repo)
+
+
+def ci_shard(config: Dict[str, Any], shard: Shard, bundle_dir: Union[str, Path]) -> Path:
+    """
+    Converts the notebooks of one shard of the course, as ``urnc ci`` would,
+    and writes all files that differ from the main repository to an artifact
+    bundle in {bundle_dir}. The student repository is not touched. Combine
+    the bundles of all shards with :func:`ci_merge`.
 
-    # Make sure main repo is clean if we want to commit and push to student remote
-    if config["ci"]["commit"] and repo and repo.is_dirty():
-        raise click.UsageError("Repo is not clean. Commit your changes first.")
+    Parameters:
+        config: configuration dictionary as returned by `urnc.config.read()`
+        shard: Tuple (index, count), with index starting at 1.
+        bundle_dir: Directory the bundle is written to.
 
-    # Clone and clear student repo. Then copy over files from main repo
-    student_repo = clone_student_repo(config)
+    Returns:
+        Path of the written bundle.
+    """
+    base_path = config["base_path"]
+    bundle_dir = urnc.config.resolve_path(config, bundle_dir)
+    output_dir = base_path.joinpath(config["git"]["output_dir"])
+    with tempfile.TemporaryDirectory() as tmp:
+        work_path = Path(tmp).joinpath(base_path.name)
+        copy_course(base_path, work_path, skip=[output_dir, bundle_dir])
+        config["base_path"] = work_path
+        config["convert"]["shard"] = shard
+        config["convert"]["discovery"]["backend"] = "walk"  # work_path is no git repo
+        notebooks = discover_notebooks(work_path, None, config)
+        notebooks = shard_notebooks(notebooks, work_path, shard, config["convert"]["shard_by"])
+        urnc.convert.convert(config, work_path, get_targets(config))
+        log("Notebooks converted")
+        files = changed_files(base_path, work_path)
+        bundle = bundle_dir.joinpath(bundle_name(shard))
+        write_bundle(bundle, work_path, files, shard, [relpath(nb, work_path) for nb in notebooks])
+    config["base_path"] = base_path
+    return bundle
+
+
+def ci_merge(config: Dict[str, Any], bundle_dir: Union[str, Path]) -> None:
+    """
+    Like :func:`ci`, but instead of converting the notebooks, the converted
+    files are taken from the bundles written by :func:`ci_shard` for every
+    shard. Aborts if a bundle is missing or a notebook was not converted by
+    any shard, so unconverted notebooks are never published.
+    """
+    base_path = config["base_path"]
+    bundle_dir = urnc.config.resolve_path(config, bundle_dir)
+    bundles = read_bundles(bundle_dir)
+    student_repo = prepare_student_repo(config, skip=[bundle_dir])
     student_path = Path(student_repo.working_dir)
-    clear_repo(student_repo)
-
-    def ignore_fn(dir: str, files: List[str]) -> List[str]:
-        ignore_list = [".git"] if ".git" in files else []
-        if Path(dir) == student_path.parent:
-            log(f"Skipping copy of {student_path}")
-            ignore_list.append(basename(student_path))
-        return ignore_list
-
-    shutil.copytree(base_path, student_path, ignore=ignore_fn, dirs_exist_ok=True)
-
-    targets = config["convert"]["targets"]
-    if not targets:
-        targets = [{"type": "student", "path": "{nb.abspath}"}]
     config["base_path"] = student_path
-    urnc.convert.convert(config, student_path, targets)
-
-    log("Notebooks converted")
-    # Update .gitignore and drop cached files
-    log("Updating .gitignore from config")
-    write_gitignore(
-        main_gitignore=base_path.joinpath(".gitignore"),
-        student_gitignore=student_path.joinpath(".gitignore"),
-        config=config,
-    )
-    log("Dropping cached files...")
-    update_index(student_repo)
-
-    # Commit and push
-    if config["ci"]["commit"]:
-        log("Adding files and commiting")
-        student_repo.git.add(all=True)
-        student_repo.index.commit("urnc convert")
-        log("Pushing student repo")
-        student_repo.git.push()
-        log("Done.")
-    else:
-        log("Skipping git commit and push")
-        log("Done.")
-    urnc.util.release_locks(student_repo)
+    converted = set()
+    for bundle, manifest in bundles.items():
+        log(f"Merging shard {manifest['shard']}/{manifest['count']} from {bundle}")
+        extract_bundle(bundle, student_path)
+        converted.update(manifest["notebooks"])
+    output_dir = base_path.joinpath(config["git"]["output_dir"])
+    notebooks = discover_notebooks(base_path, output_dir, config)
+    missing = sorted(set(relpath(nb, base_path) for nb in notebooks) - converted)
+    if missing:
+        critical(f"Notebooks not converted by any shard: {', '.join(missing)}")
+    log("Shards merged")
+    publish_student_repo(config, base_path, student_repo)
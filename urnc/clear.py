@@ -0,0 +1,184 @@
+"""Clearing of cell outputs without loading notebooks into memory"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, BinaryIO, List, Optional, Set, TextIO, Union
+
+import nbformat
+from nbformat.v4.rwbase import rejoin_lines, split_lines, strip_transient
+
+from urnc.logger import dbg
+from urnc.nbstream import (BEGIN_ARRAY, COLON, COMMA, END_ARRAY, END_OBJECT, LITERAL, STRING_ARRAY,
+                           iter_events)
+
+# Start of every notebook written by nbformat, as "cells" is the first key
+_PREFIX = '{\n "cells": ['
+
+
+class UnsupportedNotebook(Exception):
+    """Raised if a notebook cannot be cleared by streaming"""
+
+
+def _dumps(node: Any) -> str:
+    # Same options as nbformat's JSONWriter
+    return json.dumps(node, indent=1, sort_keys=True, separators=(",", ": "), ensure_ascii=False)
+
+
+def _clear_cell(data: bytes, minor: int) -> nbformat.NotebookNode:
+    """
+    Parse the cell {data} (with outputs already removed) and apply the same
+    transformations as reading the notebook with nbformat, running
+    :class:`ClearOutputs` and writing it again. The cell is validated against
+    the schema of format version 4.{minor}.
+    """
+    cell = nbformat.from_dict(json.loads(data))
+    nb = nbformat.from_dict({"cells": [cell], "metadata": {}})
+    rejoin_lines(nb)
+    strip_transient(nb)
+    if cell.cell_type == "code":
+        cell.outputs = []
+        cell.execution_count = None
+    elif "outputs" in cell:
+        raise UnsupportedNotebook(f"{cell.cell_type} cell with outputs")
+    nbformat.validate(cell, ref="cell", version=4, version_minor=minor, relax_add_props=True)
+    split_lines(nb)
+    strip_transient(nb)
+    return cell
+
+
+def stream_clear(src: BinaryIO, dst: TextIO, chunk_size: int = 1 << 20) -> None:
+    """
+    Write the notebook in {src} with cleared outputs and execution counts to
+    {dst}. The output is identical to reading the notebook with nbformat,
+    clearing it with :class:`ClearOutputs` and exporting it with nbconvert's
+    NotebookExporter. Outputs are skipped while tokenizing and cells are
+    written one at a time, so memory usage does not depend on the size of
+    the outputs.
+
+    Raises:
+        UnsupportedNotebook: If the notebook would be changed in other ways
+            by nbformat, e.g. because it has an old format version or cell
+            ids have to be generated. Parts of the notebook might already
+            have been written to {dst} in this case.
+    """
+    skeleton: List[bytes] = []  # top-level object with an empty cells list
+    cell: List[bytes] = []
+    ncells = 0
+    ids: Set[str] = set()
+    missing_ids = False
+    minor: Optional[int] = None
+    schemas: Set[int] = set()  # minor versions the cells were validated with
+    replace_value = False  # next token is the value of a cell's outputs
+    skip_outputs = False  # inside the outputs array of a cell
+    dst.write(_PREFIX)
+    for path, (kind, raw, _) in iter_events(src, chunk_size):
+        depth = len(path)
+        if depth >= 2 and path[0] == "cells":
+            if skip_outputs:
+                if depth == 3 and kind == END_ARRAY:
+                    skip_outputs = False
+                continue
+            if replace_value:
+                replace_value = False
+                if kind == BEGIN_ARRAY:
+                    skip_outputs = True
+                elif kind != STRING_ARRAY or json.loads(raw) != []:
+                    raise UnsupportedNotebook("Cell outputs are not an array")
+                cell.append(b"[]")
+                continue
+            if depth == 3 and kind == COLON and path[2] == "outputs":
+                replace_value = True
+            cell.append(raw)
+            if depth == 2 and kind == END_OBJECT:
+                # Usually nbformat_minor is not known yet, as "cells" is the
+                # first key. Guess it from the cell and check it at the end.
+                schema = minor if minor is not None else 5 if b'"id"' in cell else 4
+                schemas.add(schema)
+                node = _clear_cell(b"".join(cell), schema)
+                cell.clear()
+                if "id" in node:
+                    if node.id in ids:
+                        raise UnsupportedNotebook(f"Duplicate cell id {node.id}")
+                    ids.add(node.id)
+                else:
+                    missing_ids = True
+                dst.write(",\n  " if ncells else "\n  ")
+                dst.write(_dumps(node).replace("\n", "\n  "))
+                ncells += 1
+        elif depth == 1 and path[0] == "cells" and kind in (BEGIN_ARRAY, END_ARRAY, COMMA):
+            if kind != COMMA:
+                skeleton.append(raw)
+        else:
+            skeleton.append(raw)
+            if depth == 1 and path[0] == "nbformat_minor" and kind == LITERAL:
+                minor = int(raw)
+    if cell or replace_value or skip_outputs:
+        raise UnsupportedNotebook("Invalid cells")
+
+    nb = nbformat.from_dict(json.loads(b"".join(skeleton)))
+    if nb.get("nbformat") != 4 or not isinstance(nb.get("nbformat_minor"), int) or nb.get("cells") != []:
+        raise UnsupportedNotebook("Only notebooks in format version 4 are supported")
+    if schemas - {nb.nbformat_minor}:
+        raise UnsupportedNotebook("Cells were validated against a different format version")
+    if nb.nbformat_minor >= 5 and missing_ids:
+        raise UnsupportedNotebook("Cell ids have to be generated")
+    strip_transient(nb)
+    nbformat.validate(nb, relax_add_props=True)
+    text = _dumps(nb)
+    if not text.startswith(_PREFIX + "]"):
+        raise UnsupportedNotebook("Unexpected top-level keys")
+    dst.write(text[len(_PREFIX):] if ncells == 0 else "\n " + text[len(_PREFIX):])
+    dst.write("\n")
+
+
+def is_clear(path: Union[str, Path]) -> bool:
+    """
+    Return True if no cell of the notebook at {path} has outputs or an
+    execution count, i.e. clearing its outputs would not change it. The
+    notebook is scanned without loading it and the scan stops at the first
+    output. Returns False for files that cannot be parsed.
+    """
+    key = None  # key of the value read next
+    try:
+        with open(path, "rb") as f:
+            for location, (kind, raw, _) in iter_events(f):
+                if key is not None:
+                    if key == "outputs" and not (kind == STRING_ARRAY and json.loads(raw) == []):
+                        return False
+                    if key == "execution_count" and raw != b"null":
+                        return False
+                    key = None
+                elif len(location) == 3 and location[0] == "cells" and kind == COLON:
+                    if location[2] in ("outputs", "execution_count"):
+                        key = location[2]
+    except Exception:
+        return False
+    return True
+
+
+def clear_file(input: Union[str, Path], output: Union[str, Path], chunk_size: int = 1 << 20) -> bool:
+    """
+    Write the notebook at {input} with cleared outputs to {output} using
+    :func:`stream_clear`. {output} is replaced atomically, so it can be the
+    same as {input}.
+
+    Returns:
+        True on success. False if the notebook is not supported by
+        :func:`stream_clear`, in which case nothing is written.
+    """
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+    try:
+        with open(input, "rb") as src, open(tmp, "w", newline="\n") as dst:
+            stream_clear(src, dst, chunk_size)
+        if output.exists():
+            shutil.copymode(output, tmp)
+        os.replace(tmp, output)
+    except Exception as err:
+        dbg(f"Cannot clear {input} by streaming ({err}). Using regular conversion.")
+        tmp.unlink(missing_ok=True)
+        return False
+    return True
@@ -0,0 +1,181 @@
+"""Recompression of oversized raster images for the student version"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import click
+
+from urnc.logger import dbg, log, warn
+from urnc.preprocessor.util import string_to_byte
+from urnc.util import get_cache_dir
+
+# Maps file suffixes to the Pillow format used for re-encoding. Only raster
+# formats that can be re-encoded without changing the file suffix are listed,
+# so references in notebooks stay valid.
+image_formats: Dict[str, str] = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+}
+
+# Bump whenever the compression strategy changes to invalidate cached results
+CACHE_VERSION = "1"
+
+
+def find_images(root: Path, min_size: int = 0) -> List[Path]:
+    """
+    Recursively find all raster images below {root} that are larger than
+    {min_size} bytes, excluding hidden directories.
+    """
+    images = []
+    for dirpath, dirs, files in os.walk(root, topdown=True):
+        dirs[:] = [d for d in dirs if not d[0] == "."]
+        for file in files:
+            if Path(file).suffix.lower() not in image_formats:
+                continue
+            path = Path(dirpath).joinpath(file)
+            if path.stat().st_size > min_size:
+                images.append(path)
+    return sorted(images)
+
+
+def _import_pillow() -> Any:
+    try:
+        from PIL import Image
+    except ImportError:
+        msg = ("Image compression requires Pillow. " +
+               "Install it with 'pip install urnc[images]'.")
+        raise click.UsageError(msg)
+    return Image
+
+
+def _encode(image: Any, format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if format == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def compress_image_data(data: bytes, format: str, max_size: int) -> bytes:
+    """
+    Re-encode the image given as {data} until it is at most {max_size} bytes.
+
+    PNGs are first optimized losslessly, then quantized to 256 colors. JPEGs
+    are re-encoded with decreasing quality. If this is not sufficient, the
+    image is downscaled step by step. The smallest encoding found is returned,
+    even if it still exceeds {max_size}.
+
+    Args:
+        data: The encoded source image.
+        format: The Pillow format to encode to, e.g. 'PNG' or 'JPEG'.
+        max_size: The maximum size of the result in bytes.
+
+    Returns:
+        The re-encoded image.
+    """
+    Image = _import_pillow()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    best = data
+
+    def attempt(candidate: Any, quality: int = 85) -> bool:
+        nonlocal best
+        encoded = _encode(candidate, format, quality)
+        if len(encoded) < len(best):
+            best = encoded
+        return len(best) <= max_size
+
+    if format == "PNG":
+        if attempt(image):
+            return best
+        if image.mode not in ("P", "1", "L"):
+            quantized = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+            if attempt(quantized):
+                return best
+            image = quantized
+    else:
+        for quality in (85, 75, 65, 55):
+            if attempt(image, quality):
+                return best
+
+    while min(image.size) > 16:
+        factor = max(min((max_size / len(best)) ** 0.5 * 0.95, 0.9), 0.5)
+        width, height = image.size
+        size = (max(int(width * factor), 1), max(int(height * factor), 1))
+        resample = Image.Resampling.NEAREST if image.mode == "P" else Image.Resampling.LANCZOS
+        image = image.resize(size, resample)
+        if attempt(image, 75):
+            return best
+    return best
+
+
+def compress_image(path: Path,
+                   max_size: int,
+                   cache_dir: Optional[Path] = None) -> bool:
+    """
+    Replace the image at {path} with a version of at most {max_size} bytes.
+
+    Results are cached in {cache_dir} by hash of the source image, so repeated
+    runs on unchanged images do not recompress anything.
+
+    Returns:
+        True if the file at {path} was replaced, False otherwise.
+    """
+    format = image_formats[path.suffix.lower()]
+    data = path.read_bytes()
+    if len(data) <= max_size:
+        return False
+    key = hashlib.sha256(data)
+    key.update(f"{CACHE_VERSION}:{format}:{max_size}".encode())
+    cache_file = cache_dir.joinpath(key.hexdigest() + path.suffix.lower()) if cache_dir else None
+    if cache_file and cache_file.exists():
+        dbg(f"Using cached compressed version of {path}")
+        compressed = cache_file.read_bytes()
+    else:
+        try:
+            compressed = compress_image_data(data, format, max_size)
+        except click.UsageError:
+            raise
+        except Exception as err:
+            warn(f"Failed to compress image {path}: {err}")
+            return False
+        if cache_file:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(cache_file.suffix + ".tmp")
+            tmp_file.write_bytes(compressed)
+            os.replace(tmp_file, cache_file)
+    if len(compressed) >= len(data):
+        return False
+    if len(compressed) > max_size:
+        warn(f"Could not compress {path} below {max_size / 1024:.1f} KiB.")
+    log(f"Compressed {path} from {len(data) / 1024:.1f} KiB to {len(compressed) / 1024:.1f} KiB")
+    path.write_bytes(compressed)
+    return True
+
+
+def compress_images(root: Union[str, Path], config: Dict[str, Any]) -> int:
+    """
+    Compress all raster images below {root} that exceed the size configured in
+    ``convert.images.max_size``. Intended for the student tree created by
+    `urnc ci`, as files are replaced in place.
+
+    Returns:
+        The number of replaced images.
+    """
+    images_config = config["convert"]["images"]
+    max_size = string_to_byte(images_config["max_size"])
+    cache_dir = images_config.get("cache_dir")
+    cache_dir = Path(cache_dir).expanduser() if cache_dir else get_cache_dir("images")
+    count = 0
+    for path in find_images(Path(root), max_size):
+        if compress_image(path, max_size, cache_dir):
+            count += 1
+    log(f"Compressed {count} oversized images")
+    return count
@@ -87,6 +87,22 @@ def default_config(root: Union[str,Path]) -> Dict[str, Any]:
             "write_mode": WriteMode.SKIP_EXISTING,
             "ignore": [],
             "targets": [],
+            "shard": None,
+            "shard_by": "hash",
+            "discovery": {
+                "backend": "walk",
+                "untracked": False,
+            },
+            "images": {
+                "max_size": "250 KiB",
+                "compress": False,
+                "cache_dir": None,
+            },
+            "extract": {
+                "enabled": False,
+                "min_size": "4 KiB",
+                "path": "_files",
+            },
             "keywords": {
                 "solution": ["solution"],
                 "skeleton": ["skeleton"],
@@ -106,6 +122,38 @@ def default_config(root: Union[str,Path]) -> Dict[str, Any]:
             "output_dir": "out",
             "exclude": [],
         },
+        "execute": {
+            "truncate_outputs": False,
+            "max_output_lines": 1000,
+            "max_output_size": "100 KiB",
+            "kernel_pool_size": 0,
+            "warmup": "",
+            "parallel": 1,
+            "dependencies": {},
+            "timing": {
+                "top": 10,
+                "export": None,
+            },
+            "limits": {
+                "notebook_timeout": None,
+                "cell_timeout": None,
+                "max_memory": None,
+            },
+            "checkpoints": False,
+            "checkpoint_dir": None,
+            "resume": False,
+        },
+        "metrics": {
+            "export": None,
+        },
+        "trace": {
+            "export": None,
+        },
+        "check": {
+            "notebook_budget": None,
+            "total_budget": None,
+            "top": 5,
+        },
         "ci": {
             "commit": False,
             "push": False,
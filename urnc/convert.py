@@ -1,15 +1,21 @@
-from typing import List, Optional, Union, Dict, Any, Sequence
-from pathlib import Path
 import os
+from typing import List, Optional, Union, Dict, Any, Iterable, Iterator, Sequence
+from pathlib import Path
 
 import nbformat
 import click
-import fnmatch
 
 from urnc.logger import log, warn, critical
-from urnc.format import format_path, is_directory_path
+from urnc.clear import clear_file, is_clear
+from urnc import trace
+from urnc.metrics import add, add_file_size, phase
 from urnc.config import WriteMode, TargetType
+from urnc.schedule import SKIPPED, async_run_graph, read_dependencies
+from urnc.plan import SKIP, PlanEntry, create_plan, filter_notebooks, find_jobs, find_notebooks
+from urnc.timing import NotebookTiming, export_timing_report, log_timing_report
+from urnc.util import Pool, get_cache_dir
 
+from jupyter_core.utils import run_sync
 from traitlets.config import Config
 from nbconvert.exporters.notebook import NotebookExporter
 from urnc.preprocessor.add_tags import AddTags
@@ -19,49 +25,7 @@ from urnc.preprocessor.solutions import SolutionProcessor
 from urnc.preprocessor.clear_outputs import ClearOutputs
 from urnc.preprocessor.executor import ExecutePreprocessor
 from urnc.preprocessor.clear_tagged import ClearTaggedCells
-
-
-def find_notebooks(input: Path, output_path: Optional[Path]) -> List[Path]:
-    """
-    Recursively find all Jupyter notebooks (*.ipynb) in the input directory,
-    excluding hidden directories (those starting with a dot).
-    Notebooks that are located inside the output_path directory (if given)
-    are skipped.
-
-    Args:
-        input (Path): The root directory to search for notebooks.
-        output_path (Optional[Path]): Directory to exclude notebooks from (e.g., output directory).
-
-    Returns:
-        List[Path]: Sorted list of notebook file paths found.
-    """
-    notebooks = []
-    if not input.is_dir():
-        critical(f"Input path '{input}' is not a directory. Aborting.")
-    for root, dirs, files in os.walk(input, topdown=True):
-        dirs[:] = [d for d in dirs if not d[0] == "."]
-        files[:] = [f for f in files if f.lower().endswith(".ipynb")]
-        for file in files:
-            path = Path(root).joinpath(file)
-            if output_path in path.parents:
-                log(f"Skipping notebook {path} because it is in the output directory.")
-                continue
-            notebooks.append(path)
-    return sorted(notebooks)
-
-
-def filter_notebooks(notebooks: List[Path], ignore_patterns: List[str]) -> List[Path]:
-    filtered = []
-    for nb in notebooks:
-        ignore = False
-        for pattern in ignore_patterns:
-            if fnmatch.fnmatch(nb.name, pattern):
-                log(f"Ignoring notebook {nb} because it matches pattern '{pattern}'")
-                ignore = True
-                break
-        if not ignore:
-            filtered.append(nb)
-    return filtered
+from urnc.preprocessor.extract_outputs import ExtractOutputs
 
 
 def write_notebook(notebook: str, path: Optional[Path], config: Dict[str, Any]):
@@ -92,24 +56,132 @@ def write_notebook(notebook: str, path: Optional[Path], config: Dict[str, Any]):
 
     with open(path, "w", newline="\n") as f:
         f.write(notebook)
+    add("urnc_written_bytes", len(notebook.encode("utf-8")))
+
+
+def write_files(files: Dict[str, bytes], path: Optional[Path], config: Dict[str, Any]):
+    """
+    Write files extracted from the notebook at {path} (e.g. by
+    :class:`ExtractOutputs`). Filenames in {files} are relative to the
+    directory of {path}. As extracted files are content-addressed, existing
+    files are never rewritten.
+    """
+    if not path or not files:
+        return
+    if config["convert"]["write_mode"] == WriteMode.DRY_RUN:
+        log(f"Would write {len(files)} extracted files next to {path}. Skipping, because dry_run is set.")
+        return
+    for filename, data in files.items():
+        file_path = path.parent.joinpath(filename)
+        if file_path.exists():
+            continue
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(data)
+        add("urnc_written_bytes", len(data))
 
 
 def convert(config: Dict[str, Any],
             input: Union[str, Path],
-            targets: Sequence[Dict[str, Any]]) -> None:
+            targets: Sequence[Dict[str, Any]],
+            plan: Optional[Sequence[PlanEntry]] = None) -> None:
+    """
+    Convert {input} to all {targets}. If a {plan} (see :func:`urnc.plan.create_plan`)
+    is given, its entries are converted instead. Entries whose existing
+    output would be skipped are not converted at all. Notebooks cleared or
+    fixed in place are only written if they change.
+    """
     input = Path(input)
-    if len(targets) == 0:
-        warn("No targets specified in convert.config. Exiting.")
-        return
+    if plan is None:
+        if len(targets) == 0:
+            warn("No targets specified in convert.config. Exiting.")
+            return
+        with phase("discover"):
+            plan = create_plan(config, input, targets)
+    # Notebooks are counted per target, every job ends up in exactly one
+    # state: converted, cached or skipped
+    add("urnc_notebooks", len(plan), state="discovered")
+    groups: Dict[tuple[int, str], List[tuple[Path, Optional[Path]]]] = {}
+    for entry in plan:
+        if entry.action == SKIP:
+            log(f"Skipping existing file {entry.output}")
+            add("urnc_notebooks", state="skipped")
+            continue
+        groups.setdefault((entry.target, entry.type), []).append((entry.input, entry.output))
     converted_notebooks = []
-    for i, target in enumerate(targets):
-        type = target.get("type", None)
-        if type is None:
-            critical(f"Target type not specified in target {i}. Aborting.")
-        path = target.get("path", None)
-        converted_notebooks.extend(convert_target(input, path, type, config))
-    for body, output_path in converted_notebooks:
-        write_notebook(body, output_path, config)
+    in_place, unchanged = 0, 0
+    with phase("convert"):
+        for (_, type), jobs in groups.items():
+            if type in (TargetType.CLEAR, TargetType.FIX):
+                in_place += sum(is_in_place(*job) for job in jobs)
+            if type == TargetType.CLEAR:
+                clean = [job for job in jobs if is_in_place(*job) and is_clear(job[0])]
+                for notebook_path, _ in clean:
+                    log(f"Skipping {notebook_path}, because it has no outputs")
+                unchanged += len(clean)
+                add("urnc_notebooks", len(clean), state="skipped")
+                jobs = clear_notebooks([job for job in jobs if job not in clean], config)
+                if not jobs:
+                    continue
+            results = convert_target(input, None, type, config, jobs=jobs)
+            if type == TargetType.FIX:
+                # Notebooks without fixed image paths are not returned
+                outputs = {out for nb, out in jobs if is_in_place(nb, out)}
+                unchanged += len(outputs) - sum(out in outputs for _, out, _ in results)
+            converted_notebooks.extend(results)
+    with phase("write"):
+        for body, output_path, files in converted_notebooks:
+            write_notebook(body, output_path, config)
+            write_files(files, output_path, config)
+    if in_place:
+        log(f"{in_place - unchanged} changed, {unchanged} already clean")
+
+
+def is_in_place(notebook_path: Path, output_path: Optional[Path]) -> bool:
+    """Return True if {output_path} is the notebook at {notebook_path} itself."""
+    if output_path is None:
+        return False
+    return os.path.normcase(os.path.abspath(output_path)) == os.path.normcase(os.path.abspath(notebook_path))
+
+
+def clear_notebooks(jobs: Sequence[tuple[Path, Optional[Path]]],
+                    config: Dict[str, Any]) -> List[tuple[Path, Optional[Path]]]:
+    """
+    Clear the outputs of the notebooks in {jobs} by streaming them to their
+    output paths (see :func:`urnc.clear.clear_file`), so large notebooks are
+    never loaded into memory. The result is identical to the regular
+    conversion with :class:`ClearOutputs`.
+
+    Returns:
+        The jobs that have to be converted regularly, i.e. jobs without
+        output path, notebooks not supported by streaming and all jobs if
+        the write mode requires confirmation or is a dry run.
+    """
+    write_mode = config["convert"]["write_mode"]
+    if write_mode not in (WriteMode.OVERWRITE, WriteMode.SKIP_EXISTING):
+        return list(jobs)
+    remaining = []
+    for notebook_path, output_path in jobs:
+        if output_path is None:
+            remaining.append((notebook_path, output_path))
+            continue
+        if output_path.exists():
+            if write_mode == WriteMode.SKIP_EXISTING:
+                log(f"Skipping existing file {output_path}")
+                add("urnc_notebooks", state="skipped")
+                continue
+            message = f"Overwriting existing file {output_path}"
+        else:
+            message = f"Writing notebook to {output_path}"
+        log(f"Converting {notebook_path.name}")
+        if clear_file(notebook_path, output_path):
+            log(message)
+            add("urnc_notebooks", state="converted")
+            add_file_size("urnc_read_bytes", notebook_path)
+            add_file_size("urnc_written_bytes", output_path)
+        else:
+            remaining.append((notebook_path, output_path))
+    return remaining
 
 
 def create_nb_config(config: Dict[str, Any]) -> Config:
@@ -126,60 +198,288 @@ def create_nb_config(config: Dict[str, Any]) -> Config:
     nb_config.AddTags.ignore_tag = tags["ignore"]
 
     nb_config.ImageChecker.base_path = str(config["base_path"])
+    nb_config.ImageChecker.max_image_size = convert["images"]["max_size"]
     nb_config.SolutionProcessor.solution_keywords = keywords["solution"]
     nb_config.SolutionProcessor.solution_tag = tags["solution"]
     nb_config.SolutionProcessor.skeleton_keywords = keywords["skeleton"]
 
     nb_config.ClearTaggedCells.tags = [tags["no-execute"]]
+
+    execute = config["execute"]
+    nb_config.CheckOutputs.truncate = execute["truncate_outputs"]
+    nb_config.CheckOutputs.max_output_lines = execute["max_output_lines"]
+    nb_config.CheckOutputs.max_output_size = execute["max_output_size"]
+
+    extract = convert["extract"]
+    nb_config.ExtractOutputs.min_size = extract["min_size"]
+    nb_config.ExtractOutputs.output_dir = extract["path"]
     return nb_config
 
 
-def convert_target(input: Union[str, Path],
-                   output: Union[str, Path, None],
-                   type: str,
-                   config: Dict[str, Any]) -> List[tuple[str, Union[Path, None]]]:
+def create_preprocessors(type: str, config: Dict[str, Any], nb_config: Config) -> List[Any]:
     """
-    Convert `input` to target `type`.
-    Returns List[Tuple[<notebook-as-string>, <output-path>]]
+    Return the preprocessors (classes or instances) that convert notebooks to
+    target {type}, adapting {nb_config} to the target. For target 'execute',
+    only the preprocessors run after the execution are returned.
     """
-    jobs = []
-    input = Path(input)
-    if input.is_file():
-        input_notebooks = [input]
-    else:
-        ignore = config["base_path"].joinpath(output) if is_directory_path(output) else None
-        input_notebooks = find_notebooks(input, ignore)
-        input_notebooks = filter_notebooks(input_notebooks, config["convert"]["ignore"])
-    for nb in input_notebooks:
-        out_file = format_path(nb, output=output, root=config["base_path"], type=type)
-        jobs.append((nb, out_file))
-    nb_config = create_nb_config(config)
-    preprocessors = None
     if type == TargetType.STUDENT:
-        preprocessors = [ImageChecker, AddTags, SolutionProcessor, ClearOutputs]
+        preprocessors = [ImageChecker(config=nb_config), AddTags, SolutionProcessor, ClearOutputs]
     elif type == TargetType.SOLUTION:
         nb_config.SolutionProcessor.output = "solution"
         preprocessors = [AddTags, SolutionProcessor, ClearOutputs]
     elif type == TargetType.EXECUTE:
-        preprocessors = [ClearTaggedCells, ExecutePreprocessor, CheckOutputs, ClearOutputs]
+        preprocessors = [CheckOutputs]
     elif type == TargetType.CLEAR:
         preprocessors = [ClearOutputs]
     elif type == TargetType.FIX:
         nb_config.ImageChecker.interactive = True
         nb_config.ImageChecker.autofix = True
-        preprocessors = [ImageChecker]
-
-    if preprocessors is None:
+        preprocessors = [ImageChecker(config=nb_config)]
+    else:
         critical(f"Unknown target type '{type}' in 'convert.targets'. Aborting.")
+    extract_types = (TargetType.STUDENT, TargetType.SOLUTION, TargetType.EXECUTE)
+    if config["convert"]["extract"]["enabled"] and type in extract_types:
+        preprocessors.append(ExtractOutputs)
+    return preprocessors
 
+
+def create_exporter(preprocessors: List[Any], nb_config: Config) -> NotebookExporter:
     nb_config.NotebookExporter.preprocessors = preprocessors
-    converter = NotebookExporter(config=nb_config)
+    exporter = NotebookExporter(config=nb_config)
+    if trace.enabled():
+        # The exporter also holds the disabled default preprocessors of nbconvert
+        exporter._preprocessors = [trace.traced(p, p.__class__.__name__) if getattr(p, "enabled", True) else p
+                                   for p in exporter._preprocessors]
+    return exporter
+
+
+def get_extract_dirs(jobs: Sequence[tuple[Path, Optional[Path]]], config: Dict[str, Any]) -> Dict[Path, str]:
+    """
+    Return the directory for extracted files of every notebook in {jobs},
+    relative to its output path. All outputs share one directory
+    `convert.extract.path` in the common parent directory of the outputs,
+    so files used by several notebooks are only stored once per target.
+    """
+    outputs = {nb: out.absolute().parent for nb, out in jobs if out is not None}
+    if not outputs:
+        return {}
+    root = Path(os.path.commonpath(list(outputs.values())))
+    directory = root.joinpath(config["convert"]["extract"]["path"])
+    return {nb: Path(os.path.relpath(directory, parent)).as_posix() for nb, parent in outputs.items()}
+
+
+def get_checkpoint_dir(execute: Dict[str, Any]) -> Optional[str]:
+    """Return the directory for execution checkpoints or None if disabled."""
+    if not execute["checkpoints"] and not execute["resume"]:
+        return None
+    return str(Path(execute["checkpoint_dir"] or get_cache_dir("checkpoints")).expanduser())
+
 
+def convert_target(input: Union[str, Path],
+                   output: Union[str, Path, None],
+                   type: str,
+                   config: Dict[str, Any],
+                   jobs: Optional[Sequence[tuple[Path, Optional[Path]]]] = None
+                   ) -> List[tuple[str, Union[Path, None], Dict[str, bytes]]]:
+    """
+    Convert `input` to target `type`. If `jobs` (tuples of input notebook and
+    output path, e.g. taken from a plan) are given, `input` and `output` are
+    ignored and exactly these notebooks are converted. Notebooks fixed in
+    place by target 'fix' are omitted from the result if no image path was
+    changed.
+    Returns List[Tuple[<notebook-as-string>, <output-path>, <extracted-files>]]
+    """
+    if jobs is None:
+        jobs = find_jobs(input, output, type, config)
+    nb_config = create_nb_config(config)
+    executor = None
+    if type == TargetType.EXECUTE:
+        # Not set via nb_config, because the section name 'ExecutePreprocessor'
+        # is shared with the (unused) default preprocessor of nbconvert.
+        execute = config["execute"]
+        executor = ExecutePreprocessor(config=nb_config,
+                                       kernel_pool_size=execute["kernel_pool_size"],
+                                       warmup_code=execute["warmup"],
+                                       notebook_timeout=execute["limits"]["notebook_timeout"],
+                                       cell_timeout=execute["limits"]["cell_timeout"],
+                                       max_memory=execute["limits"]["max_memory"],
+                                       progress_bar=execute["parallel"] <= 1,
+                                       checkpoint_dir=get_checkpoint_dir(execute),
+                                       resume=execute["resume"])
+        executor.start_kernel_pool(len(jobs))
+        # Tagged cells are cleared and notebooks are executed before the
+        # conversion, see `execute_notebook` below
+        clear_tagged = ClearTaggedCells(config=nb_config)
+    preprocessors = create_preprocessors(type, config, nb_config)
+    image_checker = next((p for p in preprocessors if isinstance(p, ImageChecker)), None)
+    converter = create_exporter(preprocessors, nb_config)
+
+    converted: Dict[Path, tuple[str, Dict[str, bytes]]] = {}
+    # State of converted notebooks for metrics, counted when the output is
+    # kept below
+    states: Dict[Path, str] = {}
+    unchanged: set[Path] = set()
+    notebooks: Dict[Path, nbformat.NotebookNode] = {}
+    timings: List[NotebookTiming] = []
+
+    extract_dirs = get_extract_dirs(jobs, config) if ExtractOutputs in preprocessors else {}
+
+    def notebook_resources(notebook_path: Path) -> Dict[str, Any]:
+        resources: Dict[str, Any] = {"path": notebook_path, "filename": notebook_path.name}
+        if notebook_path in extract_dirs:
+            resources["extract_dir"] = extract_dirs[notebook_path]
+        return resources
+
+    def convert_notebook(notebook_path: Path,
+                         nb_node: Optional[nbformat.NotebookNode] = None,
+                         resources: Optional[Dict[str, Any]] = None) -> bool:
+        if nb_node is None:
+            log(f"Converting {notebook_path.name}")
+            nb_node = nbformat.read(notebook_path, as_version=4)
+            add_file_size("urnc_read_bytes", notebook_path)
+        resources = resources or notebook_resources(notebook_path)
+        body, resources = converter.from_notebook_node(nb_node, resources)
+        converted[notebook_path] = (body, resources.get("outputs", {}))
+        if type == TargetType.FIX and not resources.get("fixed_images"):
+            unchanged.add(notebook_path)
+        if "timing" in resources:
+            timings.append(resources["timing"])
+        states[notebook_path] = "cached" if resources.get("execution_cached") else "converted"
+        if resources.get("execution_failed", False):
+            add("urnc_execution_failures")
+            return False
+        return True
+
+    def trace_notebook(notebook_path: Path) -> Any:
+        return trace.span(notebook_path.name, "notebook", path=str(notebook_path), target=type)
+
+    async def execute_notebook(notebook_path: Path) -> bool:
+        with trace_notebook(notebook_path) as span:
+            log(f"Converting {notebook_path.name}")
+            nb_node = notebooks.pop(notebook_path)
+            resources = notebook_resources(notebook_path)
+            with trace.span(clear_tagged.__class__.__name__, "preprocessor"):
+                nb_node, resources = clear_tagged(nb_node, resources)
+            with trace.span(executor.__class__.__name__, "preprocessor"):
+                nb_node, resources = await executor.async_preprocess(nb_node, resources)
+            ok = convert_notebook(notebook_path, nb_node, resources)
+            if not ok:
+                span.fail("failed", "execution failed")
+            return ok
+
+    try:
+        if executor is not None:
+            # Notebooks are executed in dependency order. Independent notebooks
+            # are executed concurrently from a single event loop.
+            notebooks = {nb: nbformat.read(nb, as_version=4) for nb, _ in jobs}
+            for nb, _ in jobs:
+                add_file_size("urnc_read_bytes", nb)
+            dependencies = read_dependencies(notebooks, config)
+            status = run_sync(async_run_graph)([nb for nb, _ in jobs], dependencies, execute_notebook,
+                                               workers=config["execute"]["parallel"], name=lambda nb: nb.name)
+            add("urnc_notebooks", sum(s == SKIPPED for s in status.values()), state="skipped")
+        else:
+            for notebook_path, _ in jobs:
+                with trace_notebook(notebook_path):
+                    convert_notebook(notebook_path)
+    finally:
+        if executor is not None:
+            executor.shutdown_kernel_pool()
     converted_notebooks = []
     for notebook_path, output_path in jobs:
-        log(f"Converting {notebook_path.name}")
-        nb_node = nbformat.read(notebook_path, as_version=4)
-        resources = {"path": notebook_path, "filename": notebook_path.name}
-        body, resources = converter.from_notebook_node(nb_node, resources)
-        converted_notebooks.append((body, output_path))
+        if notebook_path in converted:
+            if notebook_path in unchanged and is_in_place(notebook_path, output_path):
+                log(f"Skipping {notebook_path}, because no image paths were fixed")
+                add("urnc_notebooks", state="skipped")
+                continue
+            add("urnc_notebooks", state=states[notebook_path])
+            body, files = converted[notebook_path]
+            converted_notebooks.append((body, output_path, files))
+    if image_checker is not None:
+        image_checker.log_summary()
+    if timings:
+        timings.sort(key=lambda t: t.path)
+        timing_config = config["execute"]["timing"]
+        log_timing_report(timings, timing_config["top"])
+        if timing_config["export"]:
+            export_path = config["base_path"].joinpath(timing_config["export"])
+            export_timing_report(timings, export_path, root=config["base_path"])
     return converted_notebooks
+
+
+# Notebook as node, or as JSON text or bytes
+Notebook = Union[nbformat.NotebookNode, str, bytes]
+
+
+class ConvertedNotebook(object):
+    def __init__(self, notebook: str, files: Dict[str, bytes], resources: Dict[str, Any]):
+        """Result of converting one notebook with a :class:`Converter`.
+
+        Attributes:
+            notebook (str): Converted notebook as written by ``urnc convert``.
+            files (Dict[str, bytes]): Extracted outputs by relative path, see
+                `convert.extract`.
+            resources (Dict[str, Any]): Resources returned by the preprocessors.
+        """
+        self.notebook = notebook
+        self.files = files
+        self.resources = resources
+
+    def node(self) -> nbformat.NotebookNode:
+        """Return the converted notebook as NotebookNode."""
+        return nbformat.reads(self.notebook, as_version=4)
+
+
+class Converter(object):
+    in_memory_types = (TargetType.STUDENT, TargetType.SOLUTION, TargetType.CLEAR)
+
+    def __init__(self, config: Dict[str, Any], type: str = TargetType.STUDENT):
+        """
+        Converts notebooks in memory to target {type} ('student', 'solution'
+        or 'clear') according to {config}. No files are written. For target
+        'student', local images referenced by the notebooks are checked, but
+        remote images are not requested.
+
+        The converter is meant to be created once and reused. It can be shared
+        by several threads: every conversion borrows an exporter from a pool,
+        as the preprocessors keep state while converting a notebook.
+
+        Example:
+            converter = urnc.convert.Converter(urnc.config.read_config(course_path))
+            for result in converter.convert_all(notebooks):
+                upload(result.notebook)
+        """
+        if type not in self.in_memory_types:
+            raise ValueError(f"Target type '{type}' cannot be converted in memory. "
+                             f"Use one of {', '.join(self.in_memory_types)}.")
+        self.config = config
+        self.type = type
+        self.exporters = Pool(self.create_exporter)
+
+    def create_exporter(self) -> NotebookExporter:
+        nb_config = create_nb_config(self.config)
+        nb_config.ImageChecker.check_remote = False
+        return create_exporter(create_preprocessors(self.type, self.config, nb_config), nb_config)
+
+    def convert(self, notebook: Notebook, path: Union[str, Path, None] = None) -> ConvertedNotebook:
+        """
+        Convert {notebook}. {path} is the location of the notebook within the
+        course, used to check image paths. Default: `notebook.ipynb` in the
+        course root. The passed NotebookNode is not modified.
+        """
+        if not isinstance(notebook, nbformat.NotebookNode):
+            notebook = nbformat.reads(notebook, as_version=4)
+        path = Path(self.config["base_path"], path or "notebook.ipynb")
+        resources = {"path": path, "filename": path.name}
+        with self.exporters.acquire() as exporter:
+            body, resources = exporter.from_notebook_node(notebook, resources)
+        return ConvertedNotebook(body, resources.get("outputs", {}), resources)
+
+    def convert_all(self, notebooks: Iterable[Notebook]) -> Iterator[ConvertedNotebook]:
+        """
+        Convert {notebooks} one by one. Results are yielded as soon as they
+        are converted, so {notebooks} can be a generator, e.g. reading from a
+        queue, and only one notebook is held in memory at a time.
+        """
+        for notebook in notebooks:
+            yield self.convert(notebook)
@@ -39,3 +39,19 @@ def set_commit_names(repo):
     config_writer.set_value("user", "name", "urnc")
     config_writer.set_value("user", "email", "urnc@spang-lab.de")
     config_writer.release()
+
+
+def list_files(path, untracked=False):
+    """
+    Return the paths (relative to {path}) of all files below {path} that are
+    tracked by git, plus the untracked files that are not ignored if
+    {untracked} is True. Returns None if {path} is not inside a git repo.
+    """
+    args = ["-z", "--cached"]
+    if untracked:
+        args += ["--others", "--exclude-standard"]
+    try:
+        output = git.Git(str(path)).ls_files(*args)
+    except (git.GitCommandError, git.GitCommandNotFound):
+        return None
+    return [file for file in output.split("\0") if file]
@@ -0,0 +1,125 @@
+"""Pre-commit hook clearing the outputs of staged notebooks (`urnc check --clear --staged`)
+
+This module is imported by the hook on every commit, so it avoids importing
+nbconvert, papermill and GitPython. Git is called directly instead.
+"""
+
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from urnc.clear import clear_file, is_clear
+from urnc.logger import critical, dbg, log
+from urnc.plan import filter_notebooks
+
+
+def run_git(cwd: Path, *args: str, input: Optional[bytes] = None) -> bytes:
+    try:
+        result = subprocess.run(["git", *args], cwd=cwd, input=input, capture_output=True, check=True)
+    except FileNotFoundError:
+        critical("Git is not installed. Aborting.")
+    except subprocess.CalledProcessError as err:
+        critical(f"git {' '.join(args)} failed: {err.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def _split(output: bytes) -> List[str]:
+    return [name for name in output.decode("utf-8").split("\0") if name]
+
+
+def staged_notebooks(path: Path) -> List[Path]:
+    """Return all notebooks below {path} that are added or modified in the git index."""
+    output = run_git(path, "diff", "--cached", "--name-only", "--diff-filter=ACMR", "--relative", "-z")
+    return sorted(path.joinpath(name) for name in _split(output) if name.lower().endswith(".ipynb"))
+
+
+def unstaged_files(path: Path, files: Sequence[Path]) -> List[Path]:
+    """Return the {files} whose working tree version differs from the index."""
+    if not files:
+        return []
+    args = [os.path.relpath(file, start=path) for file in files]
+    output = run_git(path, "diff", "--name-only", "--relative", "-z", "--", *args)
+    return [path.joinpath(name) for name in _split(output)]
+
+
+def clear_notebook(path: Path) -> bool:
+    """
+    Clear the outputs of the notebook at {path} in place.
+
+    Returns:
+        True if the notebook was changed.
+    """
+    if is_clear(path):
+        return False
+    if not clear_file(path, path):
+        # Same conversion as `urnc check --clear`
+        import nbformat
+        from nbconvert.exporters.notebook import NotebookExporter
+        from urnc.preprocessor.clear_outputs import ClearOutputs
+        nb = nbformat.read(path, as_version=4)
+        body, _ = NotebookExporter(preprocessors=[ClearOutputs]).from_notebook_node(nb)
+        with open(path, "w", newline="\n") as f:
+            f.write(body)
+    return True
+
+
+def clear_index_entry(root: Path, notebook: Path) -> bool:
+    """
+    Clear the outputs of the staged version of {notebook} without touching
+    the working tree, which contains unstaged changes.
+
+    Returns:
+        True if the staged notebook was changed.
+    """
+    name = os.path.relpath(notebook, start=root).replace(os.sep, "/")
+    mode = run_git(root, "ls-files", "--stage", "-z", "--", name).decode("utf-8").split(" ")[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = Path(tmp).joinpath(notebook.name)
+        copy.write_bytes(run_git(root, "show", f":{name}"))
+        if not clear_notebook(copy):
+            return False
+        blob = run_git(root, "hash-object", "-w", "--", str(copy)).decode().strip()
+    run_git(root, "update-index", "--cacheinfo", f"{mode},{blob},{name}")
+    return True
+
+
+def clear_staged(config: Dict[str, Any], input: Path, workers: Optional[int] = None) -> List[Path]:
+    """
+    Clear the outputs of all notebooks below {input} that are staged in git
+    and stage the result. Notebooks are processed in parallel by {workers}
+    processes (default: number of CPUs). If a notebook also has unstaged
+    changes, only its staged version is cleared.
+
+    Returns:
+        The changed notebooks.
+    """
+    input = Path(input).absolute()
+    if input.is_file():
+        input = input.parent
+    root = Path(run_git(input, "rev-parse", "--show-toplevel").decode().strip())
+    notebooks = staged_notebooks(input)
+    notebooks = filter_notebooks(notebooks, config["convert"]["ignore"], config["base_path"])
+    if not notebooks:
+        dbg("No staged notebooks")
+        return []
+    partial = set(unstaged_files(input, notebooks))
+    full = [nb for nb in notebooks if nb not in partial]
+    workers = min(workers or os.cpu_count() or 1, len(full))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            changed = [nb for nb, result in zip(full, pool.map(clear_notebook, full)) if result]
+    else:
+        changed = [nb for nb in full if clear_notebook(nb)]
+    if changed:
+        run_git(root, "add", "--", *(os.path.relpath(nb, start=root) for nb in changed))
+    for nb in sorted(partial):
+        log(f"Clearing staged version of {nb}, which has unstaged changes")
+        if clear_index_entry(root, nb):
+            changed.append(nb)
+    for nb in sorted(changed):
+        log(f"Cleared outputs of {nb}")
+    log(f"{len(changed)} changed, {len(notebooks) - len(changed)} already clean")
+    return sorted(changed)
@@ -0,0 +1,123 @@
+"""Gitignore-style patterns for excluding notebooks and directories"""
+
+import re
+from functools import lru_cache
+from typing import List, Optional, Pattern, Sequence, Tuple
+
+
+class IgnorePattern(object):
+    def __init__(self, pattern: str):
+        """A single pattern with the semantics of a line in a ``.gitignore`` file.
+
+        Attributes:
+            pattern (str): The original pattern.
+            negate (bool): True for patterns starting with '!', which re-include
+                paths excluded by earlier patterns.
+            dir_only (bool): True for patterns ending with '/', which only
+                match directories.
+            regex (Pattern): Compiled regular expression matching relative
+                paths with forward slashes.
+        """
+        self.pattern = pattern
+        body = pattern
+        self.negate = body.startswith("!")
+        if self.negate or body.startswith("\\!") or body.startswith("\\#"):
+            body = body[1:]
+        self.dir_only = body.endswith("/")
+        body = body.rstrip("/")
+        # Patterns containing a slash are anchored at the root directory,
+        # all others match at any level
+        anchored = "/" in body
+        body = body.lstrip("/")
+        prefix = "" if anchored else "(?:.*/)?"
+        self.regex: Pattern[str] = re.compile(f"^{prefix}{translate(body)}$", re.DOTALL)
+
+    def match(self, path: str) -> bool:
+        return self.regex.match(path) is not None
+
+
+def translate(pattern: str) -> str:
+    """Translate the gitignore glob {pattern} to a regular expression."""
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i) and i + 2 == n and (i == 0 or pattern[i - 1] == "/"):
+            parts.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                content = pattern[i + 1:end]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                parts.append("[" + content.replace("\\", "\\\\") + "]")
+                i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+class IgnorePatterns(object):
+    def __init__(self, patterns: Sequence[str]):
+        """A list of gitignore-style patterns. Later patterns take precedence,
+        i.e. a path is ignored if the last matching pattern is not negated.
+        Empty patterns and comments (starting with '#') are skipped.
+        """
+        self.patterns: List[IgnorePattern] = [
+            IgnorePattern(p.strip()) for p in patterns if p.strip() and not p.strip().startswith("#")
+        ]
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def match(self, path: str, is_dir: bool = False) -> Optional[str]:
+        """
+        Return the pattern ignoring {path} (relative, with forward slashes) or
+        None if it is not ignored. Only the path itself is checked, not its
+        parent directories.
+        """
+        result = None
+        for pattern in self.patterns:
+            if pattern.dir_only and not is_dir:
+                continue
+            if pattern.match(path):
+                result = None if pattern.negate else pattern.pattern
+        return result
+
+    def match_tree(self, path: str) -> Optional[str]:
+        """
+        Like :meth:`match` for a file, but also ignores {path} if one of its
+        parent directories is ignored (as git does).
+        """
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            pattern = self.match("/".join(parts[:i]), is_dir=True)
+            if pattern is not None:
+                return pattern
+        return self.match(path)
+
+
+@lru_cache(maxsize=32)
+def _compile(patterns: Tuple[str, ...]) -> IgnorePatterns:
+    return IgnorePatterns(patterns)
+
+
+def compile_patterns(patterns: Optional[Sequence[str]]) -> IgnorePatterns:
+    """Return the compiled {patterns}. Compiled patterns are cached."""
+    return _compile(tuple(patterns or ()))
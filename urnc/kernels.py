@@ -0,0 +1,372 @@
+"""Kernel management for the execute target: pre-started kernels and limits"""
+
+import asyncio
+import atexit
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Optional
+
+from jupyter_client.manager import AsyncKernelManager
+from jupyter_core.utils import run_sync
+from nbclient.exceptions import CellExecutionError, CellTimeoutError, DeadKernelError
+from nbformat import NotebookNode
+from nbformat.v4 import new_output
+from papermill.clientwrap import PapermillNotebookClient
+from papermill.engines import NotebookExecutionManager
+from papermill.log import logger
+from traitlets import Instance, Integer, Unicode
+
+from urnc.logger import dbg, warn
+from urnc.preprocessor.util import string_to_byte
+
+
+async def async_start_kernel(kernel_name: str = "python3",
+                             cwd: Optional[str] = None,
+                             warmup_code: str = "",
+                             startup_timeout: float = 60) -> AsyncKernelManager:
+    """
+    Start a new kernel in {cwd}, wait until it is ready and execute
+    {warmup_code} in it, if given.
+    """
+    km = AsyncKernelManager(kernel_name=kernel_name)
+    await km.start_kernel(cwd=cwd)
+    try:
+        kc = km.client()
+        kc.start_channels()
+        try:
+            await kc.wait_for_ready(timeout=startup_timeout)
+            if warmup_code:
+                reply = await kc.execute_interactive(warmup_code, silent=True, store_history=False,
+                                                     timeout=startup_timeout)
+                content = reply["content"]
+                if content["status"] != "ok":
+                    warn(f"Kernel warm-up failed: {content.get('ename')}: {content.get('evalue')}")
+        finally:
+            kc.stop_channels()
+    except Exception:
+        await km.shutdown_kernel(now=True)
+        raise
+    dbg(f"Kernel {km.kernel_id} is ready")
+    return km
+
+
+start_kernel = run_sync(async_start_kernel)
+
+
+async def async_shutdown_kernel(km: AsyncKernelManager):
+    """Kill the kernel of {km} if it is still running."""
+    if km.has_kernel:
+        await km.shutdown_kernel(now=True)
+
+
+shutdown_kernel = run_sync(async_shutdown_kernel)
+
+
+def kernel_memory(km: AsyncKernelManager) -> Optional[int]:
+    """
+    Return the resident memory of the kernel process of {km} in bytes, or
+    None if it cannot be determined. Only supported on Linux.
+    """
+    process = getattr(km.provisioner, "process", None)
+    if process is None:
+        return None
+    try:
+        with open(f"/proc/{process.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class KernelWatchdog(threading.Thread):
+    def __init__(self,
+                 km: AsyncKernelManager,
+                 timeout: Optional[float] = None,
+                 max_memory: Optional[str] = None,
+                 interval: float = 0.5):
+        """Thread that kills the kernel of {km} once it exceeds a limit.
+
+        Attributes:
+            timeout (Optional[float]): Wall time limit in seconds, measured from
+                the start of the watchdog.
+            max_memory (Optional[str]): Memory limit of the kernel process,
+                e.g. '4 GiB'. Only supported on Linux.
+            reason (Optional[str]): Description of the exceeded limit, if the
+                kernel was killed.
+        """
+        super().__init__(name="urnc-watchdog", daemon=True)
+        self.km = km
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.max_bytes = string_to_byte(max_memory) if max_memory else None
+        self.interval = interval
+        self.reason: Optional[str] = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        start = time.monotonic()
+        while not self._stopped.wait(self.interval):
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                self.kill(f"Notebook time limit of {self.timeout:g}s exceeded")
+                return
+            if self.max_bytes is not None:
+                memory = kernel_memory(self.km)
+                if memory is not None and memory > self.max_bytes:
+                    self.kill(f"Kernel memory limit of {self.max_memory} exceeded")
+                    return
+
+    def kill(self, reason: str):
+        self.reason = reason
+        process = getattr(self.km.provisioner, "process", None)
+        if process is not None:
+            process.kill()
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+class ManagedNotebookClient(PapermillNotebookClient):
+    """
+    Notebook client executing a notebook in an already running kernel. The
+    kernel is shut down after execution, i.e. it is used for one notebook only.
+
+    If the kernel dies or a cell exceeds `timeout`, the notebook is marked as
+    failed with an error output describing the reason, instead of raising.
+    """
+
+    cwd = Unicode(None, allow_none=True, help="Working directory of the kernel")
+    watchdog = Instance(KernelWatchdog, allow_none=True)
+    failure = Unicode(None, allow_none=True, help="Reason why execution was stopped")
+    replay_until = Integer(0, help="Cells before this index are replayed silently")
+
+    async def async_execute(self, **kwargs: Any) -> NotebookNode:
+        self.reset_execution_trackers()
+        self.shutdown_kernel = "immediate"
+        async with self.async_setup_kernel(cleanup_kc=True, **kwargs):
+            await self.async_papermill_execute_cells()
+            if self.failure is None:
+                info_msg = await self.async_wait_for_reply(self.kc.kernel_info())
+                self.nb.metadata["language_info"] = info_msg["content"]["language_info"]
+            self.set_widgets_metadata()
+        return self.nb
+
+    execute = run_sync(async_execute)
+
+    async def async_papermill_execute_cells(self):
+        if self.cwd is not None:
+            code = f"import os as __urnc_os; __urnc_os.chdir({self.cwd!r}); del __urnc_os"
+            reply = await self.async_wait_for_reply(self.kc.execute(code, silent=True, store_history=False))
+            if reply is None or reply["content"]["status"] != "ok":
+                raise RuntimeError(f"Failed to change kernel working directory to {self.cwd}")
+        for index, cell in enumerate(self.nb.cells):
+            if index < self.replay_until:
+                if not await self.async_replay_cell(cell, index):
+                    break
+                continue
+            try:
+                self.nb_man.cell_start(cell, index)
+                await self.async_execute_cell(cell, index)
+            except CellExecutionError as ex:
+                self.nb_man.cell_exception(self.nb.cells[index], cell_index=index, exception=ex)
+                break
+            except (CellTimeoutError, DeadKernelError) as ex:
+                self.record_failure(index, ex)
+                break
+            finally:
+                self.nb_man.cell_complete(self.nb.cells[index], cell_index=index)
+
+    async def async_replay_cell(self, cell: NotebookNode, index: int) -> bool:
+        """
+        Execute {cell} silently to rebuild the kernel state, keeping its
+        existing outputs. Returns False (and marks the cell as failed) if the
+        execution failed.
+        """
+        if cell.cell_type != "code" or not cell.source.strip():
+            return True
+        try:
+            msg_id = self.kc.execute(cell.source, silent=True, store_history=False)
+            reply = await self.async_wait_for_reply(msg_id, cell)
+        except (CellTimeoutError, DeadKernelError) as ex:
+            self.record_failure(index, ex)
+            return False
+        content = reply["content"] if reply else {"status": "error", "ename": "ReplayError",
+                                                  "evalue": "No reply from kernel", "traceback": []}
+        if content["status"] == "ok":
+            return True
+        self.failure = f"Replay of cell {index} failed"
+        cell.outputs = [new_output("error", ename=content["ename"], evalue=content["evalue"],
+                                   traceback=content["traceback"])]
+        self.nb_man.cell_exception(cell, cell_index=index)
+        return False
+
+    def record_failure(self, index: int, ex: Exception):
+        """Mark cell {index} as failed after a timeout or kernel death."""
+        if self.watchdog is not None and self.watchdog.reason:
+            ename, self.failure = "LimitExceeded", self.watchdog.reason
+        elif isinstance(ex, CellTimeoutError):
+            ename, self.failure = "LimitExceeded", f"Cell time limit of {self.timeout:g}s exceeded"
+        else:
+            ename, self.failure = "DeadKernelError", "Kernel died unexpectedly"
+        cell = self.nb.cells[index]
+        cell.outputs.append(new_output("error", ename=ename, evalue=self.failure,
+                                       traceback=[f"{ename}: {self.failure}"]))
+        self.nb_man.cell_exception(cell, cell_index=index, exception=ex)
+
+    papermill_execute_cells = run_sync(async_papermill_execute_cells)
+
+
+async def async_execute_notebook(nb: NotebookNode,
+                                 km: AsyncKernelManager,
+                                 cwd: Optional[str] = None,
+                                 watchdog: Optional[KernelWatchdog] = None,
+                                 cell_timeout: Optional[float] = None,
+                                 progress_bar: bool = True,
+                                 startup_timeout: float = 60,
+                                 checkpoint_path: Optional[str] = None,
+                                 checkpoint: Optional[NotebookNode] = None,
+                                 resume_index: int = 0) -> NotebookNode:
+    """
+    Execute {nb} in the running kernel of {km} using nbclient's async API and
+    record papermill's execution metadata. The kernel is shut down afterwards.
+    Many notebooks can be executed concurrently from the same event loop, as
+    the working directory is set per kernel.
+
+    Args:
+        nb: The notebook to execute.
+        km: Manager of the kernel to use.
+        cwd: Working directory of the kernel.
+        watchdog: Watchdog of the kernel, used to report exceeded limits.
+        cell_timeout: Wall time limit per cell in seconds.
+        progress_bar: Show a progress bar of executed cells.
+        startup_timeout: Seconds to wait for the kernel to become ready.
+        checkpoint_path: If given, the notebook is saved to this path after
+            every cell, so execution can be resumed later.
+        checkpoint: A previously saved checkpoint of {nb}.
+        resume_index: Index of the first cell to execute. The outputs of all
+            earlier cells are taken from {checkpoint} and the cells are
+            replayed silently to rebuild the kernel state. Their timing
+            metadata is cleared, as they are not timed in this run.
+
+    Returns:
+        The executed notebook.
+    """
+    nb_man = NotebookExecutionManager(nb, output_path=checkpoint_path, progress_bar=progress_bar)
+    nb_man.notebook_start()
+    if checkpoint is not None:
+        for cell, saved in zip(nb_man.nb.cells[:resume_index], checkpoint.cells):
+            if cell.cell_type == "code":
+                cell.outputs = saved.get("outputs", [])
+                cell.execution_count = saved.get("execution_count")
+            papermill = saved.get("metadata", {}).get("papermill", cell.metadata.papermill)
+            # Replayed cells were not timed in this run, see urnc.timing
+            cell.metadata.papermill = {**papermill, "start_time": None, "end_time": None, "duration": None}
+    try:
+        # nbclient only supports timeouts in whole seconds
+        timeout = math.ceil(cell_timeout) if cell_timeout is not None else None
+        client = ManagedNotebookClient(nb_man, km=km, cwd=cwd, watchdog=watchdog,
+                                       replay_until=resume_index if checkpoint is not None else 0,
+                                       kernel_name=km.kernel_name, timeout=timeout,
+                                       startup_timeout=startup_timeout, log=logger)
+        await client.async_execute()
+    finally:
+        nb_man.cleanup_pbar()
+        nb_man.notebook_complete()
+    return nb_man.nb
+
+
+class KernelPool(object):
+    def __init__(self,
+                 kernel_name: str = "python3",
+                 size: int = 1,
+                 warmup_code: str = "",
+                 startup_timeout: float = 60,
+                 limit: Optional[int] = None):
+        """Queue of kernels that are started in the background ahead of time.
+
+        Each kernel has already executed {warmup_code} (e.g. imports of heavy
+        libraries) when it is handed out by :meth:`acquire`. Kernels are never
+        returned to the pool, i.e. every notebook gets a fresh kernel and no
+        state can leak between notebooks. The caller is responsible for
+        shutting down acquired kernels.
+
+        Attributes:
+            kernel_name (str): Name of the kernel spec to start.
+            size (int): Number of kernels kept ready at the same time.
+            warmup_code (str): Code executed in every kernel after startup.
+            startup_timeout (float): Seconds to wait for a kernel to become ready.
+            limit (Optional[int]): Total number of kernels to start, usually the
+                number of notebooks to execute. Unlimited if None.
+        """
+        self.kernel_name = kernel_name
+        self.size = max(size, 1)
+        self.warmup_code = warmup_code
+        self.startup_timeout = startup_timeout
+        self.limit = limit
+        self.started = 0
+        self._lock = threading.Lock()
+        self._queue: Deque[Future] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="urnc-kernel")
+        self._closed = False
+        atexit.register(self.shutdown)
+        with self._lock:
+            for _ in range(self.size):
+                self._refill()
+
+    def _start_kernel(self) -> AsyncKernelManager:
+        return start_kernel(self.kernel_name, warmup_code=self.warmup_code,
+                            startup_timeout=self.startup_timeout)
+
+    def _submit(self):
+        self.started += 1
+        self._queue.append(self._executor.submit(self._start_kernel))
+
+    def _refill(self):
+        if self._closed or (self.limit is not None and self.started >= self.limit):
+            return
+        self._submit()
+
+    def _take(self) -> Future:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Kernel pool is shut down")
+            if not self._queue:
+                # More kernels requested than expected by `limit`
+                self._submit()
+            future = self._queue.popleft()
+            self._refill()
+        return future
+
+    def acquire(self) -> AsyncKernelManager:
+        """
+        Take the next warm kernel from the pool, waiting for it if necessary,
+        and start a replacement in the background.
+        """
+        return self._take().result()
+
+    async def async_acquire(self) -> AsyncKernelManager:
+        """Like :meth:`acquire`, but waits without blocking the event loop."""
+        return await asyncio.wrap_future(self._take())
+
+    def shutdown(self):
+        """Shut down all kernels that have not been acquired yet."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending = list(self._queue)
+            self._queue.clear()
+        atexit.unregister(self.shutdown)
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for future in pending:
+            if future.cancelled() or future.exception() is not None:
+                continue
+            shutdown_kernel(future.result())
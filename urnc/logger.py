@@ -5,6 +5,8 @@ import sys
 from typing import NoReturn
 from pathlib import Path
 
+from urnc import trace
+
 GREY = "\x1b[38;20m"
 YELLOW = "\x1b[33;20m"
 RED = "\x1b[31;20m"
@@ -70,24 +72,26 @@ def set_verbose():
     logger.setLevel(logging.DEBUG)
 
 
+# Looked up once, as dbg is called for every line of some notebooks
+_logger = logging.getLogger(__name__)
+
+
 def dbg(msg: str):
-    logger = logging.getLogger(__name__)
-    logger.debug(msg)
+    _logger.debug(msg)
 
 
 def log(msg: str):
-    logger = logging.getLogger(__name__)
-    logger.info(msg)
+    _logger.info(msg)
 
 
 def warn(msg: str):
-    logger = logging.getLogger(__name__)
-    logger.warning(msg)
+    _logger.warning(msg)
+    trace.event("warning", msg)
 
 
 def error(msg: str):
-    logger = logging.getLogger(__name__)
-    logger.error(msg)
+    _logger.error(msg)
+    trace.event("error", msg)
 
 
 def critical(msg: str) -> NoReturn:
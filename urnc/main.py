@@ -3,7 +3,8 @@
 #!/usr/bin/env python3
 import os
 import sys
-from typing import Dict, Optional, Any, List
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, List, Tuple
 from pathlib import Path
 import click
 import urnc
@@ -26,6 +27,58 @@ def try_call(
         sys.exit(errorcode)
 
 
+def parse_shard(ctx: click.Context, param: click.Parameter, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    if value is None:
+        return None
+    try:
+        return urnc.shard.parse_shard(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
+def export_metrics(config: Dict[str, Any], path: Optional[str], command: str):
+    """Collect metrics of {command} and write them to {path} (default: ``metrics.export``), if set."""
+    path = path or config["metrics"]["export"]
+    path = urnc.config.resolve_path(config, path) if path else None
+    return urnc.metrics.export(path, command=command, course=config["name"])
+
+
+@contextmanager
+def export_run(config: Dict[str, Any], metrics_file: Optional[str], trace_file: Optional[str], command: str):
+    """
+    Collect metrics and trace spans of {command} and write them to
+    {metrics_file} and {trace_file} (default: ``trace.export``), if set.
+    """
+    trace_file = trace_file or config["trace"]["export"]
+    trace_file = urnc.config.resolve_path(config, trace_file) if trace_file else None
+    with urnc.trace.export(trace_file, command=command, course=config["name"]):
+        with export_metrics(config, metrics_file, command):
+            yield
+
+
+metrics_option = click.option("--metrics", "metrics_file", type=str, default=None,
+                              help="Write metrics of the run in OpenMetrics text format to this file.")
+trace_option = click.option("--trace", "trace_file", type=str, default=None,
+                            help="Append spans of the run as JSON lines to this file.")
+
+
+def parse_targets(targets: tuple[str, ...]) -> Dict[str, Any]:
+    """Parse -t/--target arguments like 'student:./out' into a dict from type to path."""
+    target_dict: Dict[str, Any] = dict()
+    for t in targets:
+        if ":" in t:
+            typ, path = t.split(":", 1)
+            typ = typ.strip().lower()
+            path = path.strip()
+        else:
+            typ = t.strip().lower()
+            path = "out"
+        target_dict[typ] = path
+        if typ not in target_types:
+            raise click.UsageError(f"Unknown target type: {typ}")
+    return target_dict
+
+
 @click.group(help="Uni Regensburg Notebook Converter")
 @click.version_option(prog_name="urnc", message="%(version)s")
 @click.option("-f", "--root", default=os.getcwd(), type=click.Path(path_type=Path),
@@ -43,12 +96,39 @@ def main(ctx: click.Context, root: Path, verbose: bool) -> None:
     help="Create and push the student version",
     epilog="See https://spang-lab.github.io/urnc/commands/ci.html for details."
 )
+@click.option("--shard", type=str, default=None, callback=parse_shard,
+              help="Only convert shard INDEX/COUNT of the notebooks, e.g. '1/4', " +
+                   "and write the results to a bundle instead of pushing them.")
+@click.option("--merge", is_flag=True, help="Publish the bundles written by all shards.")
+@click.option("--bundle-dir", type=str, default="urnc-shards", show_default=True,
+              help="Directory of the shard bundles, relative to the course root.")
+@click.option("--incremental", is_flag=True,
+              help="Only convert files changed since the commit recorded in the last student commit.")
+@click.option("--since", type=str, default=None,
+              help="Only convert files changed since this commit of the course. Implies --incremental.")
+@metrics_option
+@trace_option
 @click.pass_context
-def ci(ctx: click.Context) -> None:
+def ci(ctx: click.Context,
+       shard: Optional[Tuple[int, int]],
+       merge: bool,
+       bundle_dir: str,
+       incremental: bool,
+       since: Optional[str],
+       metrics_file: Optional[str],
+       trace_file: Optional[str]) -> None:
+    if sum([bool(shard), merge, incremental or bool(since)]) > 1:
+        raise click.UsageError("Only one of --shard, --merge, --incremental/--since can be set at a time.")
     config = urnc.config.read_config(ctx.obj["root"], strict=True)
     config["convert"]["write_mode"] = WriteMode.OVERWRITE
     config["ci"]["commit"] = True
-    try_call(urnc.ci.ci, config)
+    with export_run(config, metrics_file, trace_file, "ci"):
+        if shard:
+            try_call(urnc.ci.ci_shard, config, shard, bundle_dir)
+        elif merge:
+            try_call(urnc.ci.ci_merge, config, bundle_dir)
+        else:
+            try_call(urnc.ci.ci, config, incremental, since)
 
 
 @click.command(
@@ -80,6 +160,12 @@ def student(ctx: click.Context) -> None:
 @click.option("-f", "--force", is_flag=True, help="Overwrite existing files.")
 @click.option("-n", "--dry-run", is_flag=True, help="Try conversion, but don't write to disk.")
 @click.option("-i", "--interactive", is_flag=True, help="Ask before overwriting files.")
+@click.option("--shard", type=str, default=None, callback=parse_shard,
+              help="Only convert shard INDEX/COUNT of the notebooks, e.g. '1/4'.")
+@click.option("--plan", "plan_file", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Convert the notebooks of a plan written by 'urnc plan -o'.")
+@metrics_option
+@trace_option
 @click.pass_context
 def convert(
     ctx: click.Context,
@@ -90,9 +176,14 @@ def convert(
     force: bool,
     dry_run: bool,
     interactive: bool,
+    shard: Optional[Tuple[int, int]],
+    plan_file: Optional[str],
+    metrics_file: Optional[str],
+    trace_file: Optional[str],
 ) -> None:
 
     config = urnc.config.read_config(ctx.obj["root"], strict=False)
+    config["convert"]["shard"] = shard
     if sum([force, dry_run, interactive]) > 1:
         msg = "Only one of --force, --dry-run, --interactive can be set at a time."
         raise click.UsageError(msg)
@@ -108,19 +199,16 @@ def convert(
             msg = "Interactive mode is only available when stdout is a tty."
             raise click.UsageError(msg)
 
-    # Parse -t/--target arguments
-    target_dict: Dict[str, Any] = dict()
-    for t in targets:
-        if ":" in t:
-            typ, path = t.split(":", 1)
-            typ = typ.strip().lower()
-            path = path.strip()
-        else:
-            typ = t.strip().lower()
-            path = "out"
-        target_dict[typ] = path
-        if typ not in target_types:
-            raise click.UsageError(f"Unknown target type: {typ}")
+    input_path = urnc.config.resolve_path(config, os.path.abspath(input))
+    if plan_file is not None:
+        if targets or output is not None or solution is not None:
+            raise click.UsageError("--plan cannot be combined with --target, --output or --solution.")
+        plan = urnc.plan.read_plan(plan_file, config)
+        with export_run(config, metrics_file, trace_file, "convert"):
+            urnc.convert.convert(config, input_path, [], plan)
+        return
+
+    target_dict = parse_targets(targets)
 
     # Parse --output and --solution targets (potentially overwriting -t/--target)
     if output is not None:
@@ -137,9 +225,43 @@ def convert(
     # Convert to list of dictionaries as expected by convert
     target_list = [{"type": typ, "path": path}
                    for typ, path in target_dict.items()]
+    with export_run(config, metrics_file, trace_file, "convert"):
+        urnc.convert.convert(config, input_path, target_list)
 
+
+@click.command(
+    name="plan",
+    help="Show which notebooks are converted to which outputs",
+    epilog="See https://spang-lab.github.io/urnc/commands/plan.html for details."
+)
+@click.argument("input", type=click.Path(exists=True, path_type=Path), default=Path("."))
+@click.option("-t", "--target", "targets", multiple=True,
+              help="Conversion target, as for 'urnc convert'. Can be used multiple times. " +
+                   "Defaults to the targets of 'urnc ci'.")
+@click.option("-f", "--force", is_flag=True, help="Plan to overwrite existing files.")
+@click.option("--shard", type=str, default=None, callback=parse_shard,
+              help="Only plan shard INDEX/COUNT of the notebooks, e.g. '1/4'.")
+@click.option("-o", "--output", type=str, default=None, help="Write the plan as JSON to this file.")
+@click.pass_context
+def plan(
+    ctx: click.Context,
+    input: Path,
+    targets: tuple[str, ...],
+    force: bool,
+    shard: Optional[Tuple[int, int]],
+    output: Optional[str],
+) -> None:
+    config = urnc.config.read_config(ctx.obj["root"], strict=False)
+    config["convert"]["shard"] = shard
+    config["convert"]["write_mode"] = WriteMode.OVERWRITE if force else WriteMode.SKIP_EXISTING
+    target_list = [{"type": typ, "path": path} for typ, path in parse_targets(targets).items()]
+    if not target_list:
+        target_list = urnc.ci.get_targets(config)
     input_path = urnc.config.resolve_path(config, os.path.abspath(input))
-    urnc.convert.convert(config, input_path, target_list)
+    entries = urnc.plan.create_plan(config, input_path, target_list)
+    urnc.plan.log_plan(entries, config["base_path"])
+    if output is not None:
+        urnc.plan.write_plan(entries, output, config["base_path"])
 
 
 @click.command(help="Check notebooks for errors",
@@ -148,6 +270,8 @@ def convert(
 @click.option("-q", "--quiet", is_flag=True, help="Only show warnings and errors.")
 @click.option("-c", "--clear", is_flag=True, help="Clear cell outputs.")
 @click.option("-i", "--image", is_flag=True, help="Fix image paths.")
+@click.option("--staged", is_flag=True,
+              help="Only clear notebooks staged in git and stage the result. For use as pre-commit hook.")
 @click.pass_context
 def check(
     ctx: click.Context,
@@ -155,11 +279,17 @@ def check(
     quiet: bool,
     clear: bool,
     image: bool,
+    staged: bool,
 ) -> None:
+    if staged and not clear:
+        raise click.UsageError("--staged can only be used together with --clear.")
     config = urnc.config.read_config(ctx.obj["root"], strict=False)
     input_path = urnc.config.resolve_path(config, os.path.abspath(input))
     if not quiet:
         urnc.logger.set_verbose()
+    if staged:
+        urnc.hook.clear_staged(config, input_path)
+        return
     if clear:
         log("Clearing cell outputs")
         config["convert"]["write_mode"] = WriteMode.OVERWRITE
@@ -176,6 +306,7 @@ def check(
     config["convert"]["write_mode"] = WriteMode.DRY_RUN
     targets = [{"type": TargetType.STUDENT, "path": None}]
     urnc.convert.convert(config, input_path, targets)
+    try_call(urnc.budget.check_budgets, config, input_path)
 
 
 @click.command(
@@ -184,13 +315,38 @@ def check(
 )
 @click.argument("input", type=click.Path(exists=True), default=".")
 @click.option("-o", "--output", type=str, default=None, help="Output path for executed notebook(s).")
+@click.option("--resume", is_flag=True, help="Resume execution from the checkpoints of a previous run.")
+@metrics_option
+@trace_option
 @click.pass_context
-def execute(ctx: click.Context, input: str, output: Optional[str]) -> None:
+def execute(ctx: click.Context, input: str, output: Optional[str], resume: bool,
+            metrics_file: Optional[str], trace_file: Optional[str]) -> None:
     config = urnc.config.read_config(ctx.obj["root"], strict=False)
     config["convert"]["write_mode"] = WriteMode.SKIP_EXISTING
+    if resume:
+        # Notebooks written by the previous run have to be replaced
+        config["convert"]["write_mode"] = WriteMode.OVERWRITE
+        config["execute"]["checkpoints"] = True
+        config["execute"]["resume"] = True
     targets = [{"type": TargetType.EXECUTE, "path": output}]
     input_path = urnc.config.resolve_path(config, os.path.abspath(input))
-    urnc.convert.convert(config, input_path, targets)
+    with export_run(config, metrics_file, trace_file, "execute"):
+        urnc.convert.convert(config, input_path, targets)
+
+
+@click.command(
+    help="Serve student, solution and clear previews of notebooks",
+    epilog="See https://spang-lab.github.io/urnc/commands/serve.html for details."
+)
+@click.argument("input", type=click.Path(exists=True, file_okay=False, path_type=Path), default=Path("."))
+@click.option("--host", type=str, default="127.0.0.1", show_default=True, help="Address to listen on.")
+@click.option("-p", "--port", type=int, default=8000, show_default=True, help="Port to listen on.")
+@click.option("--cache-size", type=int, default=128, show_default=True, help="Number of previews kept in memory.")
+@click.pass_context
+def serve(ctx: click.Context, input: Path, host: str, port: int, cache_size: int) -> None:
+    config = urnc.config.read_config(ctx.obj["root"], strict=False)
+    input_path = urnc.config.resolve_path(config, os.path.abspath(input))
+    try_call(urnc.serve.serve, config, input_path, host, port, cache_size)
 
 
 @click.command(
@@ -222,7 +378,15 @@ def version(ctx: click.Context, self: bool, action: str) -> None:
     "-o", "--output", type=str, help="Path of the output folder.", default=None
 )
 @click.option("-b", "--branch", help="The branch to pull. Default: main.", default="main")
-@click.option("-d", "--depth", help="The depth for git fetch. Default: 1.", default=1)
+@click.option("-d", "--depth", help="The depth for git clone, kept when fetching. Default: 1.", default=1)
+@click.option(
+    "--reference", type=str, default=None, envvar="URNC_REFERENCE",
+    help="Shared object store (bare mirror of GIT_URL) to borrow objects from. Created if missing."
+)
+@click.option(
+    "--filter", type=str, default=None, envvar="URNC_FILTER",
+    help="Object filter for a partial clone and fetch, e.g. blob:none."
+)
 @click.option(
     "-l", "--log-file", type=click.Path(path_type=Path), help="The path to the log file.", default=None
 )
@@ -233,6 +397,8 @@ def pull(
     output: Optional[str],
     branch: str,
     depth: int,
+    reference: Optional[str],
+    filter: Optional[str],
     log_file: Optional[Path],
 ) -> None:
     config = urnc.config.read_config(ctx.obj["root"], strict=False)
@@ -240,7 +406,7 @@ def pull(
         urnc.logger.add_file_handler(log_file)
     with urnc.util.chdir(config["base_path"]):
         try:
-            urnc.pull.pull(git_url, output, branch, depth)
+            urnc.pull.pull(git_url, output, branch, depth, reference, filter)
         except Exception as err:
             urnc.logger.error("pull failed with unexpected error.")
             urnc.logger.error(str(err))
@@ -255,7 +421,15 @@ def pull(
     "-o", "--output", type=str, help="The name of the output folder.", default=None
 )
 @click.option("-b", "--branch", help="The branch to pull.", default="main")
-@click.option("-d", "--depth", help="The depth for git fetch.", default=1)
+@click.option("-d", "--depth", help="The depth for git clone, kept when fetching.", default=1)
+@click.option(
+    "--reference", type=str, default=None, envvar="URNC_REFERENCE",
+    help="Shared object store (bare mirror of GIT_URL) to borrow objects from. Created if missing."
+)
+@click.option(
+    "--filter", type=str, default=None, envvar="URNC_FILTER",
+    help="Object filter for a partial clone and fetch, e.g. blob:none."
+)
 @click.option(
     "-l", "--log-file", type=click.Path(path_type=Path), help="The path to the log file.", default=None
 )
@@ -266,6 +440,8 @@ def clone(
     output: Optional[str],
     branch: str,
     depth: int,
+    reference: Optional[str],
+    filter: Optional[str],
     log_file: Optional[Path],
 ) -> None:
     config = urnc.config.read_config(ctx.obj["root"])
@@ -274,7 +450,7 @@ def clone(
     with urnc.util.chdir(config["base_path"]):
         urnc.logger.setup_logger()
         try:
-            urnc.pull.clone(git_url, output, branch, depth)
+            urnc.pull.clone(git_url, output, branch, depth, reference, filter)
         except Exception as err:
             urnc.logger.error("clone failed with unexpected error.")
             urnc.logger.error(str(err))
@@ -309,9 +485,11 @@ def init(ctx: click.Context,
 
 main.add_command(version)
 main.add_command(convert)
+main.add_command(plan)
 main.add_command(ci)
 main.add_command(check)
 main.add_command(execute)
+main.add_command(serve)
 main.add_command(student)
 main.add_command(pull)
 main.add_command(clone)
@@ -0,0 +1,173 @@
+"""Run metrics exported as OpenMetrics textfile, e.g. for the node-exporter textfile collector"""
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from urnc import trace
+from urnc.logger import log, warn
+
+# Name, help text and unit of all metrics. All metrics are gauges describing
+# the last run, as every run overwrites the textfile.
+METRICS: Dict[str, Tuple[str, str]] = {
+    "urnc_notebooks": ("Notebooks by state (discovered, converted, cached, skipped)", ""),
+    "urnc_execution_failures": ("Notebooks whose execution failed", ""),
+    "urnc_phase_duration_seconds": ("Wall time per phase of the run", "seconds"),
+    "urnc_read_bytes": ("Bytes of notebooks read", "bytes"),
+    "urnc_written_bytes": ("Bytes of notebooks and extracted files written", "bytes"),
+    "urnc_push_bytes": ("Size of the objects pushed to the student repository", "bytes"),
+    "urnc_preview_requests": ("Notebook previews served by urnc serve, by cache result (hit, miss)", ""),
+    "urnc_run_success": ("1 if the run finished successfully, else 0", ""),
+    "urnc_run_timestamp_seconds": ("Unix time of the end of the run", "seconds"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics(object):
+    def __init__(self):
+        """Values collected during one run.
+
+        Attributes:
+            values (Dict[str, Dict[Labels, float]]): Value per metric name and
+                label set (sorted tuple of label names and values).
+            labels (Dict[str, str]): Labels added to every sample.
+
+        Values are updated from worker threads (executed notebooks, preview
+        requests), so every update holds a lock.
+        """
+        self.values: Dict[str, Dict[Labels, float]] = {}
+        self.labels: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add {value} to metric {name} with {labels}."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self.values.setdefault(name, {})
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values.setdefault(name, {})[key] = value
+
+    def get(self, name: str, **labels: str) -> float:
+        return self.values.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.values.clear()
+            self.labels.clear()
+
+    def render(self) -> str:
+        """Return all metrics in the OpenMetrics text format."""
+        with self._lock:
+            values = {name: dict(samples) for name, samples in self.values.items()}
+            common = dict(self.labels)
+        lines: List[str] = []
+        for name, (help, unit) in METRICS.items():
+            samples = values.get(name)
+            if not samples:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {help}")
+            for key, value in sorted(samples.items()):
+                labels = {**common, **dict(key)}
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = [f'{_label_name(key)}="{_escape(str(value))}"' for key, value in sorted(labels.items())]
+    return "{" + ",".join(parts) + "}"
+
+
+def _label_name(name: str) -> str:
+    name = re.sub(r"[^a-zA-Z0-9_]", "_", name)
+    return f"_{name}" if name[:1].isdigit() else name
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Metrics of the current run
+metrics = Metrics()
+
+
+def add(name: str, value: float = 1, **labels: str) -> None:
+    """Add {value} to metric {name} of the current run."""
+    metrics.add(name, value, **labels)
+
+
+def add_file_size(name: str, path: Union[str, Path]) -> None:
+    """Add the size of the file at {path} to metric {name}, if it exists."""
+    try:
+        metrics.add(name, os.path.getsize(path))
+    except OSError:
+        pass
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Measure the wall time of the enclosed block as phase {name}, also traced as span."""
+    start = time.perf_counter()
+    try:
+        with trace.span(name, "phase"):
+            yield
+    finally:
+        metrics.add("urnc_phase_duration_seconds", time.perf_counter() - start, phase=name)
+
+
+def write_textfile(path: Union[str, Path]) -> None:
+    """
+    Write the metrics of the current run to {path}. The file is replaced
+    atomically, so a collector never reads a partially written file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write(metrics.render())
+    os.replace(tmp, path)
+    log(f"Wrote metrics to {path}")
+
+
+@contextmanager
+def export(path: Optional[Union[str, Path]], **labels: str) -> Iterator[None]:
+    """
+    Collect metrics while running the enclosed block and write them to
+    {path}, also if the block fails. Does nothing if {path} is None.
+    {labels} (e.g. command and course name) are added to every sample.
+    """
+    if path is None:
+        yield
+        return
+    metrics.reset()
+    metrics.labels.update({key: value for key, value in labels.items() if value is not None})
+    success = False
+    try:
+        with phase("total"):
+            yield
+        success = True
+    finally:
+        metrics.set("urnc_run_success", int(success))
+        metrics.set("urnc_run_timestamp_seconds", round(time.time(), 3))
+        try:
+            write_textfile(path)
+        except OSError as err:
+            warn(f"Could not write metrics to {path}: {err}")
@@ -0,0 +1,162 @@
+"""Streaming access to notebook files without loading them into memory"""
+
+import json
+import re
+from typing import BinaryIO, Iterator, List, Tuple, Union
+
+_WS = rb"[ \t\n\r]*"
+_STR = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_WHITESPACE = re.compile(_WS)
+_STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*')
+# Groups: 1 = array of strings, 2 = punctuation, 3 = string, 4 = literal.
+# Arrays of strings (e.g. lines of cell sources and stream outputs) are matched
+# as a single token, as they make up the majority of tokens in most notebooks.
+_TOKEN = re.compile(
+    _WS + rb"(?:"
+    rb"(\[" + _WS + rb"(?:" + _STR + _WS + rb"(?:," + _WS + _STR + _WS + rb")*)?\])|"
+    rb"([{}\[\]:,])|"
+    rb"(" + _STR + rb")|"
+    rb'([^ \t\n\r{}\[\]:,"]+))'
+)
+
+# Token kinds. Long strings are split into several STRING_PART tokens followed
+# by a final STRING token, so huge base64 payloads never have to be held in
+# memory as a whole. Arrays containing only strings are returned as a single
+# STRING_ARRAY token if they fit into the read buffer.
+BEGIN_OBJECT = "{"
+END_OBJECT = "}"
+BEGIN_ARRAY = "["
+END_ARRAY = "]"
+COLON = ":"
+COMMA = ","
+STRING = "string"
+STRING_PART = "string_part"
+STRING_ARRAY = "string_array"
+LITERAL = "literal"
+
+Token = Tuple[str, bytes, int]
+PathEntry = Union[str, int]
+
+
+def iter_tokens(f: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[Token]:
+    """
+    Split the JSON document in {f} into tokens, reading {chunk_size} bytes at
+    a time.
+
+    Yields:
+        Tuples (kind, raw, nbytes), where `raw` is the raw token (or string
+        part) without surrounding whitespace and `nbytes` is the number of
+        bytes consumed from the file for this token, incl. leading whitespace.
+        The sum of all `nbytes` (plus trailing whitespace) equals the file size.
+    """
+    buf = b""
+    pos = 0
+    eof = False
+    kinds = {b"{": BEGIN_OBJECT, b"}": END_OBJECT, b"[": BEGIN_ARRAY,
+             b"]": END_ARRAY, b":": COLON, b",": COMMA}
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    ws = 0
+    match = _TOKEN.match
+    while True:
+        # Fast path: complete tokens inside the buffer. Literals touching the
+        # end of the buffer might continue in the next chunk.
+        m = match(buf, pos)
+        if m is not None and (m.lastindex != 4 or m.end() < len(buf) or eof):
+            group = m.lastindex
+            if group == 2:
+                kind = kinds[m.group(2)]
+            elif group == 3:
+                kind = STRING
+            elif group == 1:
+                kind = STRING_ARRAY
+            else:
+                kind = LITERAL
+            yield kind, m.group(group), ws + m.end() - pos  # type: ignore[arg-type]
+            ws = 0
+            pos = m.end()
+            continue
+        # Slow path: end of buffer, incomplete token or string longer than
+        # the buffer. Long strings are yielded in parts.
+        end = _WHITESPACE.match(buf, pos).end()  # type: ignore[union-attr]
+        ws += end - pos
+        pos = end
+        if pos < len(buf) and buf[pos] == 34 and len(buf) - pos >= chunk_size:
+            start = pos
+            pos += 1
+            while True:
+                end = _STRING_BODY.match(buf, pos).end()  # type: ignore[union-attr]
+                if end < len(buf) and buf[end] == 34:
+                    yield STRING, buf[start:end + 1], ws + end + 1 - start
+                    pos = end + 1
+                    break
+                # Yield everything up to a possibly incomplete escape sequence
+                if end > start:
+                    yield STRING_PART, buf[start:end], ws + end - start
+                    ws = 0
+                pos = end
+                if not fill():
+                    raise ValueError("Unterminated string in JSON document")
+                start = 0
+            ws = 0
+            continue
+        if not fill():
+            if pos < len(buf):
+                raise ValueError(f"Invalid JSON document near {buf[pos:pos + 20]!r}")
+            return
+
+
+def iter_events(f: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[Tuple[List[PathEntry], Token]]:
+    """
+    Like :func:`iter_tokens`, but additionally yields the path of the JSON
+    value each token belongs to, e.g. ``["cells", 3, "outputs", 0, "data",
+    "image/png"]``. Object keys and colons belong to the value they introduce,
+    commas and closing brackets to the enclosing container.
+
+    The yielded path list is reused between events and must not be modified
+    or stored by the caller. Use ``tuple(path)`` to keep a copy.
+    """
+    path: List[PathEntry] = []
+    # One entry per open container: True for objects expecting a key, False
+    # for objects expecting a value and None for arrays.
+    stack: List[Union[bool, None]] = []
+    key_parts: List[bytes] = []
+    for token in iter_tokens(f, chunk_size):
+        kind = token[0]
+        expects_key = bool(stack) and stack[-1] is True
+        if expects_key and kind in (STRING, STRING_PART):
+            key_parts.append(token[1])
+            if kind == STRING:
+                path[-1] = json.loads(b"".join(key_parts))
+                key_parts.clear()
+                stack[-1] = False
+            yield path, token
+        elif kind == BEGIN_OBJECT or kind == BEGIN_ARRAY:
+            yield path, token
+            stack.append(True if kind == BEGIN_OBJECT else None)
+            path.append("" if kind == BEGIN_OBJECT else 0)
+        elif kind == END_OBJECT or kind == END_ARRAY:
+            stack.pop()
+            path.pop()
+            yield path, token
+        elif kind == COMMA:
+            last = path.pop()
+            yield path, token
+            if stack[-1] is None:
+                path.append(last + 1)  # type: ignore[operator]
+            else:
+                path.append("")
+                stack[-1] = True
+        else:
+            yield path, token
@@ -0,0 +1,327 @@
+"""Build plan of a conversion: which notebook is converted to which output"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from urnc.config import WriteMode
+from urnc.format import format_path, is_directory_path
+from urnc.ignore import IgnorePatterns, compile_patterns
+from urnc.logger import critical, dbg, log
+from urnc.shard import shard_notebooks
+
+PLAN_VERSION = 1
+
+# Write decisions of plan entries
+WRITE = "write"
+OVERWRITE = "overwrite"
+SKIP = "skip"
+ASK = "ask"
+DRY_RUN = "dry-run"
+NONE = "none"  # no output path, i.e. the notebook is only checked
+
+
+def _relpath(path: Path, root: Path) -> str:
+    return Path(os.path.relpath(Path(path).absolute(), start=root)).as_posix()
+
+
+def find_notebooks(input: Path,
+                   output_path: Optional[Path],
+                   ignore_patterns: Optional[Sequence[str]] = None,
+                   root: Optional[Path] = None,
+                   backend: str = "walk",
+                   untracked: bool = False) -> List[Path]:
+    """
+    Recursively find all Jupyter notebooks (*.ipynb) in the input directory,
+    excluding hidden directories (those starting with a dot).
+    Notebooks that are located inside the output_path directory (if given)
+    are skipped.
+
+    Directories matching {ignore_patterns} are pruned during the walk, i.e.
+    their contents are never listed. Patterns follow the semantics of
+    ``.gitignore`` files relative to {root} (default: {input}), see
+    :func:`filter_notebooks`.
+
+    Args:
+        input (Path): The root directory to search for notebooks.
+        output_path (Optional[Path]): Directory to exclude notebooks from (e.g., output directory).
+        ignore_patterns (Optional[Sequence[str]]): Gitignore-style patterns of
+            notebooks and directories to skip.
+        root (Optional[Path]): Directory the patterns are relative to.
+        backend (str): 'walk' to walk the filesystem or 'git' to list the
+            notebooks tracked by git. Falls back to 'walk' if {input} is
+            not inside a git repository.
+        untracked (bool): Include untracked, not ignored notebooks if
+            {backend} is 'git'.
+
+    Returns:
+        List[Path]: Sorted list of notebook file paths found.
+    """
+    notebooks = []
+    if not input.is_dir():
+        critical(f"Input path '{input}' is not a directory. Aborting.")
+    ignore = compile_patterns(ignore_patterns)
+    root = _pattern_root(input, root)
+    output_dir = Path(output_path).absolute() if output_path else None
+    if backend == "git":
+        from urnc.git import list_files  # imports GitPython
+        files = list_files(input, untracked)
+        if files is not None:
+            return _filter_files(input, files, output_dir, ignore, root)
+        dbg(f"{input} is not inside a git repository. Searching the filesystem for notebooks.")
+    elif backend != "walk":
+        critical(f"Unknown discovery backend '{backend}'. Supported: walk, git.")
+    for dirpath, dirs, files in os.walk(input, topdown=True):
+        current = Path(dirpath)
+        reldir = _relpath(current, root) if ignore else ""
+        kept = []
+        for d in dirs:
+            if d[0] == ".":
+                continue
+            path = current.joinpath(d)
+            if output_dir is not None and path.absolute() == output_dir:
+                log(f"Skipping notebooks in {path} because it is the output directory.")
+                continue
+            if ignore:
+                pattern = ignore.match(_join(reldir, d), is_dir=True)
+                if pattern is not None:
+                    log(f"Ignoring directory {path} because it matches pattern '{pattern}'")
+                    continue
+            kept.append(d)
+        dirs[:] = kept
+        for file in files:
+            if not file.lower().endswith(".ipynb"):
+                continue
+            path = current.joinpath(file)
+            if ignore:
+                pattern = ignore.match(_join(reldir, file))
+                if pattern is not None:
+                    log(f"Ignoring notebook {path} because it matches pattern '{pattern}'")
+                    continue
+            notebooks.append(path)
+    return sorted(notebooks)
+
+
+def _filter_files(input: Path,
+                  files: Sequence[str],
+                  output_dir: Optional[Path],
+                  ignore: IgnorePatterns,
+                  root: Path) -> List[Path]:
+    """Apply the rules of the filesystem walk in :func:`find_notebooks` to {files}."""
+    notebooks = []
+    for file in files:
+        if not file.lower().endswith(".ipynb") or any(part[0] == "." for part in file.split("/")):
+            continue
+        path = input.joinpath(file)
+        if output_dir is not None and output_dir in path.absolute().parents:
+            continue
+        if ignore:
+            pattern = ignore.match_tree(_relpath(path, root))
+            if pattern is not None:
+                dbg(f"Ignoring notebook {path} because it matches pattern '{pattern}'")
+                continue
+        if not path.is_file():
+            continue  # deleted, but not yet committed
+        notebooks.append(path)
+    return sorted(notebooks)
+
+
+def discover_notebooks(input: Path, output_path: Optional[Path], config: Dict[str, Any]) -> List[Path]:
+    """Call :func:`find_notebooks` with the options of {config}."""
+    discovery = config["convert"]["discovery"]
+    return find_notebooks(input, output_path, config["convert"]["ignore"], config["base_path"],
+                          backend=discovery["backend"], untracked=discovery["untracked"])
+
+
+def filter_notebooks(notebooks: List[Path],
+                     ignore_patterns: Sequence[str],
+                     root: Optional[Path] = None) -> List[Path]:
+    """
+    Remove all notebooks matching {ignore_patterns} from {notebooks}.
+
+    Patterns follow the semantics of ``.gitignore`` files: patterns without
+    a slash (e.g. ``draft*.ipynb`` or ``data``) match files and directories
+    at any level, patterns containing a slash (e.g. ``/old/`` or
+    ``lectures/**/scratch.ipynb``) are relative to {root}, a trailing slash
+    only matches directories, ``**`` matches any number of directories and
+    a leading ``!`` re-includes previously ignored paths. Notebooks inside
+    an ignored directory are ignored as well. If {root} is None, patterns
+    are matched against the notebook names only.
+    """
+    ignore = compile_patterns(ignore_patterns)
+    if not ignore:
+        return list(notebooks)
+    filtered = []
+    for nb in notebooks:
+        pattern = ignore.match_tree(_relpath(nb, root)) if root is not None else ignore.match(nb.name)
+        if pattern is not None:
+            log(f"Ignoring notebook {nb} because it matches pattern '{pattern}'")
+            continue
+        filtered.append(nb)
+    return filtered
+
+
+def _pattern_root(input: Path, root: Optional[Path]) -> Path:
+    """Return {root} if {input} is located inside it, else {input}."""
+    if root is not None:
+        root = Path(root).absolute()
+        input = Path(input).absolute()
+        if input == root or root in input.parents:
+            return root
+    return Path(input).absolute()
+
+
+def _join(reldir: str, name: str) -> str:
+    return name if reldir in ("", ".") else f"{reldir}/{name}"
+
+
+def find_jobs(input: Union[str, Path],
+              output: Union[str, Path, None],
+              type: str,
+              config: Dict[str, Any]) -> List[Tuple[Path, Optional[Path]]]:
+    """
+    Find the notebooks converted by target {type} with output path {output}.
+
+    Returns:
+        List of tuples (input notebook, output path).
+    """
+    input = Path(input)
+    if input.is_file():
+        input_notebooks = [input]
+    else:
+        output_dir = config["base_path"].joinpath(output) if is_directory_path(output) else None
+        input_notebooks = discover_notebooks(input, output_dir, config)
+        if config["convert"]["shard"]:
+            input_notebooks = shard_notebooks(input_notebooks, config["base_path"],
+                                              config["convert"]["shard"], config["convert"]["shard_by"])
+    jobs = []
+    for nb in input_notebooks:
+        out_file = format_path(nb, output=output, root=config["base_path"], type=type)
+        jobs.append((nb, out_file))
+    return jobs
+
+
+def write_decision(output: Optional[Path], write_mode: str) -> str:
+    """Return what happens to {output} when it is written with {write_mode}."""
+    if output is None:
+        return NONE
+    if write_mode == WriteMode.DRY_RUN:
+        return DRY_RUN
+    if not output.exists():
+        return WRITE
+    if write_mode == WriteMode.OVERWRITE:
+        return OVERWRITE
+    if write_mode == WriteMode.INTERACTIVE:
+        return ASK
+    if write_mode == WriteMode.SKIP_EXISTING:
+        return SKIP
+    raise ValueError(f"Unknown write_mode '{write_mode}' in convert.config")
+
+
+class PlanEntry(object):
+    def __init__(self, input: Path, type: str, output: Optional[Path], action: str, target: int = 0):
+        """Conversion of one notebook for one target.
+
+        Attributes:
+            input (Path): Path of the input notebook.
+            type (str): Target type, e.g. 'student'.
+            output (Optional[Path]): Output path or None if nothing is written.
+            action (str): Write decision, one of 'write', 'overwrite', 'skip',
+                'ask', 'dry-run' or 'none'.
+            target (int): Index of the target the entry belongs to.
+        """
+        self.input = input
+        self.type = type
+        self.output = output
+        self.action = action
+        self.target = target
+
+    def to_dict(self, root: Path) -> Dict[str, Any]:
+        return {
+            "input": _relpath(self.input, root),
+            "type": self.type,
+            "output": _relpath(self.output, root) if self.output else None,
+            "action": self.action,
+            "target": self.target,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], root: Path) -> "PlanEntry":
+        output = root.joinpath(data["output"]) if data.get("output") else None
+        return cls(root.joinpath(data["input"]), data["type"], output, data.get("action", WRITE),
+                   data.get("target", 0))
+
+
+def create_plan(config: Dict[str, Any],
+                input: Union[str, Path],
+                targets: Sequence[Dict[str, Any]]) -> List[PlanEntry]:
+    """
+    Compute the build plan for converting {input} to all {targets}: one entry
+    per input notebook and target, with its output path and write decision
+    (based on ``convert.write_mode``). Aborts if two entries would write to
+    the same output path.
+    """
+    write_mode = config["convert"]["write_mode"]
+    plan = []
+    for i, target in enumerate(targets):
+        type = target.get("type", None)
+        if type is None:
+            critical(f"Target type not specified in target {i}. Aborting.")
+        for nb, out_file in find_jobs(input, target.get("path", None), type, config):
+            plan.append(PlanEntry(nb, type, out_file, write_decision(out_file, write_mode), target=i))
+    check_collisions(plan)
+    return plan
+
+
+def check_collisions(plan: Sequence[PlanEntry]) -> None:
+    """Abort if several entries of {plan} write to the same output path."""
+    writers: Dict[Path, PlanEntry] = {}
+    for entry in plan:
+        if entry.output is None:
+            continue
+        key = Path(os.path.normcase(entry.output.absolute()))
+        other = writers.setdefault(key, entry)
+        if other is not entry:
+            critical(f"Output path collision: {entry.output} is written by {other.type} target of "
+                     f"{other.input} and by {entry.type} target of {entry.input}. Aborting.")
+
+
+def log_plan(plan: Sequence[PlanEntry], root: Path) -> None:
+    for entry in plan:
+        output = _relpath(entry.output, root) if entry.output else "-"
+        log(f"{entry.action:9} {entry.type:8} {_relpath(entry.input, root)} -> {output}")
+    counts: Dict[str, int] = {}
+    for entry in plan:
+        counts[entry.action] = counts.get(entry.action, 0) + 1
+    summary = ", ".join(f"{count} {action}" for action, count in counts.items())
+    log(f"Plan contains {len(plan)} conversions ({summary or 'none'})")
+
+
+def write_plan(plan: Sequence[PlanEntry], path: Union[str, Path], root: Path) -> None:
+    """Write {plan} as JSON to {path}. Paths are stored relative to {root}."""
+    data = {"version": PLAN_VERSION, "entries": [entry.to_dict(root) for entry in plan]}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    log(f"Wrote plan with {len(plan)} conversions to {path}")
+
+
+def read_plan(path: Union[str, Path], config: Dict[str, Any]) -> List[PlanEntry]:
+    """
+    Read a plan written by :func:`write_plan`. Paths are resolved relative to
+    the course root and the write decisions are recomputed, as files may have
+    changed since the plan was created.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != PLAN_VERSION:
+        critical(f"Unsupported plan version {data.get('version')} in {path}")
+    root = Path(config["base_path"])
+    plan = [PlanEntry.from_dict(entry, root) for entry in data["entries"]]
+    for entry in plan:
+        entry.action = write_decision(entry.output, config["convert"]["write_mode"])
+    check_collisions(plan)
+    return plan
@@ -1,14 +1,61 @@
+import re
+
 from nbconvert.preprocessors.base import Preprocessor
-from traitlets import Integer
+from traitlets import Bool, Integer, Unicode
 
-from urnc.logger import error, warn
+from urnc.logger import dbg, error, warn
 from urnc.preprocessor import util
 
+# Matches text overwritten by a carriage return, e.g. from progress bars
+CR_PATTERN = re.compile(r".*\r(?=[^\n])")
+
+
+def truncate_text(text: str, max_lines: int, max_bytes: int) -> str:
+    """
+    Shorten {text} to at most {max_lines} lines and about {max_bytes} bytes by
+    keeping its head and tail and inserting a truncation marker in between.
+    """
+    lines = text.splitlines(keepends=True)
+    removed_lines = 0
+    if len(lines) > max_lines:
+        head = max_lines // 2
+        tail = max_lines - head
+        removed_lines = len(lines) - max_lines
+        text = "".join(lines[:head] + lines[len(lines) - tail:])
+        split = len("".join(lines[:head]))
+    else:
+        split = len(text) // 2
+    data = text.encode()
+    removed_bytes = 0
+    if len(data) > max_bytes:
+        removed_bytes = len(data) - max_bytes
+        half = max_bytes // 2
+        head_text = data[:half].decode(errors="ignore")
+        tail_text = data[len(data) - half:].decode(errors="ignore")
+        text = head_text + tail_text
+        split = len(head_text)
+    if not removed_lines and not removed_bytes:
+        return text
+    marker = f"... [output truncated by urnc: {removed_lines} lines, {removed_bytes} bytes removed] ..."
+    head_text = text[:split]
+    if head_text and not head_text.endswith("\n"):
+        head_text += "\n"
+    return f"{head_text}{marker}\n{text[split:]}"
+
 
 class CheckOutputs(Preprocessor):
     max_line_count = Integer(30, help="Maximum number of lines in a cell output").tag(
         config=True
     )
+    truncate = Bool(
+        False, help="Coalesce stream outputs and truncate long text outputs"
+    ).tag(config=True)
+    max_output_lines = Integer(
+        1000, help="Maximum number of lines kept per text output if truncate is set"
+    ).tag(config=True)
+    max_output_size = Unicode(
+        "100 KiB", help="Maximum size of each text output if truncate is set"
+    ).tag(config=True)
 
     def check_output(self, cell) -> bool:
         outputs = cell.get("outputs", [])
@@ -31,7 +78,46 @@ class CheckOutputs(Preprocessor):
                     return False
         return True
 
+    def coalesce_streams(self, cell):
+        """Merge consecutive stream outputs of the same name into one output."""
+        outputs = []
+        for output in cell.get("outputs", []):
+            last = outputs[-1] if outputs else None
+            if (last is not None
+                    and output.output_type == "stream"
+                    and last.output_type == "stream"
+                    and last.name == output.name):
+                last.text = "".join(last.text) + "".join(output.text)
+            else:
+                outputs.append(output)
+        for output in outputs:
+            if output.output_type == "stream" and "\r" in output.text:
+                output.text = CR_PATTERN.sub("", "".join(output.text))
+        cell.outputs = outputs
+
+    def truncate_outputs(self, cell, max_bytes: int):
+        """Truncate stream and text/plain outputs of {cell} in place."""
+        for output in cell.get("outputs", []):
+            if output.output_type == "stream":
+                container, key = output, "text"
+            elif "text/plain" in output.get("data", {}):
+                container, key = output.data, "text/plain"
+            else:
+                continue
+            text = "".join(container[key])
+            truncated = truncate_text(text, self.max_output_lines, max_bytes)
+            if truncated != text:
+                dbg(f"Truncated output of cell {util.cell_preview(cell)}")
+                container[key] = truncated
+
+    def preprocess(self, nb, resources):
+        self._max_bytes = util.string_to_byte(self.max_output_size)
+        return super().preprocess(nb, resources)
+
     def preprocess_cell(self, cell, resources, index):
         if cell.cell_type == "code":
+            if self.truncate:
+                self.coalesce_streams(cell)
+                self.truncate_outputs(cell, self._max_bytes)
             self.check_output(cell)
         return cell, resources
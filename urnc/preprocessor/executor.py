@@ -1,30 +1,226 @@
-from os import chdir, getcwd
-from os.path import dirname
+import hashlib
+from datetime import datetime, timezone
+from os import getcwd
+from os.path import abspath, dirname
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
 from nbformat import NotebookNode
-from papermill.engines import NBClientEngine
 from nbconvert.preprocessors.base import Preprocessor
-from traitlets import List
-from urnc.logger import log
+from jupyter_core.utils import run_sync
+from traitlets import Bool, Float, Integer, List, Unicode
+from urnc.logger import error, log, warn
+from urnc.kernels import (KernelPool, KernelWatchdog, async_execute_notebook,
+                          async_shutdown_kernel, async_start_kernel)
+from urnc.timing import NotebookTiming
+from urnc.preprocessor.util import string_to_byte
+from urnc.util import read_notebook
+
+
+def get_language(nb: NotebookNode) -> Tuple[str, Optional[str]]:
+    """Return kernel name and language of {nb}, as far as recorded in its metadata."""
+    metadata = nb.get("metadata", {})
+    kernelspec = metadata.get("kernelspec", {})
+    language = kernelspec.get("language") or metadata.get("language_info", {}).get("name")
+    return kernelspec.get("name", "python3"), language
+
+
+def same_language(nb: NotebookNode, checkpoint: NotebookNode) -> bool:
+    """Return True if {nb} and {checkpoint} use the same kernel and language."""
+    (kernel, language), (saved_kernel, saved_language) = get_language(nb), get_language(checkpoint)
+    # The language is only recorded in the checkpoint after execution
+    return kernel == saved_kernel and (language is None or saved_language is None or language == saved_language)
+
+
+def find_resume_index(nb: NotebookNode, checkpoint: NotebookNode) -> int:
+    """
+    Return the index of the first cell of {nb} that has to be executed again,
+    i.e. the first cell that was changed, failed or not executed according
+    to {checkpoint}. Returns 0 if kernel or language differ and the number of
+    cells if all cells of {nb} are unchanged. The checkpoint is only complete
+    if it also has no further cells, see :func:`is_complete_checkpoint`.
+    """
+    if not same_language(nb, checkpoint):
+        return 0
+    for index, cell in enumerate(nb.cells):
+        if index >= len(checkpoint.cells):
+            return index
+        saved = checkpoint.cells[index]
+        if saved.cell_type != cell.cell_type or saved.source != cell.source:
+            return index
+        status = saved.get("metadata", {}).get("papermill", {}).get("status")
+        if cell.cell_type == "code" and status != "completed":
+            return index
+        if any(output.output_type == "error" for output in saved.get("outputs", [])):
+            return index
+    return len(nb.cells)
+
+
+def parse_limit(key: str, value: Any) -> Any:
+    """
+    Return execution limit {key} set to {value} in notebook metadata as used
+    by the executor: timeouts as float, `max_memory` as string. Numbers are
+    accepted as memory size in bytes. Raises ValueError or TypeError if
+    {value} is invalid. None disables the limit.
+    """
+    if value is None:
+        return None
+    if key != "max_memory":
+        if isinstance(value, bool):
+            raise TypeError(f"Expected a number of seconds, got {value!r}")
+        return float(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = f"{value} B"
+    value = str(value)
+    string_to_byte(value)
+    return value
+
+
+def is_complete_checkpoint(nb: NotebookNode, checkpoint: NotebookNode, resume_index: int) -> bool:
+    """Return True if {checkpoint} can be used as executed version of {nb} as is."""
+    return resume_index == len(nb.cells) == len(checkpoint.cells)
 
 
 class ExecutePreprocessor(Preprocessor):
     supported_kernels = List(["python3"], help="List of supported kernels").tag(
         config=True
     )
+    kernel_pool_size = Integer(
+        0, help="Number of kernels started ahead of time. 0 disables the pool."
+    ).tag(config=True)
+    warmup_code = Unicode(
+        "", help="Code executed in pooled kernels before they are used"
+    ).tag(config=True)
 
-    def execute_notebook(self, nb: NotebookNode):
+    notebook_timeout = Float(
+        None, allow_none=True, help="Wall time limit per notebook in seconds"
+    ).tag(config=True)
+    cell_timeout = Float(
+        None, allow_none=True, help="Wall time limit per cell in seconds"
+    ).tag(config=True)
+    max_memory = Unicode(
+        None, allow_none=True, help="Memory limit of the kernel process, e.g. '4 GiB'"
+    ).tag(config=True)
+    progress_bar = Bool(True, help="Show a progress bar of executed cells").tag(config=True)
+    checkpoint_dir = Unicode(
+        None, allow_none=True, help="Directory for checkpoints. Checkpoints are disabled if None."
+    ).tag(config=True)
+    resume = Bool(False, help="Resume execution from existing checkpoints").tag(config=True)
+
+    kernel_pool: Optional[KernelPool] = None
+
+    def start_kernel_pool(self, count: Optional[int] = None):
+        """
+        Start the kernel pool if `kernel_pool_size` is set. {count} is the
+        number of notebooks that will be executed, if known, to avoid starting
+        kernels that are never used.
+        """
+        if self.kernel_pool is None and self.kernel_pool_size > 0:
+            self.kernel_pool = KernelPool("python3", self.kernel_pool_size, self.warmup_code, limit=count)
+
+    def shutdown_kernel_pool(self):
+        if self.kernel_pool is not None:
+            self.kernel_pool.shutdown()
+            self.kernel_pool = None
+
+    def get_checkpoint_path(self, filepath: Union[str, Path]) -> Optional[Path]:
+        """Return the checkpoint file for the notebook at {filepath}, if enabled."""
+        if not self.checkpoint_dir or not filepath:
+            return None
+        filepath = Path(filepath).absolute()
+        digest = hashlib.sha256(str(filepath).encode()).hexdigest()[:16]
+        return Path(self.checkpoint_dir).joinpath(f"{filepath.stem}-{digest}.ipynb")
+
+    async def async_execute_notebook(self,
+                                     nb: NotebookNode,
+                                     path: Optional[str] = None,
+                                     checkpoint_path: Optional[Path] = None,
+                                     resources: Optional[Dict[str, Any]] = None):
+        """
+        Execute {nb} in a new kernel with working directory {path} (defaults to
+        the current working directory). The working directory of this process
+        is not changed, so many notebooks can be executed concurrently from
+        one event loop.
+
+        If {checkpoint_path} is given, the notebook is saved there after every
+        cell. If `resume` is set and a checkpoint exists, only the cells from
+        the first changed or failed cell on are executed. Earlier cells keep
+        their saved outputs and are replayed silently to rebuild the kernel
+        state. Notebooks whose checkpoint is complete are not executed at all,
+        which is recorded as resources["execution_cached"].
+        """
+        path = abspath(path or getcwd())
         metadata = nb.get("metadata", {})
         kernelspec = metadata.get("kernelspec", {})
         kernel_name = kernelspec.get("name", "python3")
         if kernel_name not in self.supported_kernels:
             log(f"Kernel {kernel_name} not supported. Skipping execution of notebook.")
             return nb
+        checkpoint, resume_index = None, 0
+        if checkpoint_path is not None:
+            checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+            if self.resume and checkpoint_path.exists():
+                checkpoint = read_notebook(checkpoint_path)
+                resume_index = find_resume_index(nb, checkpoint)
+                if is_complete_checkpoint(nb, checkpoint, resume_index):
+                    log(f"Reusing outputs from checkpoint {checkpoint_path}")
+                    if resources is not None:
+                        resources["execution_cached"] = True
+                    return checkpoint
+                log(f"Resuming execution from cell {resume_index}")
         nb["metadata"]["papermill"] = {}
-        engine = NBClientEngine()
-        ex_nb = engine.execute_notebook(nb, "python3")
+        limits = self.get_limits(nb)
+        self.start_kernel_pool()
+        # Each kernel executes exactly one notebook and is shut down
+        # afterwards, so no state is shared between notebooks.
+        start_time = datetime.now(timezone.utc)
+        if self.kernel_pool is not None:
+            km = await self.kernel_pool.async_acquire()
+        else:
+            km = await async_start_kernel("python3", cwd=path)
+        watchdog = KernelWatchdog(km, limits["notebook_timeout"], limits["max_memory"])
+        if limits["notebook_timeout"] is not None or limits["max_memory"] is not None:
+            watchdog.start()
+        try:
+            ex_nb = await async_execute_notebook(nb, km, cwd=path, watchdog=watchdog,
+                                                 cell_timeout=limits["cell_timeout"],
+                                                 progress_bar=self.progress_bar,
+                                                 checkpoint_path=str(checkpoint_path) if checkpoint_path else None,
+                                                 checkpoint=checkpoint, resume_index=resume_index)
+        finally:
+            watchdog.stop()
+            await async_shutdown_kernel(km)
+        # Include kernel startup in the execution time, as papermill does for
+        # kernels started by itself
+        papermill = ex_nb.metadata.papermill
+        papermill["start_time"] = start_time.isoformat()
+        end_time = datetime.fromisoformat(papermill["end_time"])
+        papermill["duration"] = (end_time - start_time).total_seconds()
         return ex_nb
 
-    def preprocess(self, nb, resources):
+    execute_notebook = run_sync(async_execute_notebook)
+
+    def get_limits(self, nb: NotebookNode) -> Dict[str, Any]:
+        """
+        Return the execution limits for {nb}. Limits can be overridden per
+        notebook in the metadata field ``urnc.limits``.
+        """
+        limits = {
+            "notebook_timeout": self.notebook_timeout,
+            "cell_timeout": self.cell_timeout,
+            "max_memory": self.max_memory,
+        }
+        overrides = nb.get("metadata", {}).get("urnc", {}).get("limits", {})
+        for key, value in overrides.items():
+            if key not in limits:
+                warn(f"Unknown execution limit '{key}' in notebook metadata")
+                continue
+            try:
+                limits[key] = parse_limit(key, value)
+            except (TypeError, ValueError):
+                warn(f"Invalid execution limit {key}={value!r} in notebook metadata. Using {limits[key]!r}.")
+        return limits
+
+    async def async_preprocess(self, nb, resources):
         filename = resources.get("filename", None)
         filepath = resources.get("path", "")
         path = dirname(filepath)
@@ -33,9 +229,13 @@ class ExecutePreprocessor(Preprocessor):
         if filename:
             log(f"Executing notebook {filename}")
 
-        cwd = getcwd()
-        chdir(path)
-        ex_nb = self.execute_notebook(nb)
-        chdir(cwd)
-
+        ex_nb = await self.async_execute_notebook(nb, path, self.get_checkpoint_path(filepath), resources)
+        papermill = ex_nb.get("metadata", {}).get("papermill", {})
+        resources["execution_failed"] = bool(papermill.get("exception", False))
+        if resources["execution_failed"]:
+            error(f"Execution of notebook {filename or filepath} failed")
+        if papermill.get("start_time"):
+            resources["timing"] = NotebookTiming(Path(filepath), ex_nb)
         return ex_nb, resources
+
+    preprocess = run_sync(async_preprocess)
@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import mimetypes
+from typing import Any, Dict, Optional, Tuple
+
+from nbconvert.preprocessors.base import Preprocessor
+from nbformat import NotebookNode
+from traitlets import List, Unicode
+
+from urnc.logger import dbg
+from urnc.preprocessor import util
+
+
+class ExtractOutputs(Preprocessor):
+    """
+    Moves large base64 encoded payloads from code cell outputs and cell
+    attachments into content-addressed files and rewrites the references.
+
+    The extracted files are stored in ``resources["outputs"]`` as a mapping
+    from relative filename (relative to the output notebook) to file content.
+    Identical payloads map to the same filename, so they are only stored once.
+    If ``resources["extract_dir"]`` is set, it is used instead of
+    `output_dir`, e.g. to share one directory between the notebooks of a
+    target.
+    """
+
+    min_size = Unicode(
+        "4 KiB", help="Payloads smaller than this size are kept inline"
+    ).tag(config=True)
+    output_dir = Unicode(
+        "_files", help="Directory for extracted files, relative to the output notebook"
+    ).tag(config=True)
+    mime_types = List(
+        ["image/png", "image/jpeg", "image/gif"],
+        help="Base64 encoded mime types that should be extracted",
+    ).tag(config=True)
+
+    def extract(self, mime: str, b64: Any, resources: Dict[str, Any]) -> Optional[str]:
+        """
+        Store the base64 payload {b64} in resources["outputs"] if it is larger
+        than `min_size`. Returns the relative filename or None if the payload
+        is kept inline.
+        """
+        if isinstance(b64, list):
+            b64 = "".join(b64)
+        if not isinstance(b64, str):
+            return None
+        if len(b64) * 3 // 4 < self._min_bytes:
+            return None
+        try:
+            data = base64.b64decode(b64)
+        except Exception:
+            return None
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        ext = mimetypes.guess_extension(mime) or ".bin"
+        directory = resources.get("extract_dir", self.output_dir)
+        filename = f"{directory}/{digest}{ext}"
+        resources.setdefault("outputs", {})[filename] = data
+        return filename
+
+    def extract_output(self, output: NotebookNode, resources: Dict[str, Any]):
+        """
+        Replace the preferred image of {output} (the first of `mime_types`
+        it contains) by a markdown reference to the extracted file. Other
+        mime types are kept. Outputs that already contain markdown are
+        kept as they are, as the reference would replace it.
+        """
+        data = output.get("data", {})
+        if "text/markdown" in data:
+            return
+        mime = next((mime for mime in self.mime_types if mime in data), None)
+        if mime is None:
+            return
+        filename = self.extract(mime, data[mime], resources)
+        if filename is None:
+            return
+        del data[mime]
+        data["text/markdown"] = f"![{mime}]({filename})"
+        output.get("metadata", {}).pop(mime, None)
+        dbg(f"Extracted {mime} output to {filename}")
+
+    def extract_attachments(self, cell: NotebookNode, resources: Dict[str, Any]):
+        attachments = cell.get("attachments", {})
+        for name in list(attachments.keys()):
+            bundle = attachments[name]
+            for mime, b64 in bundle.items():
+                if mime not in self.mime_types:
+                    continue
+                filename = self.extract(mime, b64, resources)
+                if filename is None:
+                    continue
+                cell.source = cell.source.replace(f"attachment:{name}", filename)
+                del attachments[name]
+                dbg(f"Extracted attachment {name} to {filename}")
+                break
+        if "attachments" in cell and not attachments:
+            del cell["attachments"]
+
+    def preprocess(
+        self, nb: NotebookNode, resources: Dict[str, Any]
+    ) -> Tuple[NotebookNode, Dict[str, Any]]:
+        self._min_bytes = util.string_to_byte(self.min_size)
+        return super().preprocess(nb, resources)
+
+    def preprocess_cell(
+        self, cell: NotebookNode, resources: Dict[str, Any], index: int
+    ) -> Tuple[NotebookNode, Dict[str, Any]]:
+        if cell.cell_type == "code":
+            for output in cell.get("outputs", []):
+                if output.output_type in ("display_data", "execute_result"):
+                    self.extract_output(output, resources)
+        self.extract_attachments(cell, resources)
+        return cell, resources
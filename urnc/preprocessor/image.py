@@ -1,21 +1,22 @@
 import os
 import re
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List, Set
 
 import click
 import requests
 from nbconvert.preprocessors.base import Preprocessor
 from nbformat import NotebookNode
+from traitlets import Float, Integer, observe
 from traitlets.config import Bool, Unicode
 
 import urnc.logger as log
 import urnc.preprocessor.util as util
 
 
-def url_is_valid(url: str) -> bool:
+def url_is_valid(url: str, timeout: Optional[float] = None) -> bool:
     try:
-        response = requests.head(url, allow_redirects=True)
+        response = requests.head(url, allow_redirects=True, timeout=timeout)
         is_valid = response.status_code == 200
         if not is_valid:
             log.warn(f"Request to {url} failed with code {response.status_code}")
@@ -24,6 +25,30 @@ def url_is_valid(url: str) -> bool:
         return False
 
 
+class ImageStat(object):
+    def __init__(self, path: Path):
+        """Result of a single stat call for a local image.
+
+        Attributes:
+            path (Path): Resolved path of the image.
+            exists (bool): Whether the image exists.
+            size (Optional[int]): Size of the image in bytes or None if it could not be determined.
+            notebooks (Set[Path]): Notebooks referencing the image.
+        """
+        self.path = path
+        self.exists = False
+        self.size: Optional[int] = None
+        self.notebooks: Set[Path] = set()
+        try:
+            stat = path.stat()
+            self.exists = True
+            self.size = stat.st_size
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self.exists = path.exists()
+
+
 class ImageChecker(Preprocessor):
     """
     A preprocessor that checks and validates image paths in Jupyter notebooks.
@@ -45,6 +70,74 @@ class ImageChecker(Preprocessor):
     invalid_tag = Unicode(
         None, help="Tag to assign to cells with invalid images", allow_none=True
     ).tag(config=True)
+    summary_count = Integer(
+        10, help="Number of largest images listed by log_summary()"
+    ).tag(config=True)
+    check_remote = Bool(True, help="Check that remote images can be requested").tag(config=True)
+    remote_timeout = Float(
+        10, allow_none=True, help="Timeout in seconds for requests to remote images"
+    ).tag(config=True)
+
+    def __init__(self, **kw: Any):
+        super().__init__(**kw)
+        self.max_size = util.string_to_byte(self.max_image_size)
+        self.image_stats: Dict[Path, ImageStat] = {}
+        self.remote_stats: Dict[str, bool] = {}
+        self._matches: Dict[str, List[Path]] = {}
+        self._fixed = 0
+
+    @observe("max_image_size")
+    def _max_image_size_changed(self, change: Dict[str, Any]):
+        self.max_size = util.string_to_byte(change["new"])
+
+    def stat_image(self, nb_path: Path, image_path: Path) -> ImageStat:
+        """
+        Return the cached stat result for `image_path`, calling `stat()` only
+        on the first reference during the lifetime of this preprocessor.
+        Oversized images are reported once, on their first reference.
+        """
+        resolved = Path(os.path.abspath(image_path))
+        image_stat = self.image_stats.get(resolved)
+        if image_stat is None:
+            image_stat = ImageStat(resolved)
+            self.image_stats[resolved] = image_stat
+            if image_stat.exists and image_stat.size is None:
+                log.warn(f"Could not retrieve the size of image {image_path}.")
+            if image_stat.size is not None and image_stat.size > self.max_size:
+                rel_path = os.path.relpath(resolved, start=self.base_path)
+                log.warn(f"The image {rel_path} is larger than {self.max_image_size}.")
+        image_stat.notebooks.add(nb_path)
+        return image_stat
+
+    def find_files(self, filename: str) -> List[Path]:
+        """Return all files named `filename` below `base_path` (cached per filename)."""
+        if filename not in self._matches:
+            self._matches[filename] = list(Path(self.base_path).rglob(filename))
+        return self._matches[filename]
+
+    def largest_images(self, count: Optional[int] = None) -> List[ImageStat]:
+        """Return the `count` largest local images seen so far, largest first."""
+        stats = [s for s in self.image_stats.values() if s.size is not None]
+        stats.sort(key=lambda s: s.size or 0, reverse=True)
+        return stats[:count] if count is not None else stats
+
+    def log_summary(self):
+        """
+        Log the largest images checked so far, together with the notebooks
+        referencing them. Images exceeding `max_image_size` are listed as
+        warnings, all others as debug messages.
+        """
+        for image_stat in self.largest_images(self.summary_count):
+            size = image_stat.size or 0
+            rel_path = os.path.relpath(image_stat.path, start=self.base_path)
+            notebooks = sorted(
+                os.path.relpath(nb, start=self.base_path) for nb in image_stat.notebooks
+            )
+            msg = f"{rel_path} ({size / 1024:.1f} KiB), used in: {', '.join(notebooks)}"
+            if size > self.max_size:
+                log.warn(f"Oversized image {msg}")
+            else:
+                log.dbg(f"Image {msg}")
 
     def check_image(self, nb_path: Path, src: str) -> Tuple[bool, Optional[str]]:
         """
@@ -63,29 +156,19 @@ class ImageChecker(Preprocessor):
             whether the image is valid, and the second element is a suggested
             new path if applicable.
         """
-        max_size = util.string_to_byte(self.max_image_size)
         if src.startswith("http"):
-            log.warn(f"Remote image detected. {src}")
-            if not url_is_valid(src):
-                return False, None
-            return True, None
+            if src not in self.remote_stats:
+                log.warn(f"Remote image detected. {src}")
+                self.remote_stats[src] = not self.check_remote or url_is_valid(src, self.remote_timeout)
+            return self.remote_stats[src], None
         image_path = nb_path.parent.joinpath(src)
-        if image_path.exists():
-            try:
-                stat = image_path.stat()
-                image_size = stat.st_size
-                if image_size > max_size:
-                    rel_path = os.path.relpath(image_path, start=self.base_path)
-                    log.warn(f"The image {rel_path} is larger than {self.max_image_size} KiB.")
-                return True, None
-            except Exception:
-                log.warn(f"Could not retrieve the size of image {image_path}.")
-                return False, None
+        image_stat = self.stat_image(nb_path, image_path)
+        if image_stat.exists:
+            return image_stat.size is not None, None
 
         log.warn(f"The image {image_path} does not exists.")
         filename = image_path.name
-        base_path = Path(self.base_path)
-        matching_files = list(base_path.rglob(filename))
+        matching_files = self.find_files(filename)
         if len(matching_files) == 1:
             file_path = matching_files[0]
             new_path = os.path.relpath(file_path, start=nb_path.parent).replace(os.sep, "/")
@@ -140,6 +223,7 @@ class ImageChecker(Preprocessor):
             else:
                 util.set_tag(cell, self.invalid_tag)
         if new_path:
+            self._fixed += 1
             log.warn(f"Changing path to {new_path}")
             log.warn(text.replace(src, str(new_path)))
             return text.replace(src, str(new_path))
@@ -160,12 +244,14 @@ class ImageChecker(Preprocessor):
                 key. Example: {"path": "/path/to/notebook"}
 
         Returns:
-            Tuple: The updated notebook and resources.
+            Tuple: The updated notebook and resources. The number of
+            replaced paths is stored in resources["fixed_images"].
         """
         nb_path = Path(resources["path"])
         img_regex = r'<img[^>]*src="([^"]*)"[^>]*>'
         md_img_regex = r"!\[[^\]]*\]\(([^)]*)\)"
 
+        self._fixed = 0
         for cell in nb.cells:
             cell.source = re.sub(
                 img_regex, lambda m: self.replace_src(nb_path, cell, m), cell.source
@@ -173,4 +259,5 @@ class ImageChecker(Preprocessor):
             cell.source = re.sub(
                 md_img_regex, lambda m: self.replace_src(nb_path, cell, m), cell.source
             )
+        resources["fixed_images"] = self._fixed
         return nb, resources
@@ -3,7 +3,9 @@
 import os
 import git
 import datetime
-from typing import Union
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
 
 import urnc
 from urnc.logger import dbg, error, warn, log
@@ -95,7 +97,105 @@ def merge(repo: git.Repo) -> None:
         return
 
 
-def get_repo(git_url: Union[str, None], output: Union[str, None], branch: str, depth: int) -> Union[git.Repo, None]:
+def reference_objects(reference: Union[str, Path]) -> Path:
+    """Return the object directory of the bare or non-bare repository at {reference}."""
+    reference = Path(reference).absolute()
+    if (reference / ".git" / "objects").is_dir():
+        return reference / ".git" / "objects"
+    return reference / "objects"
+
+
+def update_reference(reference: Union[str, Path], git_url: str) -> None:
+    """
+    Create or update the shared object store {reference}, a bare mirror of
+    {git_url}. Objects of a new version are then fetched over the network
+    only once instead of once per clone. Failures (e.g. missing write
+    permissions or a concurrent update by another clone) are only logged, as
+    the clones then fetch the missing objects themselves.
+    """
+    reference = Path(reference)
+    if reference_objects(reference).is_dir():
+        dbg(f"Updating shared object store {reference}")
+        try:
+            git.Repo(reference).git.fetch("--quiet", "origin")
+        except Exception as err:
+            dbg(f"Could not update shared object store {reference}: {err}")
+        return
+    log(f"Creating shared object store {reference}")
+    tmp = None
+    try:
+        reference.parent.mkdir(parents=True, exist_ok=True)
+        # Cloned next to the target and renamed, so concurrent clones never
+        # see a partially created store
+        tmp = tempfile.mkdtemp(prefix=f".{reference.name}.", dir=reference.parent)
+        mirror = git.Repo.clone_from(git_url, tmp, mirror=True)
+        # Clones borrowing objects break if these are ever pruned
+        mirror.git.config("gc.pruneExpire", "never")
+        mirror.close()
+        os.rename(tmp, reference)
+        tmp = None
+    except Exception as err:
+        if not reference_objects(reference).is_dir():
+            warn(f"Could not create shared object store {reference}: {err}")
+    finally:
+        if tmp is not None:
+            urnc.util.rmtree(tmp)
+
+
+def add_alternate(repo: git.Repo, reference: Union[str, Path]) -> None:
+    """Let {repo} use the objects of {reference} (see gitrepository-layout, objects/info/alternates)."""
+    objects = reference_objects(reference)
+    if not objects.is_dir():
+        return
+    alternates = Path(repo.git_dir) / "objects" / "info" / "alternates"
+    lines = alternates.read_text().splitlines() if alternates.exists() else []
+    if str(objects) in lines:
+        return
+    dbg(f"Using objects of {objects}")
+    alternates.parent.mkdir(parents=True, exist_ok=True)
+    alternates.write_text("\n".join(lines + [str(objects)]) + "\n")
+
+
+def fetch(repo: git.Repo, depth: int, filter: Optional[str] = None) -> None:
+    """
+    Fetch from origin without deepening a shallow {repo}. Only the commits
+    after the last fetched commit of the current branch are fetched, i.e.
+    the commits required for merging. Older commits are cut off and removed
+    by the next garbage collection, so the history stays as small as after
+    cloning with {depth}.
+
+    Args:
+        repo (git.Repo): The repository to fetch into.
+        depth (int): The depth used if no commit was fetched before.
+        filter (str): Object filter for a partial fetch, e.g. 'blob:none'.
+    """
+    options = []
+    if filter:
+        options.append(f"--filter={filter}")
+    shallow = depth > 0 and repo.git.rev_parse("--is-shallow-repository") == "true"
+    tracking = f"origin/{repo.active_branch}"
+    last = repo.commit(tracking) if tracking in [ref.name for ref in repo.remote().refs] else None
+    if shallow and last is not None:
+        # Including the last fetched commit, which is the merge base
+        options.append(f"--shallow-since={last.committed_date - 1}")
+    elif shallow:
+        options.append(f"--depth={depth}")
+    repo.git.fetch("origin", *options)
+    if shallow and last is not None and not is_connected(repo, "HEAD", tracking):
+        warn("Local and remote history are not connected. Fetching the full history.")
+        repo.git.fetch("--unshallow", "origin", *options[:-1])
+
+
+def is_connected(repo: git.Repo, a: str, b: str) -> bool:
+    try:
+        repo.git.merge_base(a, b)
+        return True
+    except git.GitCommandError:
+        return False
+
+
+def get_repo(git_url: Union[str, None], output: Union[str, None], branch: str, depth: int,
+             reference: Optional[str] = None, filter: Optional[str] = None) -> Union[git.Repo, None]:
     if not git_url:
         try:
             repo = git.Repo(os.getcwd(), search_parent_directories=True)
@@ -106,8 +206,14 @@ def get_repo(git_url: Union[str, None], output: Union[str, None], branch: str, d
     folder_name: str = output if output is not None else urnc.util.git_folder_name(git_url)
     if not os.path.exists(folder_name):
         log(f"{folder_name} does not exists. Cloning repo {git_url}")
+        options = {}
+        if filter:
+            options["filter"] = filter
+        if reference:
+            update_reference(reference, git_url)
+            options["reference_if_able"] = str(Path(reference).absolute())
         try:
-            git.Repo.clone_from(git_url, folder_name, branch=branch, depth=depth)
+            git.Repo.clone_from(git_url, folder_name, branch=branch, depth=depth, **options)
             log("Cloned successfully.")
             return None
         except Exception as err:
@@ -119,6 +225,9 @@ def get_repo(git_url: Union[str, None], output: Union[str, None], branch: str, d
         if git_url.replace("\\", "/") != repo.remote().url:
             error(f"Remote url {repo.remote().url} of folder {folder_name} does not match {git_url}")
             return None
+        if reference:
+            update_reference(reference, git_url)
+            add_alternate(repo, reference)
         return repo
     except Exception as err:
         error(f"Failed to pull: {folder_name} exists but is not a git repo")
@@ -126,7 +235,8 @@ def get_repo(git_url: Union[str, None], output: Union[str, None], branch: str, d
         return None
 
 
-def pull(git_url: Union[str, None], output: Union[str, None], branch: str, depth: int) -> None:
+def pull(git_url: Union[str, None], output: Union[str, None], branch: str, depth: int,
+         reference: Optional[str] = None, filter: Optional[str] = None) -> None:
     """
     Pull (or clone) a remote git repository and try to automatically merge local changes.
     This is essentially a wrapper around git pull and git merge -Xours.
@@ -135,7 +245,13 @@ def pull(git_url: Union[str, None], output: Union[str, None], branch: str, depth
         git_url (str): The URL of the git repository to pull.
         output (str): The name of the output folder.
         branch (str): The branch to pull.
-        depth (int): The depth for git fetch.
+        depth (int): The depth for git clone. Fetches keep the history shallow, see :func:`fetch`.
+        reference (str): Path of a shared object store (a bare mirror of
+            {git_url}), created or updated before fetching. The repository
+            borrows its objects via git alternates, so only missing objects
+            are fetched and stored.
+        filter (str): Object filter for a partial clone and fetch, e.g.
+            'blob:none'. Omitted blobs are fetched when they are checked out.
 
     Returns:
         None
@@ -145,11 +261,11 @@ def pull(git_url: Union[str, None], output: Union[str, None], branch: str, depth
         This is required because this function may be called from a jupyter postStart hook,
         and exception would prevent the notebook from starting.
     """
-    repo = get_repo(git_url, output, branch, depth)
+    repo = get_repo(git_url, output, branch, depth, reference, filter)
     if not repo:
         return
     log("Fetching changes...")
-    repo.remote().fetch()
+    fetch(repo, depth, filter)
     log("Checking for local untracked files")
     rename_local_untracked(repo)
     log("Restoring locally deleted files")
@@ -167,7 +283,8 @@ def pull(git_url: Union[str, None], output: Union[str, None], branch: str, depth
     log("Done.")
 
 
-def clone(git_url: Union[str, None], output: Union[str, None], branch: str, depth: int) -> None:
+def clone(git_url: Union[str, None], output: Union[str, None], branch: str, depth: int,
+          reference: Optional[str] = None, filter: Optional[str] = None) -> None:
     """
     Pull (or clone) a remote git repository, but only do a fast-forward pull.
 
@@ -175,7 +292,13 @@ def clone(git_url: Union[str, None], output: Union[str, None], branch: str, dept
         git_url (str): The URL of the git repository to pull.
         output (str): The name of the output folder.
         branch (str): The branch to pull.
-        depth (int): The depth for git fetch.
+        depth (int): The depth for git clone. Fetches keep the history shallow, see :func:`fetch`.
+        reference (str): Path of a shared object store (a bare mirror of
+            {git_url}), created or updated before fetching. The repository
+            borrows its objects via git alternates, so only missing objects
+            are fetched and stored.
+        filter (str): Object filter for a partial clone and fetch, e.g.
+            'blob:none'. Omitted blobs are fetched when they are checked out.
 
     Returns:
         None
@@ -185,9 +308,10 @@ def clone(git_url: Union[str, None], output: Union[str, None], branch: str, dept
         This is required because this function may be called from a jupyter postStart hook,
         and exception would prevent the notebook from starting.
     """
-    repo = get_repo(git_url, output, branch, depth)
+    repo = get_repo(git_url, output, branch, depth, reference, filter)
     if not repo:
         return
     log("Pulling...")
-    repo.git.pull("--ff-only")
+    fetch(repo, depth, filter)
+    repo.git.merge("--ff-only", f"origin/{repo.active_branch}")
     log("Done")
@@ -0,0 +1,162 @@
+"""Dependency-aware scheduling of notebook executions"""
+
+import asyncio
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, TypeVar
+
+from jupyter_core.utils import run_sync
+from nbformat import NotebookNode
+
+from urnc.logger import critical, dbg, warn
+
+Node = TypeVar("Node", bound=Hashable)
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def read_dependencies(notebooks: Dict[Path, NotebookNode],
+                      config: Dict[str, Any]) -> Dict[Path, List[Path]]:
+    """
+    Collect the dependencies of {notebooks}, a mapping from notebook path to
+    notebook content.
+
+    Dependencies are declared in the notebook metadata field
+    ``urnc.depends_on`` (paths relative to the notebook) or in the config
+    option ``execute.dependencies`` (paths relative to the course root).
+    Dependencies on notebooks that are not part of {notebooks} are ignored,
+    as their outputs are assumed to exist already.
+
+    Returns:
+        Mapping from notebook path to the paths of the notebooks it depends on.
+    """
+    base_path = Path(config["base_path"])
+    declared: Dict[Path, List[Path]] = defaultdict(list)
+    for path, nb in notebooks.items():
+        urnc_metadata = nb.get("metadata", {}).get("urnc", {})
+        for dep in urnc_metadata.get("depends_on", []):
+            declared[path.resolve()].append(path.parent.joinpath(dep).resolve())
+    for nb_path, deps in (config["execute"]["dependencies"] or {}).items():
+        for dep in deps:
+            declared[base_path.joinpath(nb_path).resolve()].append(base_path.joinpath(dep).resolve())
+
+    resolved = {path.resolve(): path for path in notebooks}
+    dependencies: Dict[Path, List[Path]] = {}
+    for path in notebooks:
+        deps = []
+        for dep in declared.get(path.resolve(), []):
+            if dep not in resolved:
+                dbg(f"Ignoring dependency of {path.name} on {dep}, as it is not executed.")
+                continue
+            if resolved[dep] not in deps:
+                deps.append(resolved[dep])
+        dependencies[path] = deps
+    return dependencies
+
+
+def check_cycles(nodes: Sequence[Node],
+                 dependencies: Dict[Node, List[Node]],
+                 name: Callable[[Node], str] = str):
+    """Abort if the graph given by {nodes} and {dependencies} contains a cycle."""
+    visited: Dict[Node, bool] = {}  # False = on the current path, True = done
+
+    def visit(node: Node, path: List[Node]):
+        state = visited.get(node)
+        if state is True:
+            return
+        if state is False:
+            cycle = path[path.index(node):] + [node]
+            critical("Dependency cycle: " + " -> ".join(name(n) for n in cycle))
+        visited[node] = False
+        path.append(node)
+        for dep in dependencies.get(node, []):
+            visit(dep, path)
+        path.pop()
+        visited[node] = True
+
+    for node in nodes:
+        visit(node, [])
+
+
+async def async_run_graph(nodes: Sequence[Node],
+                          dependencies: Dict[Node, List[Node]],
+                          func: Callable[[Node], Awaitable[bool]],
+                          workers: int = 1,
+                          name: Optional[Callable[[Node], str]] = None) -> Dict[Node, str]:
+    """
+    Await {func} for every node in {nodes}, at most {workers} at a time, such
+    that each node is only processed after all of its {dependencies}
+    succeeded. Ready nodes are started in the order given by {nodes}. All
+    calls run as tasks of the current event loop.
+
+    If {func} returns False for a node, all nodes depending on it (directly or
+    indirectly) are skipped. If {func} raises an exception, no further nodes
+    are started and the exception is re-raised once running calls finished.
+
+    Returns:
+        Mapping from node to its status: 'ok', 'failed' or 'skipped'.
+    """
+    name = name or str
+    workers = max(workers, 1)
+    check_cycles(nodes, dependencies, name)
+    pending = {node: set(dependencies.get(node, [])) for node in nodes}
+    dependents: Dict[Node, List[Node]] = defaultdict(list)
+    for node in nodes:
+        for dep in pending[node]:
+            dependents[dep].append(node)
+    status: Dict[Node, str] = {}
+    running: Dict[asyncio.Future, Node] = {}
+    exception: Optional[BaseException] = None
+
+    def skip(node: Node, cause: Node):
+        if node in status:
+            return
+        warn(f"Skipping {name(node)}, because {name(cause)} failed.")
+        status[node] = SKIPPED
+        for dependent in dependents[node]:
+            skip(dependent, cause)
+
+    while True:
+        if exception is None:
+            started = set(running.values())
+            for node in nodes:
+                if len(running) >= workers:
+                    break
+                if node not in status and node not in started and not pending[node]:
+                    running[asyncio.ensure_future(func(node))] = node
+        if not running:
+            break
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            node = running.pop(future)
+            try:
+                ok = future.result()
+            except BaseException as err:
+                exception = exception or err
+                ok = False
+            status[node] = OK if ok else FAILED
+            for dependent in dependents[node]:
+                if ok:
+                    pending[dependent].discard(node)
+                else:
+                    skip(dependent, node)
+    if exception is not None:
+        raise exception
+    return status
+
+
+def run_graph(nodes: Sequence[Node],
+              dependencies: Dict[Node, List[Node]],
+              func: Callable[[Node], bool],
+              workers: int = 1,
+              name: Optional[Callable[[Node], str]] = None) -> Dict[Node, str]:
+    """
+    Like :func:`async_run_graph`, but for a blocking {func}, which is called
+    in up to {workers} threads.
+    """
+    async def call(node: Node) -> bool:
+        return await asyncio.to_thread(func, node)
+
+    return run_sync(async_run_graph)(nodes, dependencies, call, workers, name)
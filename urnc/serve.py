@@ -0,0 +1,194 @@
+"""Local HTTP server rendering student, solution and clear previews of notebooks on demand"""
+
+import hashlib
+import html
+import mimetypes
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from urnc.convert import Converter
+from urnc.logger import dbg, log
+from urnc.metrics import add, metrics
+from urnc.plan import discover_notebooks
+from urnc.util import Pool
+
+# Format of a preview: 'html' (rendered) or 'ipynb' (converted notebook)
+FORMATS = ("html", "ipynb")
+
+
+class PreviewCache(object):
+    def __init__(self, size: int = 128):
+        """Least recently used previews, keyed on target type, format, path,
+        mtime and content hash of the notebook.
+
+        Attributes:
+            size (int): Maximum number of previews kept.
+        """
+        self.size = size
+        self._entries: "OrderedDict[Tuple[Any, ...], bytes]" = OrderedDict()
+        self._digests: Dict[Path, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.Lock()
+
+    def key(self, type: str, format: str, path: Path) -> Tuple[Any, ...]:
+        """
+        Return the cache key of {path}. The content is only hashed again if
+        mtime or size changed, so unchanged notebooks are not read.
+        """
+        stat = path.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            memo = self._digests.get(path)
+        if memo is None or memo[0] != version:
+            memo = (version, hashlib.sha256(path.read_bytes()).hexdigest())
+            with self._lock:
+                self._digests[path] = memo
+        return (type, format, path, stat.st_mtime_ns, memo[1])
+
+    def read(self, type: str, format: str, path: Path) -> Tuple[Tuple[Any, ...], bytes]:
+        """
+        Read {path} and return its cache key with the content. The key matches
+        the content even if the file changes while it is read, as it is
+        stat-ed before reading.
+        """
+        stat = path.stat()
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._digests[path] = ((stat.st_mtime_ns, stat.st_size), digest)
+        return (type, format, path, stat.st_mtime_ns, digest), data
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            add("urnc_preview_requests", cache="miss" if value is None else "hit")
+        return value
+
+    def put(self, key: Tuple[Any, ...], value: bytes) -> None:
+        with self._lock:
+            # Older versions of the same notebook are never requested again
+            for old in [k for k in self._entries if k[:3] == key[:3]]:
+                del self._entries[old]
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+def html_exporter() -> Any:
+    from nbconvert.exporters.html import HTMLExporter
+    return HTMLExporter()
+
+
+class PreviewServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: Dict[str, Any], root: Path, address: Tuple[str, int], cache_size: int = 128):
+        """
+        Serves previews of the notebooks in {root}. Requests are handled in
+        threads sharing one :class:`urnc.convert.Converter` per target type
+        and a pool of HTML exporters.
+        """
+        super().__init__(address, PreviewHandler)
+        self.config = config
+        self.root = root.resolve()
+        self.converters = {type.value: Converter(config, type) for type in Converter.in_memory_types}
+        self.cache = PreviewCache(cache_size)
+        self.html_exporters = Pool(html_exporter)
+
+    def resolve(self, relpath: str) -> Optional[Path]:
+        """Return the file {relpath} within {root}, or None if it does not exist or is outside."""
+        path = self.root.joinpath(unquote(relpath)).resolve()
+        if path != self.root and self.root not in path.parents:
+            return None
+        if any(part.startswith(".") for part in path.relative_to(self.root).parts):
+            return None
+        return path if path.is_file() else None
+
+    def render(self, type: str, format: str, path: Path) -> bytes:
+        """Return the preview of notebook {path}, from the cache if it did not change."""
+        key = self.cache.key(type, format, path)
+        body = self.cache.get(key)
+        if body is not None:
+            dbg(f"Cache hit for {type} preview of {path}")
+            return body
+        log(f"Rendering {type} preview of {path}")
+        # The file may have changed since the key was computed
+        key, data = self.cache.read(type, format, path)
+        result = self.converters[type].convert(data, path)
+        if format == "ipynb":
+            body = result.notebook.encode()
+        else:
+            with self.html_exporters.acquire() as exporter:
+                body = exporter.from_notebook_node(result.node())[0].encode()
+        self.cache.put(key, body)
+        return body
+
+    def index(self) -> bytes:
+        rows = []
+        for nb in discover_notebooks(self.root, None, self.config):
+            relpath = quote(nb.relative_to(self.root).as_posix())
+            links = " ".join(f'<a href="/{type}/{relpath}">{type}</a>' for type in self.converters)
+            rows.append(f"<li>{html.escape(nb.relative_to(self.root).as_posix())}: {links}</li>")
+        title = html.escape(str(self.config.get("name") or self.root.name))
+        return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{title}</title></head>"
+                f"<body><h1>{title}</h1><ul>{''.join(rows)}</ul></body></html>").encode()
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    server: PreviewServer
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == "/":
+            return self.send(self.server.index(), "text/html; charset=utf-8")
+        if url.path == "/metrics":
+            return self.send(metrics.render().encode(), "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        type, _, relpath = url.path.lstrip("/").partition("/")
+        if type not in self.server.converters:
+            return self.send_error(HTTPStatus.NOT_FOUND, f"Unknown target type '{type}'")
+        path = self.server.resolve(relpath)
+        if path is None:
+            return self.send_error(HTTPStatus.NOT_FOUND, f"File not found: {relpath}")
+        if path.suffix.lower() != ".ipynb":
+            # Images and other files referenced by the notebook
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            return self.send(path.read_bytes(), content_type)
+        format = parse_qs(url.query).get("format", ["html"])[0]
+        if format not in FORMATS:
+            return self.send_error(HTTPStatus.BAD_REQUEST, f"Unknown format '{format}'")
+        try:
+            body = self.server.render(type, format, path)
+        except Exception as err:
+            return self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"Converting {relpath} failed", str(err))
+        content_type = "application/x-ipynb+json" if format == "ipynb" else "text/html; charset=utf-8"
+        self.send(body, content_type)
+
+    def send(self, body: bytes, content_type: str) -> None:
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        dbg(f"{self.address_string()} {format % args}")
+
+
+def serve(config: Dict[str, Any], root: Path, host: str = "127.0.0.1", port: int = 8000,
+          cache_size: int = 128) -> None:
+    """Serve previews of the notebooks in {root} until interrupted."""
+    server = PreviewServer(config, Path(root), (host, port), cache_size)
+    log(f"Serving previews of {server.root} at http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Stopping preview server")
+    finally:
+        server.server_close()
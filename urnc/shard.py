@@ -0,0 +1,168 @@
+"""Partitioning of conversions across several CI jobs (`urnc ci --shard`)"""
+
+import filecmp
+import hashlib
+import io
+import json
+import os
+import tarfile
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from urnc.logger import critical, dbg, log
+
+Shard = Tuple[int, int]
+
+strategies = ("hash", "size")
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse a shard specification like '2/4' into the tuple (2, 4)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}'. Expected format: INDEX/COUNT, e.g. '1/4'.")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{value}'. INDEX must be between 1 and COUNT.")
+    return index, count
+
+
+def relpath(path: Path, root: Path) -> str:
+    return Path(os.path.relpath(path, start=root)).as_posix()
+
+
+def shard_notebooks(notebooks: Sequence[Path],
+                    root: Path,
+                    shard: Shard,
+                    strategy: str = "hash") -> List[Path]:
+    """
+    Return the notebooks of {notebooks} assigned to {shard}.
+
+    The partition only depends on the paths relative to {root} (and on the
+    file sizes for strategy 'size'), so all CI jobs compute the same partition
+    independently of where the course is checked out.
+
+    Args:
+        notebooks: Paths of all notebooks.
+        root: Root directory of the course.
+        shard: Tuple (index, count), with index starting at 1.
+        strategy: 'hash' assigns notebooks by a hash of their path, which
+            keeps assignments stable when notebooks are added or removed.
+            'size' balances the total file size of the shards.
+
+    Returns:
+        The assigned notebooks, in the order given by {notebooks}.
+    """
+    index, count = shard
+    if strategy == "hash":
+        def assign(path: Path) -> int:
+            digest = hashlib.sha1(relpath(path, root).encode("utf-8")).hexdigest()
+            return int(digest, 16) % count
+        assigned = {path: assign(path) for path in notebooks}
+    elif strategy == "size":
+        # Greedy balancing: largest notebooks first, each to the smallest shard
+        sizes = {path: max(path.stat().st_size, 1) for path in notebooks}
+        loads = [0] * count
+        assigned = {}
+        for path in sorted(notebooks, key=lambda p: (-sizes[p], relpath(p, root))):
+            target = min(range(count), key=lambda i: (loads[i], i))
+            assigned[path] = target
+            loads[target] += sizes[path]
+    else:
+        critical(f"Unknown shard strategy '{strategy}'. Supported: {', '.join(strategies)}.")
+    selected = [path for path in notebooks if assigned[path] == index - 1]
+    log(f"Shard {index}/{count}: {len(selected)} of {len(notebooks)} notebooks")
+    return selected
+
+
+def changed_files(original: Path, converted: Path) -> List[str]:
+    """
+    Return the paths (relative to {converted}) of all files in {converted}
+    that do not exist in {original} or differ from it. Hidden directories
+    are skipped.
+    """
+    changed = []
+    for root, dirs, files in os.walk(converted):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for file in sorted(files):
+            path = Path(root).joinpath(file)
+            rel = relpath(path, converted)
+            other = original.joinpath(rel)
+            if not other.is_file() or not filecmp.cmp(path, other, shallow=False):
+                changed.append(rel)
+    return changed
+
+
+def bundle_name(shard: Shard) -> str:
+    return f"shard-{shard[0]}-of-{shard[1]}.tar.gz"
+
+
+def write_bundle(path: Path,
+                 root: Path,
+                 files: Sequence[str],
+                 shard: Shard,
+                 notebooks: Sequence[str]) -> None:
+    """
+    Write the artifact bundle of {shard} to {path}. The bundle is a tar
+    archive containing the {files} (relative to {root}) below 'files/' and a
+    'manifest.json' listing the shard, its {notebooks} and its files.
+    """
+    manifest = {"shard": shard[0], "count": shard[1], "notebooks": list(notebooks), "files": list(files)}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(path, "w:gz") as tar:
+        data = json.dumps(manifest, indent=2).encode("utf-8")
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+        for file in files:
+            tar.add(root.joinpath(file), arcname=f"files/{file}", recursive=False)
+    log(f"Wrote bundle of shard {shard[0]}/{shard[1]} with {len(files)} files to {path}")
+
+
+def read_manifest(path: Path) -> Dict[str, Any]:
+    with tarfile.open(path, "r:gz") as tar:
+        member = tar.extractfile("manifest.json")
+        if member is None:
+            critical(f"Bundle {path} contains no manifest")
+        return json.load(member)
+
+
+def read_bundles(bundle_dir: Union[str, Path]) -> Dict[Path, Dict[str, Any]]:
+    """
+    Read the manifests of all bundles in {bundle_dir} and check that they
+    belong to the same partition and that every shard is present once.
+
+    Returns:
+        Mapping from bundle path to manifest, ordered by shard index.
+    """
+    bundle_dir = Path(bundle_dir)
+    paths = sorted(bundle_dir.glob("*.tar.gz")) if bundle_dir.is_dir() else []
+    if not paths:
+        critical(f"No shard bundles found in {bundle_dir}")
+    manifests = {path: read_manifest(path) for path in paths}
+    counts = {manifest["count"] for manifest in manifests.values()}
+    if len(counts) != 1:
+        critical(f"Bundles in {bundle_dir} belong to different partitions: {sorted(counts)} shards")
+    count = counts.pop()
+    indices = sorted(manifest["shard"] for manifest in manifests.values())
+    if indices != list(range(1, count + 1)):
+        missing = sorted(set(range(1, count + 1)) - set(indices))
+        duplicate = sorted({i for i in indices if indices.count(i) > 1})
+        critical(f"Incomplete shard bundles in {bundle_dir}: missing {missing}, duplicate {duplicate}")
+    return dict(sorted(manifests.items(), key=lambda item: item[1]["shard"]))
+
+
+def extract_bundle(path: Path, target: Path) -> None:
+    """Extract the files of the bundle at {path} into directory {target}."""
+    with tarfile.open(path, "r:gz") as tar:
+        members = []
+        for member in tar.getmembers():
+            if not member.name.startswith("files/"):
+                continue
+            name = member.name[len("files/"):]
+            if not member.isfile() or name.startswith("/") or ".." in Path(name).parts:
+                critical(f"Invalid entry '{member.name}' in bundle {path}")
+            member.name = name
+            members.append(member)
+        dbg(f"Extracting {len(members)} files from {path}")
+        tar.extractall(target, members=members)
@@ -0,0 +1,124 @@
+"""Execution time report based on the timing metadata recorded by papermill"""
+
+import csv
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from nbformat import NotebookNode
+
+from urnc.logger import log
+from urnc.preprocessor.util import cell_preview
+
+
+def _relpath(path: Path, root: Optional[Path]) -> str:
+    return Path(os.path.relpath(path, start=root)).as_posix() if root else str(path)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class CellTiming(object):
+    def __init__(self, index: int, preview: str, start: Optional[str], end: Optional[str],
+                 duration: Optional[float]):
+        """Execution time of a single code cell as recorded by papermill.
+
+        Attributes:
+            index (int): Index of the cell in the notebook.
+            preview (str): Preview of the cell source.
+            start (Optional[str]): ISO timestamp of the start of execution.
+            end (Optional[str]): ISO timestamp of the end of execution.
+            duration (float): Execution time in seconds. 0 if not executed.
+        """
+        self.index = index
+        self.preview = preview
+        self.start = start
+        self.end = end
+        self.duration = duration or 0.0
+
+
+class NotebookTiming(object):
+    def __init__(self, path: Path, nb: NotebookNode):
+        """Execution times of a notebook executed by the execute target.
+
+        Attributes:
+            path (Path): Path of the notebook.
+            start (Optional[str]): ISO timestamp of the start of execution.
+            duration (float): Total execution time in seconds incl. kernel startup.
+            startup (float): Seconds between the start of execution and the start
+                of the first executed cell, i.e. mostly kernel startup and, for
+                resumed notebooks, replaying the cells before the first
+                changed cell.
+            cells (List[CellTiming]): Timings of all code cells. Cells replayed
+                from a checkpoint have no start and a duration of 0.
+        """
+        metadata = nb.get("metadata", {}).get("papermill", {})
+        self.path = path
+        self.start = metadata.get("start_time")
+        self.duration = metadata.get("duration") or 0.0
+        self.cells: List[CellTiming] = []
+        first_start = None
+        for index, cell in enumerate(nb.cells):
+            cell_metadata = cell.get("metadata", {}).get("papermill", {})
+            if first_start is None:
+                first_start = cell_metadata.get("start_time")
+            if cell.cell_type != "code":
+                continue
+            self.cells.append(CellTiming(index, cell_preview(cell), cell_metadata.get("start_time"),
+                                         cell_metadata.get("end_time"), cell_metadata.get("duration")))
+        start, first = _parse_time(self.start), _parse_time(first_start)
+        self.startup = (first - start).total_seconds() if start and first else 0.0
+
+    def to_dict(self, root: Optional[Path] = None) -> Dict[str, Any]:
+        return {
+            "notebook": _relpath(self.path, root),
+            "start": self.start,
+            "duration": self.duration,
+            "startup": self.startup,
+            "cells": [vars(cell) for cell in self.cells],
+        }
+
+
+def log_timing_report(timings: List[NotebookTiming], top: int = 10):
+    """Log the {top} slowest notebooks and code cells of {timings}."""
+    if not timings:
+        return
+    total = sum(t.duration for t in timings)
+    startup = sum(t.startup for t in timings)
+    log(f"Executed {len(timings)} notebooks in {total:.1f}s, thereof {startup:.1f}s kernel startup")
+    log("Slowest notebooks:")
+    for t in sorted(timings, key=lambda t: t.duration, reverse=True)[:top]:
+        log(f"  {t.duration:8.1f}s  {t.path.name} (kernel startup {t.startup:.1f}s)")
+    cells = [(cell, t) for t in timings for cell in t.cells]
+    log("Slowest cells:")
+    for cell, t in sorted(cells, key=lambda c: c[0].duration, reverse=True)[:top]:
+        log(f"  {cell.duration:8.1f}s  {t.path.name} cell {cell.index}: {cell.preview}")
+
+
+def export_timing_report(timings: List[NotebookTiming],
+                         path: Union[str, Path],
+                         root: Optional[Path] = None):
+    """
+    Write {timings} to {path}. Notebook paths are written relative to {root}
+    if given. Files ending in '.json' contain one object per
+    notebook, all other files are written as CSV with one row per code cell.
+    Kernel startup is exported as a separate row with an empty cell index.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix.lower() == ".json":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([t.to_dict(root) for t in timings], f, indent=2)
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["notebook", "cell", "start", "end", "duration", "source"])
+            for t in timings:
+                notebook = _relpath(t.path, root)
+                writer.writerow([notebook, "", t.start, "", t.startup, "<kernel startup>"])
+                for cell in t.cells:
+                    writer.writerow([notebook, cell.index, cell.start, cell.end, cell.duration, cell.preview])
+    log(f"Wrote execution timing report to {path}")
@@ -0,0 +1,193 @@
+"""Structured event log of a run as JSON lines, with nested spans for the run, its phases, notebooks and preprocessors"""
+
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterator, Optional, Union
+
+
+class Tracer(object):
+    def __init__(self, file: IO[str]):
+        """Writes finished spans and events to {file}, one JSON object per line."""
+        self.file = file
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+
+class Span(object):
+    def __init__(self, tracer: Tracer, name: str, kind: str, attrs: Dict[str, Any]):
+        """Part of a run that is written to the trace when it ends.
+
+        Attributes:
+            outcome (str): 'ok', 'error' (if an exception was raised) or any
+                other value set with :meth:`fail`.
+        """
+        self.tracer = tracer
+        self.id = tracer.next_id()
+        self.parent = _current.get()
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.outcome = "ok"
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        """Add {attrs} to the span."""
+        self.attrs.update(attrs)
+
+    def fail(self, outcome: str = "failed", error: Optional[str] = None) -> None:
+        """Mark the span as failed, without raising an exception."""
+        self.outcome = outcome
+        self.error = error
+
+    def __enter__(self) -> "Span":
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self._token = _current.set(self.id)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+        if exc is not None and not (isinstance(exc, SystemExit) and not exc.code):
+            self.outcome = "error"
+            self.error = str(exc) or type(exc).__name__
+        record = {
+            "span": self.id,
+            "parent": self.parent,
+            "kind": self.kind,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "end": round(self.start + duration, 6),
+            "duration": round(duration, 6),
+            "worker": worker_id(),
+            "outcome": self.outcome,
+        }
+        if self.error is not None:
+            record["error"] = self.error
+        if self.attrs:
+            record["attrs"] = self.attrs
+        self.tracer.write(record)
+
+
+class _NoSpan(object):
+    """Returned by :func:`span` while tracing is disabled."""
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def fail(self, outcome: str = "failed", error: Optional[str] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+# Tracer of the current run, None if tracing is disabled
+_tracer: Optional[Tracer] = None
+# Id of the innermost open span. Context variables are copied into asyncio
+# tasks and threads started via asyncio.to_thread, so spans opened there get
+# the correct parent.
+_current: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("urnc_trace_span", default=None)
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def worker_id() -> str:
+    """Return '<pid>/<thread>' or '<pid>/<thread>/<asyncio task>' of the caller."""
+    worker = f"{os.getpid()}/{threading.current_thread().name}"
+    # Not imported here, so the pre-commit hook starts fast
+    asyncio = sys.modules.get("asyncio")
+    try:
+        task = asyncio.current_task() if asyncio else None
+    except RuntimeError:
+        task = None
+    return worker if task is None else f"{worker}/{task.get_name()}"
+
+
+def span(name: str, kind: str, **attrs: Any) -> Union[Span, _NoSpan]:
+    """
+    Return a context manager for span {name} of {kind} (run, phase,
+    notebook, preprocessor). While tracing is disabled, this is a shared
+    object that does nothing.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return Span(_tracer, name, kind, attrs)
+
+
+def event(name: str, message: str, **attrs: Any) -> None:
+    """Write event {name} (e.g. a warning) to the trace, if enabled."""
+    tracer = _tracer
+    if tracer is None:
+        return
+    record = {"event": name, "span": _current.get(), "time": round(time.time(), 6),
+              "worker": worker_id(), "message": message}
+    if attrs:
+        record["attrs"] = attrs
+    tracer.write(record)
+
+
+def traced(func: Callable[..., Any], name: str, kind: str = "preprocessor") -> Callable[..., Any]:
+    """Return {func} wrapped in a span, or {func} itself if tracing is disabled."""
+    if _tracer is None:
+        return func
+
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with span(name, kind):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def export(path: Optional[Union[str, Path]], **attrs: Any) -> Iterator[None]:
+    """
+    Trace the enclosed block as span of kind 'run' and append it to the
+    JSON lines file {path}. Does nothing if {path} is None. {attrs} (e.g.
+    command and course name) are added to the span of the run.
+    """
+    global _tracer
+    if path is None or _tracer is not None:
+        yield
+        return
+    path = Path(path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file = open(path, "a", encoding="utf-8", newline="\n")
+    except OSError as err:
+        from urnc.logger import warn
+        warn(f"Could not write trace to {path}: {err}")
+        yield
+        return
+    attrs = {key: value for key, value in attrs.items() if value is not None}
+    _tracer = Tracer(file)
+    try:
+        with span(attrs.get("command", "run"), "run", **attrs):
+            yield
+    finally:
+        _tracer = None
+        file.close()
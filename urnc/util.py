@@ -4,9 +4,11 @@ import abc
 import filecmp
 import os
 import re
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from types import TracebackType
-from typing import Optional, Union
+from typing import Iterator, List, Optional, Union
 
 import click
 import git
@@ -61,6 +63,16 @@ def dirs_equal(dir1: Union[str, Path],
     return True
 
 
+def get_cache_dir(*parts: str) -> Path:
+    """Return the urnc cache directory, optionally joined with {parts}.
+
+    The cache lives in ``$XDG_CACHE_HOME/urnc`` (or ``~/.cache/urnc`` if
+    ``XDG_CACHE_HOME`` is not set), so it can be persisted between CI runs.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    return Path(base).joinpath("urnc", *parts)
+
+
 def read_notebook(path: Union[str, Path]) -> nbformat.NotebookNode:
     with open(path, encoding="utf-8") as f:
         return nbformat.read(f, as_version=4)
@@ -194,6 +206,36 @@ def get_course_root() -> Path:
     raise Exception("No 'config.yaml' found in the directory hierarchy")
 
 
+class Pool(object):
+    def __init__(self, factory: Callable[[], Any]):
+        """Thread-safe pool of objects that are expensive to create, e.g.
+        nbconvert exporters. Objects are created by {factory} when all others
+        are in use, so at most as many objects exist as threads used them at
+        the same time.
+
+        Example:
+            >>> exporters = Pool(HTMLExporter)
+            >>> with exporters.acquire() as exporter:
+            >>>     body, _ = exporter.from_notebook_node(nb)
+        """
+        self.factory = factory
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        """Borrow an idle object, or a new one if none is idle."""
+        with self._lock:
+            obj = self._idle.pop() if self._idle else None
+        if obj is None:
+            obj = self.factory()
+        try:
+            yield obj
+        finally:
+            with self._lock:
+                self._idle.append(obj)
+
+
 class chdir(abc.ABC):
     """Non thread-safe context manager to change the current working directory.
 